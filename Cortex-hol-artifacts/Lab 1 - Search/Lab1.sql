@@ -123,6 +123,7 @@ CREATE OR REPLACE CORTEX SEARCH SERVICE cortex_search_tutorial_db.public.documen
 /*
 CHECKPOINT - We have a search service,.. Let's put a streamlit app on top of it!
 Navigate to streamlit in the left nav pane
+Paste streamlit_app.py, and add rag_utils.py and vector_index.py next to it (the app imports them)
 */
 
 --notice... the search service didnt require us to make / store vectors? 
@@ -138,6 +139,11 @@ embeddings = SNOWFLAKE.CORTEX.EMBED_TEXT_768('snowflake-arctic-embed-m-v1.5', ch
 --validate
 select * from doc_chunks_vectors;
 
+--new or changed documents in @doc_repo? no need to rebuild the tables above...
+--ingest.py parses, chunks and embeds only the files whose MD5 changed since the last run:
+--  python ingest.py --connection <your connection> --adopt   (first run, tables built above)
+--  python ingest.py --connection <your connection>           (after that)
+
 
 --lets search on it.
 
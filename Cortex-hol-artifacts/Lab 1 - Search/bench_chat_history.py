@@ -0,0 +1,131 @@
+"""
+Benchmark - rerun latency of the Lab 1 chat UI as the conversation grows
+
+Runs the history rendering of streamlit_app.py headless with Streamlit's AppTest at 10, 100
+and 1000 turns and compares:
+    legacy   - every message of an unbounded st.session_state.messages list, rendered on every rerun
+    bounded  - ChatHistory with paginated rendering (render_chat_history)
+
+Also reports the characters of message content each session keeps in st.session_state, and
+first checks that ChatHistory.prompt_messages puts every earlier message either in the prompt or
+in the summary, for every history length up to a few windows and every message count.
+
+Usage:
+    python bench_chat_history.py
+    python bench_chat_history.py --turns 10 100 1000 5000 --reruns 5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from streamlit.testing.v1 import AppTest
+
+LAB_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ANSWER = (
+    "A participant may borrow from their 401(k) account up to the lesser of $50,000 or 50% of "
+    "the vested balance. Loans are repaid through payroll deduction over at most five years, "
+    "unless the loan is used to buy a principal residence.\n\n"
+    "| PDF Title | URL |\n|-------|-----|\n| retirement-plan-trust-agreement-basic-plan-doc.pdf | [Link](#) |\n"
+)
+
+
+def legacy_app(turns, answer):
+    import streamlit as st
+
+    if "messages" not in st.session_state:
+        st.session_state.messages = []
+        for i in range(turns):
+            st.session_state.messages.append({"role": "user", "content": f"Question {i} about loans?"})
+            st.session_state.messages.append({"role": "assistant", "content": answer})
+
+    icons = {"assistant": "❄️", "user": "👤"}
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"], avatar=icons[message["role"]]):
+            st.markdown(message["content"])
+
+
+def bounded_app(turns, answer):
+    import streamlit as st
+
+    from streamlit_app import (
+        HISTORY_MAX_CHARS,
+        HISTORY_MAX_MESSAGES,
+        HISTORY_WINDOW,
+        render_chat_history,
+    )
+    from rag_utils import ChatHistory
+
+    if "chat_history" not in st.session_state:
+        st.session_state.chat_history = ChatHistory(
+            window=HISTORY_WINDOW, max_messages=HISTORY_MAX_MESSAGES, max_chars=HISTORY_MAX_CHARS
+        )
+        st.session_state.history_pages = 1
+        for i in range(turns):
+            st.session_state.chat_history.append("user", f"Question {i} about loans?")
+            st.session_state.chat_history.append("assistant", answer)
+
+    render_chat_history(st.session_state.chat_history, {"assistant": "❄️", "user": "👤"})
+
+
+def check_prompt_coverage(max_turns=30, max_count=10):
+    """
+    Raise AssertionError if a prompt built by ChatHistory.prompt_messages leaves out a message
+    before the latest one (with a summary large enough not to drop any line).
+    """
+    from rag_utils import ChatHistory
+
+    for count in range(1, max_count + 1):
+        history = ChatHistory(summary_chars=10**6)
+        messages = []
+        for i in range(max_turns):
+            for role, content in (("user", f"q{i}?"), ("assistant", f"a{i}.")):
+                history.append(role, content)
+                messages.append(content)
+                prompt = history.prompt_messages(count)
+                summary = prompt[0]["content"].split("\n") if prompt and prompt[0]["role"].startswith("summary") else []
+                covered = [line.split(": ", 1)[1] for line in summary]
+                covered += [m["content"] for m in prompt[1 if summary else 0:]]
+                assert covered == messages[:-1], (count, len(messages), covered)
+
+
+def rerun_latency(script, turns, reruns):
+    at = AppTest.from_function(script, args=(turns, ANSWER), default_timeout=600)
+    at.run()  # first run builds the history
+    timings = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        at.run()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), at
+
+
+def kept_chars(at):
+    if "messages" in at.session_state:
+        return sum(len(m["content"]) for m in at.session_state.messages)
+    history = at.session_state.chat_history
+    return sum(len(m["content"]) for m in history.last(len(history))) + len(history.summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--reruns", type=int, default=3)
+    args = parser.parse_args()
+
+    sys.path.insert(0, LAB_DIR)
+    check_prompt_coverage()
+    print("prompt_messages covers every earlier message")
+    print(f"{'turns':>6}  {'legacy rerun':>13}  {'bounded rerun':>13}  {'legacy state':>13}  {'bounded state':>13}")
+    for turns in args.turns:
+        legacy, legacy_at = rerun_latency(legacy_app, turns, args.reruns)
+        bounded, bounded_at = rerun_latency(bounded_app, turns, args.reruns)
+        print(f"{turns:>6}  {legacy * 1000:>11.1f}ms  {bounded * 1000:>11.1f}ms  "
+              f"{kept_chars(legacy_at):>11,}ch  {kept_chars(bounded_at):>11,}ch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Benchmark - local IVF index (vector_index.py) vs. brute-force NumPy search
+
+Generates synthetic clustered embeddings (a Gaussian mixture, like real text embeddings,
+which are far from uniform) into a memory-mapped float32 file, builds an IVFIndex over them
+and reports, for a sweep of nprobe values, recall@k against exact brute-force search and
+single-query QPS. Also times the build and an incremental add.
+
+Usage:
+    python bench_vector_index.py
+    python bench_vector_index.py --n 100000 --queries 500 --nprobe 4 8 16 32
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from vector_index import IVFIndex, normalize, top_k
+
+
+def mixture_means(dim, topics, subtopics, spread, seed=0):
+    """
+    Means of a two-level Gaussian mixture: topics, and subtopics scattered around each topic.
+    Text embeddings cluster at several scales like this, so nearest neighbours are not all in
+    one cluster and IVF recall depends on nprobe.
+    """
+    rng = np.random.default_rng(seed)
+    topic_means = rng.normal(size=(topics, 1, dim))
+    return (topic_means + spread * rng.normal(size=(topics, subtopics, dim))).reshape(-1, dim).astype(np.float32)
+
+
+def sample(means, count, noise, rng):
+    picks = means[rng.integers(0, len(means), count)]
+    return normalize(picks + noise * rng.normal(size=picks.shape))
+
+
+def synthetic_vectors(path, n, means, noise, seed=0, batch_size=65536):
+    rng = np.random.default_rng(seed)
+    vectors = np.memmap(path, dtype=np.float32, mode="w+", shape=(n, means.shape[1]))
+    for start in range(0, n, batch_size):
+        count = min(batch_size, n - start)
+        vectors[start : start + count] = sample(means, count, noise, rng)
+    vectors.flush()
+    return np.memmap(path, dtype=np.float32, mode="r", shape=(n, means.shape[1]))
+
+
+def brute_force(vectors, queries, k, batch_size=65536):
+    """
+    Exact top-k of every query, scanning the vectors once in batches.
+    """
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(queries), k), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        scores = queries @ np.asarray(vectors[start : start + batch_size]).T
+        merged_scores = np.concatenate([best_scores, scores], axis=1)
+        merged_ids = np.concatenate(
+            [best_ids, np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)], axis=1
+        )
+        keep = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+        best_ids = np.take_along_axis(merged_ids, keep, axis=1)
+    return best_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--topics", type=int, default=100)
+    parser.add_argument("--subtopics", type=int, default=20, help="subtopics per topic")
+    parser.add_argument("--spread", type=float, default=0.3, help="subtopic spread around its topic")
+    parser.add_argument("--noise", type=float, default=1.0, help="vector spread around its subtopic")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=None, help="clusters (default 4 * sqrt(n))")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    parser.add_argument("--brute-force-queries", type=int, default=5,
+                        help="single queries timed for brute-force QPS")
+    parser.add_argument("--add", type=int, default=10_000, help="vectors added incrementally after the build")
+    parser.add_argument("--dir", help="work directory (default: a temporary one, removed afterwards)")
+    args = parser.parse_args()
+
+    work = args.dir or tempfile.mkdtemp(prefix="ivf_bench_")
+    os.makedirs(work, exist_ok=True)
+    try:
+        print(f"{args.n:,} x {args.dim} float32 vectors ({args.n * args.dim * 4 / 2**30:.1f} GiB) in {work}")
+        start = time.perf_counter()
+        means = mixture_means(args.dim, args.topics, args.subtopics, args.spread)
+        vectors = synthetic_vectors(os.path.join(work, "data.f32"), args.n, means, args.noise)
+        print(f"generated in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        index = IVFIndex.build(os.path.join(work, "index"), vectors, nlist=args.nlist)
+        print(f"built IVF index with {len(index.centroids)} clusters in {time.perf_counter() - start:.1f}s")
+
+        queries = sample(means, args.queries, args.noise, np.random.default_rng(1))
+        start = time.perf_counter()
+        truth = brute_force(vectors, queries, args.k)
+        print(f"exact top-{args.k} of {args.queries} queries in one batched scan: {time.perf_counter() - start:.1f}s")
+
+        # Single-query brute force, as the app would run it
+        timings = []
+        for q in queries[: args.brute_force_queries]:
+            start = time.perf_counter()
+            scores = np.concatenate([
+                np.asarray(vectors[s : s + 65536]) @ q for s in range(0, len(vectors), 65536)
+            ])
+            top_k(scores, args.k)
+            timings.append(time.perf_counter() - start)
+        brute_qps = 1 / np.median(timings)
+
+        # Warm the page cache so the first nprobe setting is not charged for reading from disk
+        for q in queries:
+            index.search(q, args.k, max(args.nprobe))
+
+        print(f"\n{'engine':<16} {'recall@' + str(args.k):>10} {'QPS':>10} {'p50 ms':>9}")
+        print(f"{'brute force':<16} {1.0:>10.3f} {brute_qps:>10.1f} {1000 / brute_qps:>9.1f}")
+        for nprobe in args.nprobe:
+            hits, timings = 0, []
+            for q, expected in zip(queries, truth):
+                start = time.perf_counter()
+                positions, _ = index.search(q, args.k, nprobe)
+                timings.append(time.perf_counter() - start)
+                # keys default to the input row number, so they map positions back to ids
+                hits += len(set(index.keys[positions].tolist()) & set(expected.tolist()))
+            p50 = np.median(timings)
+            print(f"{'IVF nprobe=' + str(nprobe):<16} {hits / truth.size:>10.3f} "
+                  f"{len(timings) / sum(timings):>10.1f} {p50 * 1000:>9.1f}")
+
+        if args.add:
+            extra = sample(means, args.add, args.noise, np.random.default_rng(2))
+            start = time.perf_counter()
+            index.add(extra, np.arange(args.n, args.n + args.add))
+            elapsed = time.perf_counter() - start
+            positions, scores = index.search(extra[0], 1, 8)
+            found = index.keys[positions[0]] == args.n
+            print(f"\nadded {args.add:,} vectors in {elapsed:.2f}s "
+                  f"({args.add / elapsed:,.0f}/s); first added vector found: {found}")
+    finally:
+        if not args.dir:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
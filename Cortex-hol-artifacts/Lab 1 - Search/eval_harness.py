@@ -0,0 +1,323 @@
+"""
+Headless evaluation harness for the Lab 1 RAG pipeline
+
+Runs a question set through the same retrieval and prompting steps as streamlit_app.py
+(rag_utils.retrieve -> build_context -> build_prompt -> complete), without Streamlit, on a
+thread pool. Reports per-stage latency percentiles (chat history rewrite, search, completion),
+throughput and the retrieval hit rate: the share of questions whose expected documents made it
+into the prompt.
+
+With --answer-cache every question is also looked up in an empty AnswerCache, near-duplicate
+lookup included, the way the app does by default, so every lookup is a miss.
+--check-cache-overhead runs the set without and with those lookups and fails if the lookups
+make the time to the prompt (everything before the completion) slower at the median or p95: a
+miss must not cost more than the search it runs next to.
+
+Backends:
+    fake       - offline: keyword search over a small built-in corpus and canned completions,
+                 with configurable latencies. Needs no Snowflake account, so it can run in CI.
+    snowflake  - the real cortex search service and Cortex LLM functions, through a Snowflake
+                 connection from your connections.toml.
+
+Question sets are JSONL files, one {"question", "expected": [relative_path, ...], "history":
+[{"role", "content"}, ...]} object per line; "expected" and "history" are optional. Without
+one, a built-in set of plan document questions is used.
+
+Usage:
+    python eval_harness.py
+    python eval_harness.py --concurrency 8 --repeat 20 --speculative
+    python eval_harness.py --backend snowflake --connection my_conn \\
+        --service cortex_search_tutorial_db.public.document_search_service --model llama3.1-8b
+    python eval_harness.py --questions questions.jsonl --max-p95-ms 4000
+    python eval_harness.py --speculative --check-cache-overhead
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rag_utils import (
+    EMBEDDING_MODEL,
+    AnswerCache,
+    build_context,
+    build_prompt,
+    retrieve_and_lookup,
+    timed_call,
+)
+
+DOCS = {
+    "Corbel_EGTRRA_SPD_401(k)_QACA_Roth_Loans_Mandatory_Distributions_Sample.doc": [
+        "Participants may borrow from their 401(k) account. A loan is limited to the lesser of "
+        "$50,000 or 50% of the vested account balance and is repaid through payroll deduction.",
+        "Qualified automatic contribution arrangement (QACA) safe harbor contributions vest "
+        "after two years of service.",
+        "Roth elective deferrals are made on an after-tax basis; qualified Roth distributions "
+        "are tax free.",
+        "Mandatory distributions of vested balances of $1,000 or less may be paid out "
+        "without consent after termination of employment.",
+    ],
+    "Sample Wrap Document_SPD requirements.docx": [
+        "The summary plan description must describe eligibility, benefits and claims procedures "
+        "for each welfare benefit plan wrapped into the document.",
+        "ERISA requires the plan administrator to furnish the SPD within 90 days of coverage.",
+    ],
+    "form-sar-newpension2023.docx": [
+        "The summary annual report lists the plan's total assets, liabilities, net income and "
+        "the insurance contracts held by the pension plan for the plan year.",
+        "Participants have the right to receive a copy of the full annual report on request.",
+    ],
+    "retirement-plan-trust-agreement-basic-plan-doc.pdf": [
+        "The trustee holds plan assets in trust and invests them at the direction of the plan "
+        "administrator or the participants.",
+        "The employer may amend or terminate the plan; on termination all accounts become "
+        "fully vested.",
+    ],
+}
+
+QUESTIONS = [
+    {"question": "How much can I borrow from my 401(k)?",
+     "expected": ["Corbel_EGTRRA_SPD_401(k)_QACA_Roth_Loans_Mandatory_Distributions_Sample.doc"]},
+    {"question": "When do QACA safe harbor contributions vest?",
+     "expected": ["Corbel_EGTRRA_SPD_401(k)_QACA_Roth_Loans_Mandatory_Distributions_Sample.doc"]},
+    {"question": "Are Roth distributions taxed?",
+     "expected": ["Corbel_EGTRRA_SPD_401(k)_QACA_Roth_Loans_Mandatory_Distributions_Sample.doc"]},
+    {"question": "What happens to small balances after I leave the company?",
+     "expected": ["Corbel_EGTRRA_SPD_401(k)_QACA_Roth_Loans_Mandatory_Distributions_Sample.doc"]},
+    {"question": "What must a summary plan description include?",
+     "expected": ["Sample Wrap Document_SPD requirements.docx"]},
+    {"question": "What does the summary annual report show about plan assets?",
+     "expected": ["form-sar-newpension2023.docx"]},
+    {"question": "Who invests the plan assets held in trust?",
+     "expected": ["retirement-plan-trust-agreement-basic-plan-doc.pdf"]},
+    {"question": "And what if the employer terminates it?",
+     "expected": ["retirement-plan-trust-agreement-basic-plan-doc.pdf"],
+     "history": [
+         {"role": "user", "content": "Who holds the retirement plan trust assets?"},
+         {"role": "assistant", "content": "The trustee holds plan assets in trust."},
+     ]},
+]
+
+
+STAGE_ORDER = [
+    "chat history rewrite",
+    "search",
+    "search (raw question)",
+    "search (rewritten)",
+    "answer cache",
+    "completion",
+    "total",
+]
+
+
+def words(text):
+    return set(re.findall(r"[a-z0-9()]+", text.lower()))
+
+
+class FakeBackend:
+    """
+    Offline stand-in for CortexBackend: ranks the built-in corpus by word overlap with the
+    query and answers with canned text, sleeping to simulate service latency.
+    """
+
+    def __init__(self, search_ms=80, complete_ms=900, embed_ms=50, jitter=0.2, seed=0):
+        self.search_ms = search_ms
+        self.complete_ms = complete_ms
+        self.embed_ms = embed_ms
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self.rows = [
+            {
+                "relative_path": path,
+                "file_url": f"https://example.invalid/{path}",
+                "chunk": f"{path}: {text}",
+                "_words": words(text),
+            }
+            for path, chunks in DOCS.items()
+            for text in chunks
+        ]
+
+    def _sleep(self, ms):
+        time.sleep(ms / 1000 * (1 + self._rng.uniform(-self.jitter, self.jitter)))
+
+    def search(self, query, limit):
+        self._sleep(self.search_ms)
+        query_words = words(query)
+        ranked = sorted(self.rows, key=lambda r: len(query_words & r["_words"]), reverse=True)
+        return [{k: v for k, v in r.items() if k != "_words"} for r in ranked[:limit]]
+
+    def embed(self, text):
+        self._sleep(self.embed_ms)
+        return [float(hash(word) % 7) for word in sorted(words(text))][:8] + [1.0] * 8
+
+    def complete(self, model, prompt):
+        self._sleep(self.complete_ms)
+        question = re.search(r"<question>\s*(.*?)\s*</question>", prompt, re.S)
+        history = re.search(r"<chat_history>\s*(.*?)\s*</chat_history>", prompt, re.S)
+        if "generate a query" in prompt:
+            # Rewrite: fold the history into the question
+            return f"{history.group(1) if history else ''} {question.group(1)}".strip()
+        return f"Answer to: {question.group(1) if question else ''}"
+
+
+def snowflake_backend(connection, service):
+    from snowflake.core import Root
+    from snowflake.snowpark import Session
+
+    from snowflake.cortex import EmbedText768
+
+    from rag_utils import CortexBackend
+
+    session = Session.builder.config("connection_name", connection).create()
+    db, schema, name = service.split(".")
+    handle = Root(session).databases[db].schemas[schema].cortex_search_services[name]
+    backend = CortexBackend(session, handle)
+    backend.embed = lambda text: EmbedText768(EMBEDDING_MODEL, text, session=session)
+    return backend
+
+
+def load_questions(path):
+    if not path:
+        return QUESTIONS
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_question(backend, item, args, cache=None):
+    """
+    Run one question through the pipeline and return its stage timings and retrieval outcome.
+    With a cache, the question is also looked up in it as the app does.
+    """
+    start = time.perf_counter()
+    history = item.get("history", [])
+    lookup = None
+    if cache is not None:
+        lookup = lambda query: cache.get((args.model,), query, embed=backend.embed)
+    results, _, timings, _ = retrieve_and_lookup(
+        backend, item["question"], history, args.model, args.limit,
+        lookup=lookup, speculative=args.speculative,
+    )
+    packed = build_context(results, history, item["question"], args.model)
+    prompt = build_prompt(packed["history"], packed["context"], item["question"])
+    _, timings["completion"] = timed_call(backend.complete, args.model, prompt)
+    timings["total"] = time.perf_counter() - start
+
+    cited = {results[i]["relative_path"] for i, _ in packed["chunks"]}
+    expected = set(item.get("expected", []))
+    return {"timings": timings, "hit": bool(cited & expected) if expected else None}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def report(outcomes, elapsed):
+    stages = {}
+    for outcome in outcomes:
+        for stage, seconds in outcome["timings"].items():
+            stages.setdefault(stage, []).append(seconds * 1000)
+
+    summary = {"questions": len(outcomes), "throughput_qps": len(outcomes) / elapsed, "stages": {}}
+    print(f"{'stage':<24} {'n':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for stage, ms in sorted(stages.items(), key=lambda item: STAGE_ORDER.index(item[0])):
+        row = {p: percentile(ms, p) for p in (50, 95, 99)}
+        row["max"] = max(ms)
+        summary["stages"][stage] = row
+        print(f"{stage:<24} {len(ms):>5} {row[50]:>7.1f}ms {row[95]:>7.1f}ms "
+              f"{row[99]:>7.1f}ms {row['max']:>7.1f}ms")
+
+    judged = [o["hit"] for o in outcomes if o["hit"] is not None]
+    summary["hit_rate"] = sum(judged) / len(judged) if judged else None
+    print(f"\n{len(outcomes)} questions in {elapsed:.2f}s: {summary['throughput_qps']:.1f} questions/s")
+    if judged:
+        print(f"retrieval hit rate: {summary['hit_rate']:.0%} ({sum(judged)}/{len(judged)})")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["fake", "snowflake"], default="fake")
+    parser.add_argument("--connection", help="snowflake backend: connection name in connections.toml")
+    parser.add_argument("--service", help="snowflake backend: <database>.<schema>.<search service>")
+    parser.add_argument("--questions", help="JSONL question set (default: built-in set)")
+    parser.add_argument("--model", default="mistral-large2")
+    parser.add_argument("--limit", type=int, default=5, help="search results per query")
+    parser.add_argument("--speculative", action="store_true", help="use speculative retrieval")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5, help="times to run the question set")
+    parser.add_argument("--search-ms", type=float, default=80, help="fake backend: search latency")
+    parser.add_argument("--complete-ms", type=float, default=900, help="fake backend: completion latency")
+    parser.add_argument("--embed-ms", type=float, default=50, help="fake backend: question embedding latency")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="look every question up in an empty answer cache")
+    parser.add_argument("--check-cache-overhead", action="store_true",
+                        help="exit with status 1 if answer cache misses slow the time to the prompt down")
+    parser.add_argument("--cache-overhead-pct", type=float, default=10,
+                        help="slowdown allowed by --check-cache-overhead, in percent")
+    parser.add_argument("--json", help="also write the summary to this file")
+    parser.add_argument("--max-p95-ms", type=float, help="exit with status 1 if the total p95 is above this")
+    parser.add_argument("--min-hit-rate", type=float, help="exit with status 1 if the hit rate is below this")
+    args = parser.parse_args()
+
+    if args.backend == "snowflake":
+        if not (args.connection and args.service):
+            parser.error("--backend snowflake needs --connection and --service")
+        backend = snowflake_backend(args.connection, args.service)
+    else:
+        backend = FakeBackend(
+            search_ms=args.search_ms, complete_ms=args.complete_ms, embed_ms=args.embed_ms
+        )
+
+    questions = load_questions(args.questions) * args.repeat
+    print(f"{len(questions)} questions, {args.backend} backend, model {args.model}, "
+          f"concurrency {args.concurrency}{', speculative' if args.speculative else ''}\n")
+
+    def run_set(with_cache):
+        cache = AnswerCache() if with_cache else None
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            outcomes = list(pool.map(lambda item: run_question(backend, item, args, cache), questions))
+        return report(outcomes, time.perf_counter() - start), outcomes
+
+    def time_to_prompt(outcomes, pct):
+        ms = [(o["timings"]["total"] - o["timings"]["completion"]) * 1000 for o in outcomes]
+        return percentile(ms, pct)
+
+    failed = False
+    if args.check_cache_overhead:
+        print("without answer cache")
+        _, baseline = run_set(False)
+        print("\nwith answer cache misses")
+        summary, outcomes = run_set(True)
+        print()
+        for pct in (50, 95):
+            without_ms, with_ms = time_to_prompt(baseline, pct), time_to_prompt(outcomes, pct)
+            print(f"time to prompt p{pct}: {without_ms:.0f}ms without, "
+                  f"{with_ms:.0f}ms with answer cache misses")
+            if with_ms > without_ms * (1 + args.cache_overhead_pct / 100):
+                print(f"FAIL: answer cache misses slow p{pct} down by more than "
+                      f"{args.cache_overhead_pct:.0f}%")
+                failed = True
+    else:
+        summary, _ = run_set(args.answer_cache)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if args.max_p95_ms is not None and summary["stages"]["total"][95] > args.max_p95_ms:
+        print(f"FAIL: total p95 {summary['stages']['total'][95]:.0f}ms > {args.max_p95_ms:.0f}ms")
+        failed = True
+    if args.min_hit_rate is not None and (summary["hit_rate"] or 0) < args.min_hit_rate:
+        print(f"FAIL: hit rate {summary['hit_rate'] or 0:.0%} < {args.min_hit_rate:.0%}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
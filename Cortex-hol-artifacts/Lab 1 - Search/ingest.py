@@ -0,0 +1,241 @@
+"""
+Incremental ingestion for the Lab 1 document tables
+
+Lab1.sql builds raw_text, doc_chunks and doc_chunks_vectors with CREATE TABLE ... AS over every
+document in the stage, so adding one document means parsing, chunking and embedding the whole
+corpus again. This driver keeps the MD5 of every ingested file in an ingest_state table and,
+on each run, only touches the files of DIRECTORY(@doc_repo) that are new, changed or deleted:
+
+    1. PARSE_DOCUMENT only the new / changed files into raw_text
+    2. re-chunk only those files into doc_chunks (same SPLIT_TEXT_RECURSIVE_CHARACTER settings)
+    3. carry over the embeddings of chunks whose text did not change and EMBED_TEXT_768 only the
+       new chunks into doc_chunks_vectors
+    4. drop the rows of files removed from the stage
+
+Files are processed in batches of --batch-size, one transaction per batch together with its
+ingest_state update, so an interrupted run resumes where it stopped. The cortex search service
+picks the changes up within its TARGET_LAG, and the app's local vector index with "Sync vector
+index".
+
+If the tables were already built with Lab1.sql, run once with --adopt to record the files
+already in raw_text as ingested instead of parsing them again.
+
+Usage:
+    python ingest.py --connection my_conn
+    python ingest.py --connection my_conn --adopt
+    python ingest.py --connection my_conn --dry-run
+"""
+
+import argparse
+import time
+
+from snowflake.snowpark import Session
+
+from rag_utils import CHUNK_OVERLAP, EMBEDDING_MODEL
+
+CHUNK_SIZE = 2000
+FILE_PATTERNS = ("%.pdf", "%.docx")
+
+
+class Ingestor:
+    """
+    Brings raw_text, doc_chunks and doc_chunks_vectors in line with the files of the stage.
+    """
+
+    def __init__(self, session, schema="cortex_search_tutorial_db.public", stage="doc_repo",
+                 batch_size=20, dry_run=False):
+        self.session = session
+        self.schema = schema
+        self.stage = f"@{schema}.{stage}"
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+
+    def sql(self, query, params=None):
+        return self.session.sql(query, params=params).collect()
+
+    def ensure_tables(self):
+        s = self.schema
+        self.sql(f"CREATE TABLE IF NOT EXISTS {s}.ingest_state "
+                 "(relative_path VARCHAR, md5 VARCHAR, ingested_at TIMESTAMP_LTZ)")
+        self.sql(f"CREATE TABLE IF NOT EXISTS {s}.raw_text "
+                 "(relative_path VARCHAR, extracted_layout VARCHAR)")
+        self.sql(f"CREATE TABLE IF NOT EXISTS {s}.doc_chunks "
+                 "(relative_path VARCHAR, file_url VARCHAR, chunk VARCHAR, language VARCHAR)")
+        self.sql(f"CREATE TABLE IF NOT EXISTS {s}.doc_chunks_vectors "
+                 "(relative_path VARCHAR, file_url VARCHAR, chunk VARCHAR, language VARCHAR, "
+                 "embeddings VECTOR(FLOAT, 768))")
+
+    def refresh_stage(self):
+        # Internal stages only update their directory table on refresh
+        self.sql(f"ALTER STAGE {self.stage[1:]} REFRESH")
+
+    def file_filter(self, column):
+        return "(" + " OR ".join(f"{column} ILIKE '{p}'" for p in FILE_PATTERNS) + ")"
+
+    def plan(self):
+        """
+        Return the (relative_path, md5) of new or changed files and the paths of deleted ones.
+        """
+        changed = self.sql(
+            f"SELECT d.relative_path, d.md5 FROM DIRECTORY({self.stage}) d "
+            f"LEFT JOIN {self.schema}.ingest_state s ON s.relative_path = d.relative_path "
+            f"WHERE {self.file_filter('d.relative_path')} AND (s.md5 IS NULL OR s.md5 <> d.md5) "
+            "ORDER BY d.relative_path"
+        )
+        deleted = self.sql(
+            f"SELECT s.relative_path FROM {self.schema}.ingest_state s "
+            f"LEFT JOIN DIRECTORY({self.stage}) d ON d.relative_path = s.relative_path "
+            "WHERE d.relative_path IS NULL"
+        )
+        return [(r[0], r[1]) for r in changed], [r[0] for r in deleted]
+
+    def adopt(self):
+        """
+        Record the files already parsed into raw_text as ingested at their current MD5.
+        """
+        rows = self.sql(
+            f"INSERT INTO {self.schema}.ingest_state "
+            f"SELECT d.relative_path, d.md5, CURRENT_TIMESTAMP() FROM DIRECTORY({self.stage}) d "
+            f"WHERE d.relative_path IN (SELECT DISTINCT relative_path FROM {self.schema}.raw_text) "
+            f"AND d.relative_path NOT IN (SELECT relative_path FROM {self.schema}.ingest_state)"
+        )
+        return rows[0][0]
+
+    def ingest_batch(self, files):
+        """
+        Parse, chunk and embed a batch of (relative_path, md5) files in one transaction.
+
+        Returns:
+            tuple: The number of chunks embedded and the number whose embedding was reused.
+        """
+        s, stage = self.schema, self.stage
+        paths = [path for path, _ in files]
+        in_paths = ", ".join("?" * len(paths))
+
+        # Embeddings of the current chunks, to reuse for chunks whose text did not change. DDL
+        # commits the open transaction in Snowflake, so the temporary table is created first.
+        self.sql(
+            "CREATE OR REPLACE TEMPORARY TABLE ingest_previous_vectors AS "
+            f"SELECT relative_path, chunk, embeddings FROM {s}.doc_chunks_vectors "
+            f"WHERE relative_path IN ({in_paths}) "
+            "QUALIFY ROW_NUMBER() OVER (PARTITION BY relative_path, chunk ORDER BY relative_path) = 1",
+            paths,
+        )
+        self.sql("BEGIN")
+        try:
+            for table in ("raw_text", "doc_chunks", "doc_chunks_vectors"):
+                self.sql(f"DELETE FROM {s}.{table} WHERE relative_path IN ({in_paths})", paths)
+
+            self.sql(
+                f"INSERT INTO {s}.raw_text "
+                "SELECT relative_path, TO_VARCHAR(SNOWFLAKE.CORTEX.PARSE_DOCUMENT("
+                f"'{stage}', relative_path, {{'mode': 'LAYOUT'}}):content) "
+                f"FROM DIRECTORY({stage}) WHERE relative_path IN ({in_paths})",
+                paths,
+            )
+            self.sql(
+                f"INSERT INTO {s}.doc_chunks "
+                f"SELECT relative_path, BUILD_SCOPED_FILE_URL({stage}, relative_path), "
+                "CONCAT(relative_path, ': ', c.value::TEXT), 'English' "
+                f"FROM {s}.raw_text, LATERAL FLATTEN(SNOWFLAKE.CORTEX.SPLIT_TEXT_RECURSIVE_CHARACTER("
+                f"extracted_layout, 'markdown', {CHUNK_SIZE}, {CHUNK_OVERLAP})) c "
+                f"WHERE relative_path IN ({in_paths})",
+                paths,
+            )
+            reused = self.sql(
+                f"INSERT INTO {s}.doc_chunks_vectors "
+                "SELECT c.relative_path, c.file_url, c.chunk, c.language, p.embeddings "
+                f"FROM {s}.doc_chunks c JOIN ingest_previous_vectors p "
+                "ON p.relative_path = c.relative_path AND p.chunk = c.chunk "
+                f"WHERE c.relative_path IN ({in_paths})",
+                paths,
+            )[0][0]
+            embedded = self.sql(
+                f"INSERT INTO {s}.doc_chunks_vectors "
+                "SELECT c.relative_path, c.file_url, c.chunk, c.language, "
+                f"SNOWFLAKE.CORTEX.EMBED_TEXT_768('{EMBEDDING_MODEL}', c.chunk) "
+                f"FROM {s}.doc_chunks c LEFT JOIN ingest_previous_vectors p "
+                "ON p.relative_path = c.relative_path AND p.chunk = c.chunk "
+                f"WHERE c.relative_path IN ({in_paths}) AND p.chunk IS NULL",
+                paths,
+            )[0][0]
+            self.sql(
+                f"MERGE INTO {s}.ingest_state s USING ("
+                "SELECT column1 AS relative_path, column2 AS md5 FROM VALUES "
+                + ", ".join("(?, ?)" for _ in files)
+                + ") f ON s.relative_path = f.relative_path "
+                "WHEN MATCHED THEN UPDATE SET md5 = f.md5, ingested_at = CURRENT_TIMESTAMP() "
+                "WHEN NOT MATCHED THEN INSERT (relative_path, md5, ingested_at) "
+                "VALUES (f.relative_path, f.md5, CURRENT_TIMESTAMP())",
+                [value for item in files for value in item],
+            )
+            self.sql("COMMIT")
+        except Exception:
+            self.sql("ROLLBACK")
+            raise
+        return embedded, reused
+
+    def delete(self, paths):
+        """
+        Drop the rows and ingest state of files removed from the stage.
+        """
+        in_paths = ", ".join("?" * len(paths))
+        self.sql("BEGIN")
+        try:
+            for table in ("raw_text", "doc_chunks", "doc_chunks_vectors", "ingest_state"):
+                self.sql(f"DELETE FROM {self.schema}.{table} WHERE relative_path IN ({in_paths})", paths)
+            self.sql("COMMIT")
+        except Exception:
+            self.sql("ROLLBACK")
+            raise
+
+    def run(self, adopt=False, refresh=True):
+        self.ensure_tables()
+        if refresh:
+            self.refresh_stage()
+        if adopt and not self.dry_run:
+            print(f"adopted {self.adopt()} files already in raw_text")
+
+        changed, deleted = self.plan()
+        print(f"{len(changed)} new or changed files, {len(deleted)} deleted files")
+        if self.dry_run:
+            for path, _ in changed:
+                print(f"  ingest {path}")
+            for path in deleted:
+                print(f"  delete {path}")
+            return
+
+        if deleted:
+            self.delete(deleted)
+        total_embedded = total_reused = 0
+        for start in range(0, len(changed), self.batch_size):
+            batch = changed[start : start + self.batch_size]
+            began = time.perf_counter()
+            embedded, reused = self.ingest_batch(batch)
+            total_embedded += embedded
+            total_reused += reused
+            print(f"  files {start + 1}-{start + len(batch)}: {embedded} chunks embedded, "
+                  f"{reused} reused ({time.perf_counter() - began:.1f}s)")
+        print(f"done: {total_embedded} chunks embedded, {total_reused} embeddings reused")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connection", required=True, help="connection name in connections.toml")
+    parser.add_argument("--schema", default="cortex_search_tutorial_db.public")
+    parser.add_argument("--stage", default="doc_repo")
+    parser.add_argument("--batch-size", type=int, default=20, help="files per transaction")
+    parser.add_argument("--adopt", action="store_true",
+                        help="record files already in raw_text as ingested (first run on Lab1.sql tables)")
+    parser.add_argument("--no-refresh", action="store_true", help="skip ALTER STAGE ... REFRESH")
+    parser.add_argument("--dry-run", action="store_true", help="only list what would be ingested")
+    args = parser.parse_args()
+
+    session = Session.builder.config("connection_name", args.connection).create()
+    Ingestor(session, args.schema, args.stage, args.batch_size, args.dry_run).run(
+        adopt=args.adopt, refresh=not args.no_refresh
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,604 @@
+"""
+Retrieval, prompting and caching steps of the Lab 1 chatbot. They do not depend on Streamlit,
+so they can be shared between browser sessions and run headless (see eval_harness.py).
+"""
+
+import math
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SEARCH_COLUMNS = ["chunk", "file_url", "relative_path"]
+SEARCH_FILTER = {"@and": [{"@eq": {"language": "English"}}]}
+
+# Model used to embed questions for near-duplicate lookup in the answer cache
+EMBEDDING_MODEL = "snowflake-arctic-embed-m-v1.5"
+
+# Prompt size budgets (tokens) per model, well below each model's context window: smaller
+# prompts complete faster and cost less
+MODEL_TOKEN_BUDGETS = {
+    "mistral-large2": 8000,
+    "llama3.1-70b": 8000,
+    "llama3.1-8b": 4000,
+}
+DEFAULT_TOKEN_BUDGET = 4000
+
+# Rough number of characters per token of each model's tokenizer on English text
+CHARS_PER_TOKEN = {
+    "mistral-large2": 3.5,
+    "llama3.1-70b": 4.0,
+    "llama3.1-8b": 4.0,
+}
+
+# Chunk overlap set in SPLIT_TEXT_RECURSIVE_CHARACTER in Lab1.sql, and the shortest repeat
+# treated as overlap rather than coincidence
+CHUNK_OVERLAP = 300
+MIN_OVERLAP = 20
+
+
+def normalize_question(question):
+    """
+    Normalize a question for exact cache lookups: lowercase, collapse whitespace and drop
+    trailing punctuation.
+
+    Args:
+        question (str): The user's question.
+
+    Returns:
+        str: The normalized question.
+    """
+    return re.sub(r"\s+", " ", question).strip().lower().rstrip("?!. ")
+
+
+def format_message(message):
+    return f"{message['role']}: {message['content']}"
+
+
+def format_history(messages):
+    """
+    Render chat messages as "role: content" lines for a prompt.
+    """
+    return "\n".join(format_message(m) for m in messages)
+
+
+class ChatHistory:
+    """
+    Bounded chat history of one session.
+
+    The last `window` messages are kept in a ring buffer for prompts. Messages pushed out of it
+    are folded into a rolling summary of at most `summary_chars` characters, built without an
+    LLM call: the start of each question and the first sentence of each answer. Messages still
+    in the buffer but older than the ones a prompt asks for are summarized the same way when
+    the prompt is built, so no message falls between the summary and the prompt. For display,
+    at most `max_messages` messages and `max_chars` characters of content are kept, so the
+    memory of a session stays bounded however long it runs.
+    """
+
+    def __init__(self, window=11, max_messages=200, max_chars=200_000, summary_chars=2000):
+        self._window = deque(maxlen=window)
+        self._log = deque()
+        self._log_chars = 0
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self.summary_chars = summary_chars
+        self.summary = ""
+        self.total = 0
+
+    def __len__(self):
+        return len(self._log)
+
+    def append(self, role, content):
+        """
+        Add a message to the history.
+        """
+        message = {"role": role, "content": content}
+        if len(self._window) == self._window.maxlen:
+            self._fold_into_summary(self._window[0])
+        self._window.append(message)
+
+        self._log.append(message)
+        self._log_chars += len(content)
+        while len(self._log) > self.max_messages or (
+            self._log_chars > self.max_chars and len(self._log) > 1
+        ):
+            self._log_chars -= len(self._log.popleft()["content"])
+        self.total += 1
+
+    def _fold_into_summary(self, message):
+        self.summary = self._summarize(self.summary, [message])
+
+    def _summarize(self, summary, messages):
+        """
+        Return summary with a line for each of messages added, oldest lines dropped to stay
+        within `summary_chars`.
+        """
+        lines = summary.split("\n") if summary else []
+        for message in messages:
+            text = " ".join(message["content"].split())
+            if message["role"] == "assistant":
+                text = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+            lines.append(f"{message['role']}: {text[:200]}")
+        while len(lines) > 1 and sum(len(l) + 1 for l in lines) > self.summary_chars:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def prompt_messages(self, count):
+        """
+        Return the `count` messages before the latest one, preceded by a summary message of
+        all older turns when there are any.
+
+        Args:
+            count (int): The number of messages, including the latest one, to take from the
+                prompt window.
+
+        Returns:
+            list: The chat messages for the prompt, oldest first.
+        """
+        window = list(self._window)
+        start = max(0, len(window) - count)
+        recent = window[start : len(window) - 1]
+        # Older messages still in the window are summarized along with those already folded
+        summary = self._summarize(self.summary, window[:start])
+        if summary:
+            return [{"role": "summary of earlier turns", "content": summary}] + recent
+        return recent
+
+    def last(self, count):
+        """
+        Return the last `count` messages kept for display, oldest first.
+        """
+        start = max(0, len(self._log) - count)
+        return [self._log[i] for i in range(start, len(self._log))]
+
+
+def estimate_tokens(text, model):
+    """
+    Estimate the number of tokens of text for the given model from its length.
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN.get(model, 4.0))
+
+
+def _overlap(left, right, max_overlap=CHUNK_OVERLAP, min_overlap=MIN_OVERLAP):
+    """
+    Return the length of the longest suffix of left that is also a prefix of right.
+    """
+    for k in range(min(len(left), len(right), max_overlap), min_overlap - 1, -1):
+        if left.endswith(right[:k]):
+            return k
+    return 0
+
+
+def strip_overlap(text, neighbours):
+    """
+    Remove from text the start that repeats the end of a neighbouring chunk and the end that
+    repeats the start of one, as left by the chunk overlap.
+
+    Args:
+        text (str): The chunk text.
+        neighbours (list): The texts of other chunks of the same document.
+
+    Returns:
+        str: The text without the overlapping parts.
+    """
+    start, end = 0, len(text)
+    for other in neighbours:
+        start += _overlap(other, text[start:end])
+        end -= _overlap(text[start:end], other)
+    return text[start:end]
+
+
+def format_context_document(number, text):
+    return f"Context document {number}: {text} \n" + "\n"
+
+
+def _pack_chunks(chunks, model, available):
+    packed, bodies = [], {}
+    for index, (path, text) in enumerate(chunks):
+        # Chunks are stored as "<relative_path>: <text>", keep the prefix out of the comparison
+        prefix = f"{path}: " if text.startswith(f"{path}: ") else ""
+        body = text[len(prefix):]
+        deduped = prefix + strip_overlap(body, bodies.get(path, []))
+        tokens = estimate_tokens(format_context_document(len(packed) + 1, deduped), model)
+        if tokens <= available:
+            packed.append((index, deduped))
+            bodies.setdefault(path, []).append(body)
+            available -= tokens
+    return packed
+
+
+def pack_context(chunks, history, fixed_text, model, budget=None):
+    """
+    Pack ranked chunks and chat history into the prompt token budget of the model. Text a chunk
+    repeats from a higher ranked chunk of the same document is removed. The oldest history
+    messages are dropped first; only when no history is left are the lowest ranked chunks that
+    do not fit left out.
+
+    Args:
+        chunks (list): (relative_path, text) pairs, best match first.
+        history (list): The chat messages, oldest first.
+        fixed_text (str): The rest of the prompt (instructions and question).
+        model (str): The model the prompt is for.
+        budget (int, optional): Overrides the model's token budget.
+
+    Returns:
+        dict: "chunks" as (index into chunks, deduplicated text) pairs, the "history" kept,
+        the estimated prompt "tokens" and the "budget".
+    """
+    budget = budget or MODEL_TOKEN_BUDGETS.get(model, DEFAULT_TOKEN_BUDGET)
+    fixed = estimate_tokens(fixed_text, model)
+    history_tokens = [estimate_tokens(format_message(m), model) for m in history]
+
+    for first in range(len(history) + 1):
+        available = budget - fixed - sum(history_tokens[first:])
+        packed = _pack_chunks(chunks, model, available)
+        if len(packed) == len(chunks):
+            break
+
+    kept_history = history[first:]
+    tokens = fixed + sum(history_tokens[first:]) + sum(
+        estimate_tokens(format_context_document(n + 1, text), model)
+        for n, (_, text) in enumerate(packed)
+    )
+    return {"chunks": packed, "history": kept_history, "tokens": tokens, "budget": budget}
+
+
+class CortexBackend:
+    """
+    Search and completion calls of the pipeline, run against a cortex search service and Cortex
+    LLM functions. Anything with the same search / complete methods (e.g. a fake backend for
+    offline runs) can be passed to retrieve instead.
+    """
+
+    def __init__(self, session, search_service):
+        self.session = session
+        self.search_service = search_service
+
+    def search(self, query, limit):
+        """
+        Run one query against the search service and return the result rows, best match first.
+        """
+        return self.search_service.search(
+            query, columns=SEARCH_COLUMNS, filter=SEARCH_FILTER, limit=limit
+        ).results
+
+    def complete(self, model, prompt):
+        """
+        Generate a completion for the given prompt using the specified model.
+        """
+        from snowflake.cortex import Complete
+
+        return Complete(model, prompt, session=self.session)
+
+
+def timed_call(fn, *args, **kwargs):
+    """
+    Call fn and return its result along with the wall-clock seconds it took.
+    """
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def chat_history_summary_prompt(chat_history, question):
+    """
+    Build the prompt that asks the language model to extend the question with the chat history.
+    """
+    return f"""
+        [INST]
+        Based on the chat history below and the question, generate a query that extend the question
+        with the chat history provided. The query should be in natural language.
+        Answer with only the query. Do not add any explanation.
+
+        <chat_history>
+        {format_history(chat_history)}
+        </chat_history>
+        <question>
+        {question}
+        </question>
+        [/INST]
+    """
+
+
+def rewrite_question(backend, question, chat_history, model):
+    """
+    Rewrite the question with the language model into a standalone query that includes the
+    chat history, and return it along with the seconds the rewrite took.
+    """
+    return timed_call(backend.complete, model, chat_history_summary_prompt(chat_history, question))
+
+
+def merge_results(primary, secondary, limit):
+    """
+    Interleave two result sets, primary first, dropping chunks already taken, and keep at most
+    limit rows.
+    """
+    merged, seen = [], set()
+    for pair in zip(primary, secondary):
+        for r in pair:
+            key = (r.get("relative_path"), r.get("chunk"))
+            if key not in seen:
+                seen.add(key)
+                merged.append(r)
+    shorter = min(len(primary), len(secondary))
+    for r in primary[shorter:] + secondary[shorter:]:
+        key = (r.get("relative_path"), r.get("chunk"))
+        if key not in seen:
+            seen.add(key)
+            merged.append(r)
+    return merged[:limit]
+
+
+def retrieve(backend, question, chat_history, model, limit, speculative=False):
+    """
+    Retrieve the search results for a question. With chat history, the question is first
+    rewritten by the language model to include the history. In speculative mode the raw
+    question is searched while the rewrite is generated, the rewritten query is searched as
+    soon as it lands and both result sets are merged, so the critical path becomes
+    max(rewrite, search) + search instead of rewrite + search.
+
+    Args:
+        backend: The search / complete backend, e.g. CortexBackend.
+        question (str): The user's question.
+        chat_history (list): The chat history messages, oldest first.
+        model (str): The model used to rewrite the question.
+        limit (int): The number of results per search.
+        speculative (bool): Search with the raw question while the rewrite is generated.
+
+    Returns:
+        tuple: The result rows, the rewritten query (None without chat history) and the
+        seconds spent in each stage.
+    """
+    results, rewritten, timings, _ = retrieve_and_lookup(
+        backend, question, chat_history, model, limit, speculative=speculative
+    )
+    return results, rewritten, timings
+
+
+def retrieve_and_lookup(
+    backend, question, chat_history, model, limit, lookup=None, speculative=False
+):
+    """
+    retrieve, also calling lookup (e.g. an answer cache lookup) with the standalone query: the
+    rewritten query, or the question itself without chat history. The lookup runs on the pool
+    next to the search of that query, so a miss adds no latency unless the lookup is slower
+    than the search.
+
+    Args:
+        lookup (callable, optional): Called with the standalone query from a pool thread.
+        The other arguments are those of retrieve.
+
+    Returns:
+        tuple: As for retrieve, followed by the result of lookup (None without one). The lookup
+        time is in the "answer cache" stage.
+    """
+    timings = {}
+    with ThreadPoolExecutor(max_workers=3) as pool:
+
+        def search_and_lookup(query):
+            search = pool.submit(timed_call, backend.search, query, limit)
+            found = pool.submit(timed_call, lookup, query) if lookup else None
+            return search, found
+
+        rewritten, raw_search = None, None
+        if not chat_history:
+            search, found = search_and_lookup(question)
+            results, timings["search"] = search.result()
+        else:
+            if speculative:
+                raw_search = pool.submit(timed_call, backend.search, question, limit)
+            # Generated in this thread, while the raw question is searched in speculative mode
+            rewritten, timings["chat history rewrite"] = rewrite_question(
+                backend, question, chat_history, model
+            )
+            search, found = search_and_lookup(rewritten)
+            if raw_search is None:
+                results, timings["search"] = search.result()
+            else:
+                raw_results, timings["search (raw question)"] = raw_search.result()
+                rewritten_results, timings["search (rewritten)"] = search.result()
+                results = merge_results(rewritten_results, raw_results, limit)
+
+        looked_up = None
+        if found is not None:
+            looked_up, timings["answer cache"] = found.result()
+
+    return results, rewritten, timings, looked_up
+
+
+def build_context(results, chat_history, question, model, search_column="chunk"):
+    """
+    Pack the search results and chat history into the token budget of the model and
+    concatenate the packed chunks into the context string of the prompt.
+
+    Args:
+        results (list): The search result rows, best match first.
+        chat_history (list): The chat history messages, oldest first.
+        question (str): The user's question.
+        model (str): The model the prompt is for.
+        search_column (str): The result column holding the chunk text.
+
+    Returns:
+        dict: The pack_context result plus the "context" string.
+    """
+    packed = pack_context(
+        [(r["relative_path"], r[search_column]) for r in results],
+        chat_history,
+        build_prompt([], "", question),
+        model,
+    )
+    packed["context"] = "".join(
+        format_context_document(i + 1, text) for i, (_, text) in enumerate(packed["chunks"])
+    )
+    return packed
+
+
+def build_prompt(chat_history, prompt_context, user_question):
+    """
+    Format the answer prompt according to the expected input format of the model.
+
+    Args:
+        chat_history (list): The chat history messages to include.
+        prompt_context (str): The context documents.
+        user_question (str): The user's question.
+
+    Returns:
+        str: The prompt for the language model.
+    """
+    return f"""
+            [INST]
+            You are a helpful AI chat assistant with RAG capabilities. When a user asks you a question,
+            you will also be given context provided between <context> and </context> tags. Use that context
+            with the user's chat history provided in the between <chat_history> and </chat_history> tags
+            to provide a summary that addresses the user's question. Ensure the answer is coherent, concise,
+            and directly relevant to the user's question.
+
+            If the user asks a generic question which cannot be answered with the given context or chat_history,
+            just say "I don't know the answer to that question.
+
+            Don't saying things like "according to the provided context".
+
+            <chat_history>
+            {format_history(chat_history)}
+            </chat_history>
+            <context>
+            {prompt_context}
+            </context>
+            <question>
+            {user_question}
+            </question>
+            [/INST]
+            Answer:
+            """
+
+
+class AnswerCache:
+    """
+    LRU + TTL cache of generated answers and their references, shared by all sessions.
+
+    Entries are keyed on a scope (e.g. search service, its data timestamp, model and number of
+    chunks) plus the normalized question. When an embed function is given, a question with no exact
+    match also matches the most similar cached question of the same scope whose cosine
+    similarity is at least the threshold.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, similarity_threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def _expired(self, entry, now):
+        return now - entry["created"] > self.ttl
+
+    def get(self, scope, question, embed=None, similarity_threshold=None):
+        """
+        Look up the cached {"answer", "references"} entry for the question. The question is only
+        embedded, outside the lock, when there is no exact match.
+
+        Args:
+            scope (tuple): The part of the key that must match exactly.
+            question (str): The user's question.
+            embed (callable, optional): Returns the embedding of a question, for near-duplicate
+                lookup.
+            similarity_threshold (float, optional): Overrides the cache-wide threshold.
+
+        Returns:
+            tuple: The cached entry (or None on a miss) and the question embedding (or None
+            when it was not computed), to reuse when storing the answer.
+        """
+        key = (scope, normalize_question(question))
+        threshold = self.similarity_threshold if similarity_threshold is None else similarity_threshold
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, time.monotonic()):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry, None
+            if embed is None:
+                self.misses += 1
+                return None, None
+
+        embedding = embed(question)
+        query = _unit(embedding)
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_score = None, threshold
+            for other_key, other in list(self._entries.items()):
+                if self._expired(other, now):
+                    del self._entries[other_key]
+                    continue
+                if other_key[0] != scope or other["embedding"] is None:
+                    continue
+                score = float(np.dot(query, other["embedding"]))
+                if score >= best_score:
+                    best_key, best_score = other_key, score
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self.near_hits += 1
+                return self._entries[best_key], embedding
+            self.misses += 1
+            return None, embedding
+
+    def put(self, scope, question, answer, references, embedding=None):
+        """
+        Store an answer and its references, evicting the least recently used entry when full.
+
+        Args:
+            scope (tuple): The part of the key that must match exactly.
+            question (str): The user's question.
+            answer (str): The generated answer.
+            references (list): The {"relative_path", "file_url"} rows cited with the answer.
+            embedding (list, optional): The question embedding, for near-duplicate lookup.
+        """
+        key = (scope, normalize_question(question))
+        entry = {
+            "answer": answer,
+            "references": references,
+            "embedding": None if embedding is None else _unit(embedding),
+            "created": time.monotonic(),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate):
+        """
+        Drop every entry whose scope satisfies predicate, e.g. all entries of a service that
+        was refreshed.
+        """
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k[0])]:
+                del self._entries[key]
+
+    def stats(self):
+        """
+        Return the hit, near-duplicate hit and miss counts, the hit ratio and the entry count.
+        """
+        with self._lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.near_hits) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -1,8 +1,24 @@
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
 import streamlit as st
 from snowflake.core import Root # requires snowflake>=0.8.0
-from snowflake.cortex import Complete
+from snowflake.cortex import Complete, EmbedText768
 from snowflake.snowpark.context import get_active_session
 
+from rag_utils import (
+    EMBEDDING_MODEL,
+    AnswerCache,
+    ChatHistory,
+    CortexBackend,
+    build_context,
+    build_prompt,
+    retrieve_and_lookup,
+)
+from vector_index import IVFIndex, LocalIndexBackend, export_table, sync_table
+
 # """"
 # The available models are subject to change. Check the model availability for the REST API:
 # https://docs.snowflake.com/en/user-guide/snowflake-cortex/cortex-llm-rest-api#model-availability
@@ -13,36 +29,164 @@ MODELS = [
     "llama3.1-8b",
 ]
 
+# How long (seconds) cortex search service metadata is shared across sessions before it is reloaded
+SERVICE_METADATA_TTL = 600
+# How long (seconds) the data timestamp of a service, which keys the answer cache, is reused
+DATA_TIMESTAMP_TTL = 15
+
+# Answer cache shared by all sessions: at most this many answers, each kept for this many seconds
+ANSWER_CACHE_MAX_ENTRIES = 512
+ANSWER_CACHE_TTL = 3600
+
+# Chat messages rendered per page, newest first; older pages are rendered on demand
+HISTORY_PAGE_SIZE = 20
+# Messages kept for prompts: the largest "number of messages to use in chat history" option plus
+# the current question. Older messages are folded into a rolling summary
+HISTORY_WINDOW = 11
+# Per-session cap on the chat messages kept in st.session_state
+HISTORY_MAX_MESSAGES = 200
+HISTORY_MAX_CHARS = 200_000
+
+RETRIEVAL_ENGINES = ["Cortex Search service", "Local vector index"]
+# Where the local vector index over doc_chunks_vectors is exported to
+VECTOR_INDEX_DIR = os.path.join(tempfile.gettempdir(), "lab1_vector_index")
+
 def init_messages():
     """
     Initialize the session state for chat messages. If the session state indicates that the
-    conversation should be cleared or if the "messages" key is not in the session state,
-    initialize it as an empty list.
+    conversation should be cleared or if the "chat_history" key is not in the session state,
+    initialize it as an empty ChatHistory.
     """
-    if st.session_state.clear_conversation or "messages" not in st.session_state:
-        st.session_state.messages = []
+    if st.session_state.clear_conversation or "chat_history" not in st.session_state:
+        st.session_state.chat_history = ChatHistory(
+            window=HISTORY_WINDOW, max_messages=HISTORY_MAX_MESSAGES, max_chars=HISTORY_MAX_CHARS
+        )
+        st.session_state.history_pages = 1
 
 
-def init_service_metadata():
+def show_earlier_messages():
+    st.session_state.history_pages += 1
+
+
+def render_chat_history(chat_history, icons):
     """
-    Initialize the session state for cortex search service metadata. Query the available
-    cortex search services from the Snowflake session and store their names and search
-    columns in the session state.
-    """
-    if "service_metadata" not in st.session_state:
-        services = session.sql("SHOW CORTEX SEARCH SERVICES;").collect()
-        service_metadata = []
-        if services:
-            for s in services:
-                svc_name = s["name"]
-                svc_search_col = session.sql(
-                    f"DESC CORTEX SEARCH SERVICE {svc_name};"
-                ).collect()[0]["search_column"]
-                service_metadata.append(
-                    {"name": svc_name, "search_column": svc_search_col}
-                )
+    Display the most recent pages of the chat history. Earlier messages are only rendered when
+    the user asks for them, so reruns do not get slower as the conversation grows.
+
+    Args:
+        chat_history (ChatHistory): The chat history of the session.
+        icons (dict): The avatar of each role.
+    """
+    messages = chat_history.last(st.session_state.history_pages * HISTORY_PAGE_SIZE)
+    hidden = len(chat_history) - len(messages)
+    if hidden:
+        st.button(
+            f"Show {min(hidden, HISTORY_PAGE_SIZE)} earlier messages", on_click=show_earlier_messages
+        )
+    elif chat_history.total > len(chat_history):
+        st.caption(f"{chat_history.total - len(chat_history)} earlier messages are no longer kept")
+
+    for message in messages:
+        with st.chat_message(message["role"], avatar=icons[message["role"]]):
+            st.markdown(message["content"])
+
+
+@st.cache_data(ttl=SERVICE_METADATA_TTL, show_spinner=False)
+def load_service_metadata(_session):
+    """
+    Load the name, search column and data timestamp of every cortex search service. The result is cached
+    process-wide, so all browser sessions share it until SERVICE_METADATA_TTL expires or
+    load_service_metadata.clear() is called.
+
+    Args:
+        _session: The Snowpark session to query with (not part of the cache key).
+
+    Returns:
+        list: A list of {"name", "search_column", "data_timestamp"} dicts, one per service.
+    """
+    services = _session.sql("SHOW CORTEX SEARCH SERVICES;").collect()
+    if not services:
+        return []
+
+    # Newer accounts include the search column in SHOW output, so one query is enough
+    if "search_column" in services[0].as_dict():
+        return [
+            {
+                "name": s["name"],
+                "search_column": s["search_column"],
+                "data_timestamp": str(s.as_dict().get("data_timestamp")),
+            }
+            for s in services
+        ]
+
+    # Otherwise submit every DESC up front so they run concurrently, then collect them
+    jobs = [
+        (s["name"], _session.sql(f"DESC CORTEX SEARCH SERVICE {s['name']};").collect_nowait())
+        for s in services
+    ]
+    described = [(svc_name, job.result()[0].as_dict()) for svc_name, job in jobs]
+    return [
+        {
+            "name": svc_name,
+            "search_column": desc["search_column"],
+            "data_timestamp": str(desc.get("data_timestamp")),
+        }
+        for svc_name, desc in described
+    ]
+
+
+@st.cache_data(ttl=DATA_TIMESTAMP_TTL, show_spinner=False)
+def load_data_timestamp(_session, service):
+    """
+    Load the data timestamp of a cortex search service with a single DESC. Cached process-wide
+    for DATA_TIMESTAMP_TTL only, so a refresh of the service reaches the answer cache within
+    seconds rather than when the service metadata expires.
+
+    Args:
+        _session: The Snowpark session to query with (not part of the cache key).
+        service (str): The name of the cortex search service.
 
-        st.session_state.service_metadata = service_metadata
+    Returns:
+        str: The data timestamp of the service.
+    """
+    desc = _session.sql(f"DESC CORTEX SEARCH SERVICE {service};").collect()[0].as_dict()
+    return str(desc.get("data_timestamp"))
+
+
+@st.cache_resource(show_spinner="Exporting doc_chunks_vectors to the local vector index...")
+def get_vector_index():
+    """
+    Return the local vector index shared by all sessions, exporting doc_chunks_vectors into it
+    the first time.
+    """
+    if os.path.exists(os.path.join(VECTOR_INDEX_DIR, "index.npz")):
+        return IVFIndex(VECTOR_INDEX_DIR)
+    return export_table(session, VECTOR_INDEX_DIR)
+
+
+def sync_vector_index():
+    added = sync_table(get_vector_index(), session)
+    st.toast(f"Added {added} new chunks to the local vector index")
+
+
+@st.cache_resource
+def get_answer_cache():
+    """
+    Return the answer cache shared by all sessions of the app.
+    """
+    return AnswerCache(max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL)
+
+
+def init_service_metadata():
+    """
+    Initialize the session state for cortex search service metadata from the shared cache,
+    along with a name -> search column lookup used when querying a service.
+    """
+    service_metadata = load_service_metadata(session)
+    st.session_state.service_metadata = service_metadata
+    st.session_state.service_search_columns = {
+        s["name"]: s["search_column"] for s in service_metadata
+    }
 
 
 def init_config_options():
@@ -56,11 +200,38 @@ def init_config_options():
         "Select cortex search service:",
         [s["name"] for s in st.session_state.service_metadata],
         key="selected_cortex_search_service",
+        on_change=reset_search_service,
     )
 
+    st.sidebar.radio(
+        "Retrieval engine:",
+        RETRIEVAL_ENGINES,
+        key="retrieval_engine",
+        help="The local vector index searches the doc_chunks_vectors embeddings in the app "
+        "process instead of calling the cortex search service.",
+    )
+    if st.session_state.retrieval_engine == RETRIEVAL_ENGINES[1]:
+        st.sidebar.button(
+            "Sync vector index",
+            on_click=sync_vector_index,
+            help="Add chunks inserted into doc_chunks_vectors since the index was exported.",
+        )
+
+    st.sidebar.button(
+        "Refresh search services",
+        on_click=load_service_metadata.clear,
+        help="Reload the list of cortex search services instead of waiting for the cache to expire.",
+    )
     st.sidebar.button("Clear conversation", key="clear_conversation")
     st.sidebar.toggle("Debug", key="debug", value=False)
     st.sidebar.toggle("Use chat history", key="use_chat_history", value=True)
+    st.sidebar.toggle(
+        "Speculative retrieval",
+        key="speculative_retrieval",
+        value=False,
+        help="Search with the raw question while the chat history rewrite is generated, "
+        "then merge both result sets.",
+    )
 
     with st.sidebar.expander("Advanced options"):
         st.selectbox("Select model:", MODELS, key="model_name")
@@ -78,175 +249,261 @@ def init_config_options():
             min_value=1,
             max_value=10,
         )
+        st.number_input(
+            "Clusters scanned by the local vector index (nprobe)",
+            value=16,
+            key="vector_index_nprobe",
+            min_value=1,
+            max_value=256,
+        )
+        st.toggle("Use answer cache", key="use_answer_cache", value=True)
+        st.slider(
+            "Answer cache similarity threshold",
+            min_value=0.80,
+            max_value=1.00,
+            value=0.95,
+            step=0.01,
+            key="answer_cache_threshold",
+            help="Reuse the answer of a cached question at least this similar. 1.00 only reuses "
+            "answers to the same question.",
+        )
 
     st.sidebar.expander("Session State").write(st.session_state)
 
 
-def query_cortex_search_service(query, columns = [], filter={}):
+@contextmanager
+def timed(stage):
     """
-    Query the selected cortex search service with the given query and retrieve context documents.
-    Display the retrieved context documents in the sidebar if debug mode is enabled. Return the
-    context documents as a string.
+    Add the wall-clock time spent in the block to st.session_state.turn_timings[stage], which
+    holds the latency breakdown of the current question.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(stage, time.perf_counter() - start)
 
-    Args:
-        query (str): The query to search the cortex search service with.
 
-    Returns:
-        str: The concatenated string of context documents.
+def record_timing(stage, seconds):
     """
-    db, schema = session.get_current_database(), session.get_current_schema()
+    Add seconds to st.session_state.turn_timings[stage]. The pipeline steps in rag_utils do not
+    use st, so they return their timings and the script thread records them here.
+    """
+    timings = st.session_state.setdefault("turn_timings", {})
+    timings[stage] = timings.get(stage, 0.0) + seconds
 
-    cortex_search_service = (
-        root.databases[db]
-        .schemas[schema]
-        .cortex_search_services[st.session_state.selected_cortex_search_service]
-    )
 
-    context_documents = cortex_search_service.search(
-        query, columns=columns, filter=filter, limit=st.session_state.num_retrieved_chunks
+def show_turn_timings():
+    """
+    Display how the latency of the last question was split between setup, search, chat history
+    rewrite and completion in the sidebar.
+    """
+    timings = st.session_state.get("turn_timings")
+    if not timings:
+        return
+    # Stages overlap in speculative retrieval, so shares are taken of the wall-clock total
+    total = st.session_state.get("turn_total") or sum(timings.values())
+    st.sidebar.markdown(f"**Latency breakdown** ({total * 1000:.0f} ms total)")
+    if st.session_state.get("turn_ttft") is not None:
+        st.sidebar.markdown(f"Time to first token: {st.session_state.turn_ttft * 1000:.0f} ms")
+    st.sidebar.table(
+        [
+            {"stage": stage, "ms": round(seconds * 1000), "share": f"{seconds / total:.0%}"}
+            for stage, seconds in timings.items()
+        ]
     )
-    results = context_documents.results
 
-    service_metadata = st.session_state.service_metadata
-    search_col = [s["search_column"] for s in service_metadata
-                    if s["name"] == st.session_state.selected_cortex_search_service][0].lower()
 
-    context_str = ""
-    for i, r in enumerate(results):
-        context_str += f"Context document {i+1}: {r[search_col]} \n" + "\n"
+def show_answer_cache_stats():
+    """
+    Display the hit and miss counts of the shared answer cache in the sidebar.
+    """
+    stats = get_answer_cache().stats()
+    st.sidebar.markdown(
+        f"**Answer cache**: {stats['hit_ratio']:.0%} hit ratio "
+        f"({stats['hits']} hits, {stats['near_hits']} near-duplicate hits, "
+        f"{stats['misses']} misses, {stats['entries']} entries)"
+    )
 
-    if st.session_state.debug:
-        st.sidebar.text_area("Context documents", context_str, height=500)
 
-    return context_str, results
+def answer_cache_scope():
+    """
+    Return the part of the answer cache key besides the question. It includes the data
+    timestamp of the search service, so answers are not reused after the service refreshes.
+    """
+    service = st.session_state.selected_cortex_search_service
+    return (
+        service,
+        load_data_timestamp(session, service),
+        st.session_state.model_name,
+        st.session_state.num_retrieved_chunks,
+        st.session_state.retrieval_engine,
+    )
 
 
-def get_chat_history():
+def answer_lookup(scope):
     """
-    Retrieve the chat history from the session state limited to the number of messages specified
-    by the user in the sidebar options.
+    Return the function that looks up a cached answer in the shared answer cache.
+    retrieve_and_lookup calls it with the standalone question (the user's question, rewritten to
+    include the chat history when there is one) on a pool thread, next to the search, so the
+    settings are read here on the script thread.
+
+    Args:
+        scope (tuple): The answer cache scope, from answer_cache_scope.
 
     Returns:
-        list: The list of chat messages from the session state.
+        callable: Returns the cached {"answer", "references"} entry (or None) and the question
+        embedding (or None when near-duplicate lookup is disabled), to reuse when storing the
+        answer.
     """
-    start_index = max(
-        0, len(st.session_state.messages) - st.session_state.num_chat_messages
-    )
-    return st.session_state.messages[start_index : len(st.session_state.messages) - 1]
+    cache = get_answer_cache()
+    # Drop answers of earlier versions of the service
+    cache.invalidate(lambda other: other[0] == scope[0] and other[1] != scope[1])
 
+    threshold = st.session_state.answer_cache_threshold
+    embed = None
+    if threshold < 1.0:
+        embed = lambda text: EmbedText768(EMBEDDING_MODEL, text, session=session)
+    return lambda question: cache.get(scope, question, embed=embed, similarity_threshold=threshold)
 
-def complete(model, prompt):
+
+def reset_search_service():
+    """
+    Drop the memoized cortex search service handle so the next question resolves the newly
+    selected service.
     """
-    Generate a completion for the given prompt using the specified model.
+    st.session_state.pop("search_service_handle", None)
 
-    Args:
-        model (str): The name of the model to use for completion.
-        prompt (str): The prompt to generate a completion for.
+
+def get_search_service():
+    """
+    Return the handle of the selected cortex search service. The current database and schema
+    are looked up once per session and the handle is memoized per selected service, so a
+    question does not pay for those round trips before searching.
 
     Returns:
-        str: The generated completion.
+        CortexSearchServiceResource: The handle of the selected cortex search service.
     """
-    return Complete(model, prompt).replace("$", "\$")
+    selected = st.session_state.selected_cortex_search_service
+    cached = st.session_state.get("search_service_handle")
+    if cached is None or cached[0] != selected:
+        if "current_db_schema" not in st.session_state:
+            st.session_state.current_db_schema = (
+                session.get_current_database(),
+                session.get_current_schema(),
+            )
+        db, schema = st.session_state.current_db_schema
+        handle = root.databases[db].schemas[schema].cortex_search_services[selected]
+        st.session_state.search_service_handle = (selected, handle)
+    return st.session_state.search_service_handle[1]
 
 
-def make_chat_history_summary(chat_history, question):
+def show_context(packed, results, chat_history):
+    """
+    Display the packed context documents and the token estimate in the sidebar.
     """
-    Generate a summary of the chat history combined with the current question to extend the query
-    context. Use the language model to generate this summary.
+    st.sidebar.text_area("Context documents", packed["context"], height=500)
+    st.sidebar.caption(
+        f"Packed {len(packed['chunks'])} of {len(results)} chunks and "
+        f"{len(packed['history'])} of {len(chat_history)} history messages into "
+        f"~{packed['tokens']} of {packed['budget']} tokens"
+    )
 
-    Args:
-        chat_history (str): The chat history to include in the summary.
-        question (str): The current user question to extend with the chat history.
+
+def get_chat_history():
+    """
+    Retrieve the chat history from the session state limited to the number of messages specified
+    by the user in the sidebar options.
 
     Returns:
-        str: The generated summary of the chat history and question.
+        list: The list of chat messages from the session state, preceded by a summary of older
+        turns when there is one.
     """
-    prompt = f"""
-        [INST]
-        Based on the chat history below and the question, generate a query that extend the question
-        with the chat history provided. The query should be in natural language.
-        Answer with only the query. Do not add any explanation.
+    return st.session_state.chat_history.prompt_messages(st.session_state.num_chat_messages)
 
-        <chat_history>
-        {chat_history}
-        </chat_history>
-        <question>
-        {question}
-        </question>
-        [/INST]
+
+def complete_stream(model, prompt):
     """
+    Stream a completion for the given prompt using the specified model. "$" is a single
+    character, so escaping each chunk as it arrives gives the same text as escaping the whole
+    answer.
 
-    summary = complete(st.session_state.model_name, prompt)
+    Args:
+        model (str): The name of the model to use for completion.
+        prompt (str): The prompt to generate a completion for.
+
+    Yields:
+        str: The next chunk of the completion.
+    """
+    for chunk in Complete(model, prompt, stream=True):
+        yield chunk.replace("$", "\$")
 
-    if st.session_state.debug:
-        st.sidebar.text_area(
-            "Chat history summary", summary.replace("$", "\$"), height=150
-        )
 
-    return summary
+def get_backend():
+    """
+    Return the search / complete backend of the selected retrieval engine.
+    """
+    if st.session_state.retrieval_engine == RETRIEVAL_ENGINES[1]:
+        return LocalIndexBackend(
+            session, get_vector_index(), nprobe=st.session_state.vector_index_nprobe
+        )
+    return CortexBackend(session, get_search_service())
 
 
-def create_prompt(user_question):
+def create_prompt(user_question, lookup=None):
     """
     Create a prompt for the language model by combining the user question with context retrieved
-    from the cortex search service and chat history (if enabled). Format the prompt according to
-    the expected input format of the model.
+    from the cortex search service and chat history (if enabled), packed into the token budget
+    of the selected model. The steps themselves live in rag_utils so they can run without
+    Streamlit; this records their timings and shows their output in debug mode.
 
     Args:
         user_question (str): The user's question to generate a prompt for.
+        lookup (callable, optional): The answer cache lookup, from answer_lookup. It runs next
+            to the search, so a follow-up question is looked up by its rewritten form without
+            giving up the speculative retrieval overlap.
 
     Returns:
-        str: The generated prompt for the language model.
-    """
-    if st.session_state.use_chat_history:
-        chat_history = get_chat_history()
-        if chat_history != []:
-            question_summary = make_chat_history_summary(chat_history, user_question)
-            prompt_context, results = query_cortex_search_service(
-                question_summary,
-                columns=["chunk", "file_url", "relative_path"],
-                filter={"@and": [{"@eq": {"language": "English"}}]},
-            )
-        else:
-            prompt_context, results = query_cortex_search_service(
-                user_question,
-                columns=["chunk", "file_url", "relative_path"],
-                filter={"@and": [{"@eq": {"language": "English"}}]},
-            )
+        tuple: The generated prompt for the language model (None when lookup found a cached
+        answer), the result rows it cites, the result of lookup (None without one) and the
+        standalone question.
+    """
+    chat_history = get_chat_history() if st.session_state.use_chat_history else []
+
+    with timed("setup"):
+        backend = get_backend()
+    results, question_summary, timings, found = retrieve_and_lookup(
+        backend,
+        user_question,
+        chat_history,
+        st.session_state.model_name,
+        st.session_state.num_retrieved_chunks,
+        lookup=lookup,
+        speculative=st.session_state.speculative_retrieval,
+    )
+    for stage, seconds in timings.items():
+        record_timing(stage, seconds)
+    standalone = question_summary or user_question
+    if found is not None and found[0] is not None:
+        return None, results, found, standalone
+
+    if st.session_state.retrieval_engine == RETRIEVAL_ENGINES[1]:
+        search_col = "chunk"
     else:
-        prompt_context, results = query_cortex_search_service(
-            user_question,
-            columns=["chunk", "file_url", "relative_path"],
-            filter={"@and": [{"@eq": {"language": "English"}}]},
-        )
-        chat_history = ""
-
-    prompt = f"""
-            [INST]
-            You are a helpful AI chat assistant with RAG capabilities. When a user asks you a question,
-            you will also be given context provided between <context> and </context> tags. Use that context
-            with the user's chat history provided in the between <chat_history> and </chat_history> tags
-            to provide a summary that addresses the user's question. Ensure the answer is coherent, concise,
-            and directly relevant to the user's question.
-
-            If the user asks a generic question which cannot be answered with the given context or chat_history,
-            just say "I don't know the answer to that question.
-
-            Don't saying things like "according to the provided context".
-
-            <chat_history>
-            {chat_history}
-            </chat_history>
-            <context>
-            {prompt_context}
-            </context>
-            <question>
-            {user_question}
-            </question>
-            [/INST]
-            Answer:
-            """
-    return prompt, results
+        search_col = st.session_state.service_search_columns[
+            st.session_state.selected_cortex_search_service
+        ].lower()
+    packed = build_context(results, chat_history, user_question, st.session_state.model_name, search_col)
+
+    if st.session_state.debug:
+        if question_summary is not None:
+            st.sidebar.text_area(
+                "Chat history summary", question_summary.replace("$", "\$"), height=150
+            )
+        show_context(packed, results, chat_history)
+
+    prompt = build_prompt(packed["history"], packed["context"], user_question)
+    return prompt, [results[i] for i, _ in packed["chunks"]], found, standalone
 
 
 def main():
@@ -259,9 +516,7 @@ def main():
     icons = {"assistant": "❄️", "user": "👤"}
 
     # Display chat messages from history on app rerun
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"], avatar=icons[message["role"]]):
-            st.markdown(message["content"])
+    render_chat_history(st.session_state.chat_history, icons)
 
     disable_chat = (
         "service_metadata" not in st.session_state
@@ -269,7 +524,7 @@ def main():
     )
     if question := st.chat_input("Ask a question...", disabled=disable_chat):
         # Add user message to chat history
-        st.session_state.messages.append({"role": "user", "content": question})
+        st.session_state.chat_history.append("user", question)
         # Display user message in chat message container
         with st.chat_message("user", avatar=icons["user"]):
             st.markdown(question.replace("$", "\$"))
@@ -277,21 +532,55 @@ def main():
         # Display assistant response in chat message container
         with st.chat_message("assistant", avatar=icons["assistant"]):
             message_placeholder = st.empty()
+            references_placeholder = st.empty()
             question = question.replace("'", "")
-            prompt, results = create_prompt(question)
+            st.session_state.turn_timings = {}
+            st.session_state.turn_ttft = None
+            turn_start = time.perf_counter()
+            cacheable = st.session_state.use_answer_cache
+            cache_scope = answer_cache_scope() if cacheable else None
             with st.spinner("Thinking..."):
-                generated_response = complete(
-                    st.session_state.model_name, prompt
+                # Follow-up questions are cached by their standalone form, which holds the history
+                prompt, results, found, cache_question = create_prompt(
+                    question, answer_lookup(cache_scope) if cacheable else None
                 )
-                # build references table for citation
-                markdown_table = "###### References \n\n| PDF Title | URL |\n|-------|-----|\n"
-                for ref in results:
-                    markdown_table += f"| {ref['relative_path']} | [Link]({ref['file_url']}) |\n"
-                message_placeholder.markdown(generated_response + "\n\n" + markdown_table)
-
-        st.session_state.messages.append(
-            {"role": "assistant", "content": generated_response}
-        )
+            cached, embedding = found or (None, None)
+            if cached is not None:
+                generated_response, results = cached["answer"], cached["references"]
+
+            # build references table for citation as soon as the search results are known
+            markdown_table = "###### References \n\n| PDF Title | URL |\n|-------|-----|\n"
+            for ref in results:
+                markdown_table += f"| {ref['relative_path']} | [Link]({ref['file_url']}) |\n"
+            references_placeholder.markdown(markdown_table)
+
+            if cached is not None:
+                message_placeholder.markdown(generated_response)
+                st.session_state.turn_ttft = time.perf_counter() - turn_start
+            else:
+                with timed("completion"):
+                    generated_response = ""
+                    for chunk in complete_stream(st.session_state.model_name, prompt):
+                        if st.session_state.turn_ttft is None:
+                            st.session_state.turn_ttft = time.perf_counter() - turn_start
+                        generated_response += chunk
+                        message_placeholder.markdown(generated_response + "▌")
+                    message_placeholder.markdown(generated_response)
+                if cacheable:
+                    references = [
+                        {"relative_path": r["relative_path"], "file_url": r["file_url"]}
+                        for r in results
+                    ]
+                    get_answer_cache().put(
+                        cache_scope, cache_question, generated_response, references, embedding
+                    )
+            st.session_state.turn_total = time.perf_counter() - turn_start
+
+        st.session_state.chat_history.append("assistant", generated_response)
+
+    if st.session_state.debug:
+        show_turn_timings()
+        show_answer_cache_stats()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,468 @@
+"""
+Local approximate nearest neighbour index over the doc_chunks_vectors embeddings of Lab1.sql
+
+An IVF (inverted file) index. Embeddings are L2-normalized, so cosine similarity is a dot
+product, and kept in a memory-mapped float32 matrix on disk, grouped by their nearest k-means
+centroid. A query is scored against the centroids first and then only against the vectors of
+the `nprobe` closest clusters, which are contiguous rows of the matrix. Vectors added after the
+build are appended to the matrix and assigned to their nearest centroid; rebuild() re-clusters
+once they make up a large share of the index.
+
+One index can be shared by concurrent sessions. Everything a search reads lives in an immutable
+IndexState; add() and rebuild() build the next state off to the side and swap it in with a single
+assignment, under a lock that only serializes the writers, so a search always sees keys, vectors
+and offsets of the same version.
+
+Files in the index directory:
+    vectors.f32   - float32 rows, clustered rows first, then rows added since the build
+    index.npz     - centroids, cluster offsets of the clustered rows, cluster of each added row
+                    and the key of every row
+    meta.jsonl    - relative_path, file_url and chunk of every row, in row order ({} without)
+
+index.npz is written last, under a temporary name moved into place, and commits the rows: rows
+of vectors.f32 and meta.jsonl past the ones it counts are left over from an add() that did not
+finish, are ignored when loading and dropped by the next add(). Without index.npz the directory
+holds no index, e.g. after a rebuild() that did not finish, and is exported again.
+"""
+
+import itertools
+import json
+import os
+import threading
+from array import array
+
+import numpy as np
+
+from rag_utils import EMBEDDING_MODEL, CortexBackend
+
+DIM = 768
+VECTOR_TABLE = "doc_chunks_vectors"
+# Rebuild once rows added since the build exceed this share of the index
+REBUILD_RATIO = 0.2
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def top_k(scores, k):
+    """
+    Return the indices of the k highest scores, best first.
+    """
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+def write_index_file(path, **arrays):
+    """Write index.npz of the index directory path atomically"""
+    tmp = os.path.join(path, "index.npz.tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, os.path.join(path, "index.npz"))
+
+
+def kmeans(vectors, nlist, iterations=10, seed=0, batch_size=65536):
+    """
+    Spherical k-means: cluster normalized vectors by cosine similarity.
+
+    Args:
+        vectors (np.ndarray): Normalized (n, dim) float32 training vectors.
+        nlist (int): The number of clusters.
+        iterations (int): The number of assignment / update rounds.
+        seed (int): Seed of the initial centroid sample.
+
+    Returns:
+        np.ndarray: The normalized (nlist, dim) centroids.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(vectors, centroids, batch_size)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        sums = np.zeros_like(centroids)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums[~empty] = np.add.reduceat(vectors[order], starts[~empty], axis=0)
+        # Re-seed empty clusters with random training vectors
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+def assign(vectors, centroids, batch_size=65536):
+    """
+    Return the index of the nearest centroid of every vector.
+    """
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch_size):
+        batch = np.asarray(vectors[start : start + batch_size], dtype=np.float32)
+        labels[start : start + batch_size] = np.argmax(batch @ centroids.T, axis=1)
+    return labels
+
+
+class IndexState:
+    """
+    One version of an IVFIndex: centroids, cluster offsets, added rows, keys, metadata and the
+    memory map of the rows they describe. Never modified once created.
+    """
+
+    def __init__(self, path, centroids, offsets, added_clusters, keys, metadata, meta_bytes=0):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.added_clusters = added_clusters
+        self.keys = keys
+        self.metadata = metadata
+        self.meta_bytes = meta_bytes  # size of the lines of meta.jsonl that metadata was read from
+        self.dim = centroids.shape[1]
+        rows = len(keys)
+        self.vectors = (
+            np.memmap(os.path.join(path, "vectors.f32"), dtype=np.float32, mode="r", shape=(rows, self.dim))
+            if rows
+            else np.empty((0, self.dim), dtype=np.float32)
+        )
+        # Row positions of the added rows of every cluster
+        order = np.argsort(added_clusters, kind="stable")
+        bounds = np.searchsorted(added_clusters[order], np.arange(len(centroids) + 1))
+        positions = order + self.clustered
+        self.added = [positions[bounds[c] : bounds[c + 1]] for c in range(len(centroids))]
+
+    @property
+    def clustered(self):
+        return int(self.offsets[-1])
+
+    @classmethod
+    def load(cls, path):
+        state = np.load(os.path.join(path, "index.npz"))
+        keys = state["keys"]
+        lines = []
+        meta_path = os.path.join(path, "meta.jsonl")
+        if os.path.exists(meta_path):
+            with open(meta_path, "rb") as f:
+                # Lines past the committed rows are left over from an unfinished add
+                lines = list(itertools.islice(f, len(keys)))
+        metadata = [json.loads(line) for line in lines]
+        return cls(
+            path, state["centroids"], state["offsets"], state["added_clusters"], keys, metadata,
+            sum(map(len, lines)),
+        )
+
+
+class IVFIndex:
+    """
+    IVF index stored in a directory. Open an existing one with IVFIndex(path), create one with
+    IVFIndex.build(path, vectors, ...).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._state = IndexState.load(path)
+        self._write_lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._state.keys)
+
+    # The current state; read it once per operation rather than field by field
+    centroids = property(lambda self: self._state.centroids)
+    offsets = property(lambda self: self._state.offsets)
+    added_clusters = property(lambda self: self._state.added_clusters)
+    keys = property(lambda self: self._state.keys)
+    metadata = property(lambda self: self._state.metadata)
+    vectors = property(lambda self: self._state.vectors)
+    dim = property(lambda self: self._state.dim)
+    clustered = property(lambda self: self._state.clustered)
+
+    def _save_state(self, state):
+        write_index_file(
+            self.path,
+            centroids=state.centroids,
+            offsets=state.offsets,
+            added_clusters=state.added_clusters,
+            keys=state.keys,
+        )
+
+    @classmethod
+    def build(cls, path, vectors, keys=None, metadata=None, nlist=None, train_size=65536,
+              iterations=10, seed=0, batch_size=65536):
+        """
+        Cluster the vectors and write a new index to path.
+
+        Args:
+            path (str): The index directory (created if missing, files are overwritten).
+            vectors (np.ndarray): (n, dim) vectors; may be a memmap larger than memory.
+            keys (np.ndarray, optional): An int64 key per vector, e.g. HASH(relative_path, chunk).
+            metadata (list, optional): A JSON-serializable dict per vector, {} by default.
+            nlist (int, optional): The number of clusters, 4 * sqrt(n) by default.
+            train_size (int): The number of vectors sampled to train the centroids.
+
+        Returns:
+            IVFIndex: The new index.
+        """
+        os.makedirs(path, exist_ok=True)
+        n, dim = vectors.shape
+        keys = np.arange(n, dtype=np.int64) if keys is None else np.asarray(keys, dtype=np.int64)
+        nlist = nlist or max(1, min(n, int(4 * np.sqrt(n))))
+
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, min(n, max(train_size, nlist)), replace=False))
+        centroids = kmeans(normalize(vectors[sample]), nlist, iterations, seed, batch_size)
+
+        labels = np.empty(n, dtype=np.int32)
+        for start in range(0, n, batch_size):
+            labels[start : start + batch_size] = assign(
+                normalize(vectors[start : start + batch_size]), centroids, batch_size
+            )
+        order = np.argsort(labels, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))]).astype(np.int64)
+
+        with open(os.path.join(path, "vectors.f32"), "wb") as f:
+            for start in range(0, n, batch_size):
+                wanted = order[start : start + batch_size]
+                rows = np.sort(wanted)
+                # Read in file order, then put the batch back in cluster order
+                batch = normalize(vectors[rows])[np.searchsorted(rows, wanted)]
+                f.write(batch.tobytes())
+        with open(os.path.join(path, "meta.jsonl"), "w") as f:
+            for i in order:
+                f.write(json.dumps({} if metadata is None else metadata[i]) + "\n")
+
+        write_index_file(
+            path,
+            centroids=centroids,
+            offsets=offsets,
+            added_clusters=np.empty(0, dtype=np.int32),
+            keys=keys[order],
+        )
+        return cls(path)
+
+    def add(self, vectors, keys, metadata=None):
+        """
+        Append vectors to the index, each assigned to its nearest centroid.
+
+        Args:
+            vectors (np.ndarray): (n, dim) vectors.
+            keys (np.ndarray): An int64 key per vector.
+            metadata (list, optional): A JSON-serializable dict per vector, {} by default.
+        """
+        vectors = normalize(vectors)
+        if not len(vectors):
+            return
+        metadata = [{} for _ in range(len(vectors))] if metadata is None else list(metadata)
+        if len(metadata) != len(vectors):
+            raise ValueError(f"{len(metadata)} metadata rows for {len(vectors)} vectors")
+        lines = "".join(json.dumps(item) + "\n" for item in metadata).encode()
+        with self._write_lock:
+            old = self._state
+            # Drop the rows of an add that did not commit, then append; the rows mapped by the
+            # current state stay untouched
+            with open(os.path.join(self.path, "vectors.f32"), "ab") as f:
+                f.truncate(len(old.keys) * old.dim * 4)
+                f.write(vectors.tobytes())
+            with open(os.path.join(self.path, "meta.jsonl"), "ab") as f:
+                f.truncate(old.meta_bytes)
+                f.write(lines)
+            state = IndexState(
+                self.path,
+                old.centroids,
+                old.offsets,
+                np.concatenate([old.added_clusters, assign(vectors, old.centroids)]),
+                np.concatenate([old.keys, np.asarray(keys, dtype=np.int64)]),
+                old.metadata + metadata,
+                old.meta_bytes + len(lines),
+            )
+            # Commits the new rows
+            self._save_state(state)
+            self._state = state
+
+    @property
+    def needs_rebuild(self):
+        state = self._state
+        return len(state.added_clusters) > REBUILD_RATIO * max(state.clustered, 1)
+
+    def rebuild(self, **kwargs):
+        """
+        Re-cluster every row, including the ones added since the build.
+        """
+        with self._write_lock:
+            old = self._state
+            tmp = self.path.rstrip(os.sep) + ".rebuild"
+            rebuilt = IVFIndex.build(tmp, old.vectors, old.keys, old.metadata or None, **kwargs)
+            # Searches still running keep reading the replaced files through their open mappings.
+            # No index.npz until all the files are replaced: a crash in between leaves no index
+            # rather than one that does not match its rows
+            os.remove(os.path.join(self.path, "index.npz"))
+            for name in ("vectors.f32", "meta.jsonl", "index.npz"):
+                os.replace(os.path.join(tmp, name), os.path.join(self.path, name))
+            os.rmdir(tmp)
+            del rebuilt
+            self._state = IndexState.load(self.path)
+
+    def search(self, query, k=10, nprobe=16):
+        """
+        Return the k rows most similar to the query among the nprobe closest clusters.
+
+        Args:
+            query (np.ndarray): The (dim,) query vector.
+            k (int): The number of results.
+            nprobe (int): The number of clusters to scan; higher is slower and more accurate.
+
+        Returns:
+            tuple: The row positions and their cosine similarities, best first.
+        """
+        return self._search(self._state, query, k, nprobe)
+
+    @staticmethod
+    def _search(state, query, k, nprobe):
+        query = normalize(query)
+        probes = top_k(state.centroids @ query, nprobe)
+        positions, scores = [], []
+        for c in probes:
+            start, end = state.offsets[c], state.offsets[c + 1]
+            if end > start:
+                positions.append(np.arange(start, end))
+                scores.append(state.vectors[start:end] @ query)
+            added = state.added[c]
+            if len(added):
+                positions.append(added)
+                scores.append(state.vectors[added] @ query)
+        if not positions:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        positions, scores = np.concatenate(positions), np.concatenate(scores)
+        best = top_k(scores, k)
+        return positions[best], scores[best]
+
+    def query(self, query, k=10, nprobe=16):
+        """
+        Return the metadata of the k rows most similar to the query, with a "score" key.
+        """
+        state = self._state
+        positions, scores = self._search(state, query, k, nprobe)
+        return [{**state.metadata[p], "score": float(s)} for p, s in zip(positions, scores)]
+
+
+class JsonlRows:
+    """
+    Read-only sequence of the JSON lines of an open binary file, by byte offset, for metadata
+    too large to hold in memory.
+    """
+
+    def __init__(self, file, offsets):
+        self.file = file
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        self.file.seek(self.offsets[i])
+        return json.loads(self.file.readline())
+
+
+def export_table(session, path, table=VECTOR_TABLE, batch_size=10000, **build_kwargs):
+    """
+    Export the embeddings of a table created as in Lab1.sql into a new index at path.
+
+    Rows are streamed: the vectors are written batch by batch to a float32 staging file and the
+    metadata to a staging JSONL file in the index directory, and the index is built from those,
+    so memory use does not grow with the size of the table.
+    """
+    os.makedirs(path, exist_ok=True)
+    vectors_path = os.path.join(path, "export.f32")
+    meta_path = os.path.join(path, "export.jsonl")
+    keys, offsets = array("q"), array("q")
+    dim = None
+    rows = session.sql(
+        f"SELECT HASH(relative_path, chunk) AS key, relative_path, file_url, chunk, embeddings FROM {table}"
+    ).to_local_iterator()
+    try:
+        with open(vectors_path, "wb") as vectors_file, open(meta_path, "wb") as meta_file:
+            batch = []
+            for row in rows:
+                keys.append(row["KEY"])
+                offsets.append(meta_file.tell())
+                meta_file.write(json.dumps(
+                    {"relative_path": row["RELATIVE_PATH"], "file_url": row["FILE_URL"], "chunk": row["CHUNK"]}
+                ).encode() + b"\n")
+                batch.append(row["EMBEDDINGS"])
+                if len(batch) == batch_size:
+                    vectors_file.write(np.asarray(batch, dtype=np.float32).tobytes())
+                    dim, batch = len(batch[0]), []
+            if batch:
+                vectors_file.write(np.asarray(batch, dtype=np.float32).tobytes())
+                dim = len(batch[0])
+
+        vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(len(keys), dim or DIM))
+        with open(meta_path, "rb") as meta_file:
+            index = IVFIndex.build(
+                path, vectors, np.frombuffer(keys, dtype=np.int64), JsonlRows(meta_file, offsets), **build_kwargs
+            )
+        del vectors
+        return index
+    finally:
+        for staging in (vectors_path, meta_path):
+            if os.path.exists(staging):
+                os.remove(staging)
+
+
+def sync_table(index, session, table=VECTOR_TABLE, batch_size=1000):
+    """
+    Add the rows of the table that are not in the index yet, e.g. chunks of new documents.
+    Rows removed from the table stay in the index until it is exported again.
+
+    Returns:
+        int: The number of rows added.
+    """
+    # One sync at a time, so concurrent syncs do not add the same rows twice
+    with index._write_lock:
+        return _sync_table(index, session, table, batch_size)
+
+
+def _sync_table(index, session, table, batch_size):
+    known = set(index.keys.tolist())
+    missing = [
+        row["KEY"]
+        for row in session.sql(f"SELECT HASH(relative_path, chunk) AS key FROM {table}").collect()
+        if row["KEY"] not in known
+    ]
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start : start + batch_size]
+        rows = session.sql(
+            f"SELECT HASH(relative_path, chunk) AS key, relative_path, file_url, chunk, embeddings "
+            f"FROM {table} WHERE HASH(relative_path, chunk) IN ({', '.join('?' * len(batch))})",
+            params=batch,
+        ).collect()
+        index.add(
+            [row["EMBEDDINGS"] for row in rows],
+            [row["KEY"] for row in rows],
+            [
+                {"relative_path": row["RELATIVE_PATH"], "file_url": row["FILE_URL"], "chunk": row["CHUNK"]}
+                for row in rows
+            ],
+        )
+    if index.needs_rebuild:
+        index.rebuild()
+    return len(missing)
+
+
+class LocalIndexBackend(CortexBackend):
+    """
+    CortexBackend that searches a local IVFIndex instead of a cortex search service. The query
+    is embedded with the model used for doc_chunks_vectors in Lab1.sql.
+    """
+
+    def __init__(self, session, index, nprobe=16):
+        super().__init__(session, None)
+        self.index = index
+        self.nprobe = nprobe
+
+    def search(self, query, limit):
+        from snowflake.cortex import EmbedText768
+
+        embedding = EmbedText768(EMBEDDING_MODEL, query, session=self.session)
+        return self.index.query(embedding, k=limit, nprobe=self.nprobe)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Benchmark - pooled MCPClient vs. the one-login-per-call path
+
+Starts a local stub of the Snowflake login and MCP endpoints, then measures
+calls per second for:
+    legacy  - get_auth_token() + a bare requests.post() for every call
+    pooled  - one shared MCPClient (keep-alive pool + cached token)
+
+Usage:
+    python bench_mcp_client.py
+    python bench_mcp_client.py --calls 2000 --threads 8 --login-latency-ms 150
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers login-request and MCP JSON-RPC calls with canned payloads"""
+
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real endpoint
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+    login_latency = 0.0
+    logins = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def _result(request):
+        return {
+            "jsonrpc": "2.0",
+            "id": request.get("id"),
+            "result": {"content": [{"type": "text", "text": "ok"}]},
+        }
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path.startswith("/session/v1/login-request"):
+            StubHandler.logins += 1
+            time.sleep(self.login_latency)
+            self._reply(200, {
+                "success": True,
+                "data": {"token": f"stub-token-{StubHandler.logins}", "validityInSeconds": 3600},
+            })
+        elif "/mcp-servers/" in self.path:
+            if not self.headers.get("Authorization", "").startswith("Snowflake Token="):
+                self._reply(401, {"message": "missing token"})
+                return
+            if isinstance(request, list):
+                self._reply(200, [self._result(r) for r in request])
+            else:
+                self._reply(200, self._result(request))
+        else:
+            self._reply(404, {"message": "not found"})
+
+
+def start_stub(login_latency):
+    StubHandler.login_latency = login_latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def load_client_module(base_url):
+    """Import simple_mcp_client against a throwaway secrets file pointing at the stub"""
+    secrets = {
+        "account": "stub",
+        "database": "cortex_analyst_demo",
+        "schema": "public",
+        "mcp_server_name": "FIN_SERV_MCP",
+        "username": "bench",
+        "password": "bench",
+        "base_url": base_url,
+    }
+    secrets_file = os.path.join(tempfile.mkdtemp(), "secrets.json")
+    with open(secrets_file, "w") as f:
+        json.dump(secrets, f)
+    os.environ["MCP_SECRETS_FILE"] = secrets_file
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import simple_mcp_client
+    return simple_mcp_client
+
+
+def run(label, call, calls, threads):
+    start = time.perf_counter()
+    if threads == 1:
+        for _ in range(calls):
+            call()
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(lambda _: call(), range(calls)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<8} {calls:>6} calls  {elapsed:8.2f}s  {calls / elapsed:10.1f} calls/s")
+    return calls / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--login-latency-ms", type=float, default=0.0,
+                        help="artificial delay on the stub login endpoint")
+    args = parser.parse_args()
+
+    server = start_stub(args.login_latency_ms / 1000)
+    mcp = load_client_module(f"http://127.0.0.1:{server.server_port}")
+
+    params = {"name": "policy-search", "arguments": {"query": "vesting", "limit": 5}}
+    payload = {"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": params}
+    client = mcp.MCPClient(pool_size=max(args.threads, 1))
+    url = client.url
+
+    def legacy_call():
+        token = mcp.get_auth_token()
+        headers = {
+            "Authorization": f"Snowflake Token=\"{token}\"",
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+        requests.post(url, json=payload, headers=headers, timeout=60).raise_for_status()
+
+    def pooled_call():
+        client.call("tools/call", params)
+
+    print(f"Stub at {mcp.BASE_URL} (login latency {args.login_latency_ms:.0f} ms, {args.threads} thread(s))")
+    print("Note: the stub is plain HTTP, so TLS handshake savings are not included\n")
+
+    StubHandler.logins = 0
+    legacy = run("legacy", legacy_call, args.calls, args.threads)
+    legacy_logins = StubHandler.logins
+
+    StubHandler.logins = 0
+    pooled = run("pooled", pooled_call, args.calls, args.threads)
+    pooled_logins = StubHandler.logins
+    client.close()
+
+    print(f"\nlogins: legacy={legacy_logins} pooled={pooled_logins}")
+    print(f"speedup: {pooled / legacy:.1f}x")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
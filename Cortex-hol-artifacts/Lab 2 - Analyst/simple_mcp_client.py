@@ -8,17 +8,24 @@ Usage:
     python simple_mcp_client.py list
     python simple_mcp_client.py search "retirement plan documents"
     python simple_mcp_client.py analyst "What's the total portfolio value?"
+    python simple_mcp_client.py batch search questions.txt --out results.jsonl
 """
 
 import requests
+import argparse
+import itertools
 import json
 import sys
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote
+from requests.adapters import HTTPAdapter
 
 def load_secrets():
     """Load secrets from secrets.json file"""
-    secrets_file = "secrets.json"
+    secrets_file = os.environ.get("MCP_SECRETS_FILE", "secrets.json")
     
     if not os.path.exists(secrets_file):
         print("secrets.json not found!")
@@ -65,8 +72,11 @@ PASSWORD = secrets['password']
 print(f"Loaded config: {USERNAME}@{ACCOUNT} -> {DATABASE}.{SCHEMA}.{MCP_SERVER_NAME}")
 print()
 
-# Snowflake REST API base URL
-BASE_URL = f"https://{ACCOUNT}.snowflakecomputing.com"
+# Snowflake REST API base URL (optional "base_url" override, e.g. for private link or a local stub)
+BASE_URL = secrets.get("base_url") or f"https://{ACCOUNT}.snowflakecomputing.com"
+
+# Refresh the cached session token this many seconds before Snowflake expires it
+TOKEN_EXPIRY_MARGIN = 60
 
 def get_auth_token():
     """Get Snowflake auth token"""
@@ -99,36 +109,190 @@ def get_auth_token():
         sys.exit(1)
 
 
+class MCPClient:
+    """
+    Reusable MCP client for batch jobs.
+
+    Keeps a keep-alive connection pool and caches the session token until it
+    expires, so repeated calls skip the login round trip and the TCP/TLS
+    handshake. One instance can be shared across threads.
+    """
+
+    def __init__(self, base_url=None, account=None, database=None, schema=None,
+                 mcp_server_name=None, username=None, password=None,
+                 pool_size=10, timeout=60):
+        self.base_url = base_url or BASE_URL
+        self.account = account or ACCOUNT
+        self.username = username or USERNAME
+        self.password = password or PASSWORD
+        self.timeout = timeout
+
+        database = database or DATABASE
+        schema = schema or SCHEMA
+        mcp_server_name = mcp_server_name or MCP_SERVER_NAME
+        endpoint = f"/api/v2/databases/{quote(database)}/schemas/{quote(schema)}/mcp-servers/{quote(mcp_server_name)}"
+        self.url = f"{self.base_url}{endpoint}"
+
+        # requests.Session is not thread-safe, so each thread gets its own
+        # Session, but they all mount the same adapter and share one pool
+        self._adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+
+        self._token = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+
+        # JSON-RPC ids, unique for the lifetime of the client
+        self._ids = itertools.count(1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close every per-thread session and the shared connection pool"""
+        with self._sessions_lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+        self._adapter.close()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self._adapter)
+            session.mount("http://", self._adapter)
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def _login(self):
+        payload = {
+            "data": {
+                "CLIENT_APP_ID": "Python",
+                "CLIENT_APP_VERSION": "1.0.0",
+                "SVN_REVISION": "1.0.0",
+                "ACCOUNT_NAME": self.account.split('.')[0],
+                "LOGIN_NAME": self.username,
+                "PASSWORD": self.password,
+            }
+        }
+        response = self._session().post(
+            f"{self.base_url}/session/v1/login-request", json=payload, timeout=30
+        )
+        response.raise_for_status()
+
+        result = response.json()
+        if not result.get("success"):
+            raise RuntimeError(f"Auth failed: {result.get('message', 'Unknown error')}")
+
+        data = result["data"]
+        validity = data.get("validityInSeconds") or 3600
+        self._token = data["token"]
+        self._token_expires_at = time.monotonic() + max(validity - TOKEN_EXPIRY_MARGIN, 0)
+
+    def get_token(self, stale_token=None):
+        """
+        Return the cached session token, logging in only when there is none,
+        it is about to expire, or it is the token a caller just saw rejected.
+        """
+        with self._token_lock:
+            if (
+                self._token is None
+                or self._token == stale_token
+                or time.monotonic() >= self._token_expires_at
+            ):
+                self._login()
+            return self._token
+
+    def _post(self, payload, token, timeout):
+        headers = {
+            "Authorization": f"Snowflake Token=\"{token}\"",
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+        return self._session().post(
+            self.url, json=payload, headers=headers, timeout=timeout or self.timeout
+        )
+
+    def send(self, payload, timeout=None):
+        """POST a JSON-RPC payload and return the raw response, re-authenticating once on 401"""
+        token = self.get_token()
+        response = self._post(payload, token, timeout)
+        if response.status_code == 401:
+            token = self.get_token(stale_token=token)
+            response = self._post(payload, token, timeout)
+        return response
+
+    def next_id(self):
+        """Return a request id no other call on this client has used"""
+        return next(self._ids)
+
+    def request(self, method, params=None, request_id=None):
+        """Build a JSON-RPC request object, assigning a fresh id if none is given"""
+        return {
+            "jsonrpc": "2.0",
+            "id": self.next_id() if request_id is None else request_id,
+            "method": method,
+            "params": params or {}
+        }
+
+    def call(self, method, params=None, request_id=None, timeout=None):
+        """Make a JSON-RPC call and return the decoded response (raises on HTTP errors)"""
+        response = self.send(self.request(method, params, request_id), timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def call_batch(self, payloads, timeout=None):
+        """
+        Send JSON-RPC requests as one batch array.
+
+        Returns a dict mapping each request id to its response object. The
+        server may answer batch members in any order.
+        """
+        response = self.send(payloads, timeout)
+        response.raise_for_status()
+        body = response.json()
+        if isinstance(body, dict):
+            # A single error object means the whole batch was rejected
+            return {p["id"]: body for p in payloads}
+        return {item.get("id"): item for item in body}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the process-wide MCPClient, creating it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MCPClient()
+        return _client
+
+
 def make_mcp_call(method, params=None):
     """Make MCP API call to Snowflake"""
     
-    # Get auth token
-    token = get_auth_token()
-    
-    # MCP endpoint as per official docs
-    endpoint = f"/api/v2/databases/{quote(DATABASE)}/schemas/{quote(SCHEMA)}/mcp-servers/{quote(MCP_SERVER_NAME)}"
-    url = f"{BASE_URL}{endpoint}"
+    # Pooled client with a cached auth token
+    client = get_client()
+    url = client.url
     
     # JSON-RPC payload as per official docs
-    payload = {
-        "jsonrpc": "2.0",
-        "id": 1,
-        "method": method,
-        "params": params or {}
-    }
-    
-    headers = {
-        "Authorization": f"Snowflake Token=\"{token}\"",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
+    payload = client.request(method, params)
     
     try:
         print(f"Making {method} call to MCP server...")
         print(f"URL: {url}")
         print(f"Payload: {json.dumps(payload, indent=2)}")
         
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
+        response = client.send(payload)
         
         print(f"Status: {response.status_code}")
         print(f"Response: {response.text[:500]}...")
@@ -148,6 +312,131 @@ def make_mcp_call(method, params=None):
         print(f"\nERROR: {e}")
         return None
 
+def tool_params(command, text):
+    """tools/call params for the search and analyst commands"""
+    if command == "search":
+        return {
+            "name": "policy-search",
+            "arguments": {
+                "query": text,
+                "limit": 5
+            }
+        }
+    return {
+        "name": "revenue-semantic-view",
+        "arguments": {
+            "message": text
+        }
+    }
+
+
+def read_queries(path):
+    """Read one query per non-blank line from a file, or from stdin when path is '-'"""
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        return [line.strip() for line in f if line.strip()]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _batch_record(index, query, request_id, response=None, error=None, elapsed=None):
+    if response is not None and "error" in response:
+        error = response["error"]
+    return {
+        "index": index,
+        "id": request_id,
+        "query": query,
+        "result": response.get("result") if response else None,
+        "error": error,
+        "elapsed_ms": round(elapsed * 1000, 1) if elapsed is not None else None,
+    }
+
+
+def run_batch(client, command, queries, mode="concurrent", concurrency=8,
+              batch_size=50, timeout=60):
+    """
+    Run a tools/call for every query and yield one result record per query,
+    in input order.
+
+    mode="concurrent" keeps up to `concurrency` single requests in flight, each
+    with its own timeout. mode="jsonrpc" sends JSON-RPC batch arrays of
+    `batch_size` requests, with up to `concurrency` arrays in flight.
+    """
+    payloads = [client.request("tools/call", tool_params(command, q)) for q in queries]
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            response = client.send(payloads[i], timeout)
+            response.raise_for_status()
+            return _batch_record(i, queries[i], payloads[i]["id"], response.json(),
+                                 elapsed=time.perf_counter() - start)
+        except Exception as e:
+            return _batch_record(i, queries[i], payloads[i]["id"], error=str(e),
+                                 elapsed=time.perf_counter() - start)
+
+    def group(start_index):
+        members = payloads[start_index:start_index + batch_size]
+        start = time.perf_counter()
+        try:
+            responses = client.call_batch(members, timeout)
+            error = None
+        except Exception as e:
+            responses, error = {}, str(e)
+        elapsed = time.perf_counter() - start
+
+        records = []
+        for offset, payload in enumerate(members):
+            i = start_index + offset
+            response = responses.get(payload["id"])
+            if response is None and error is None:
+                records.append(_batch_record(i, queries[i], payload["id"],
+                                             error="no response for request id", elapsed=elapsed))
+            else:
+                records.append(_batch_record(i, queries[i], payload["id"], response, error, elapsed))
+        return records
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        if mode == "jsonrpc":
+            for records in pool.map(group, range(0, len(payloads), batch_size)):
+                yield from records
+        else:
+            # pool.map yields in submission order, so output stays in input order
+            yield from pool.map(one, range(len(payloads)))
+
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="simple_mcp_client.py batch",
+        description="Run many search/analyst queries and write the results as JSONL",
+    )
+    parser.add_argument("command", choices=["search", "analyst"])
+    parser.add_argument("queries", help="file with one query per line, or '-' for stdin")
+    parser.add_argument("--out", default="batch_results.jsonl", help="output JSONL file")
+    parser.add_argument("--mode", choices=["concurrent", "jsonrpc"], default="concurrent",
+                        help="concurrent single requests, or JSON-RPC batch arrays")
+    parser.add_argument("--concurrency", type=int, default=8, help="max requests in flight")
+    parser.add_argument("--batch-size", type=int, default=50, help="requests per JSON-RPC batch array")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request timeout in seconds")
+    args = parser.parse_args(argv)
+
+    queries = read_queries(args.queries)
+    print(f"Running {len(queries)} {args.command} queries ({args.mode}, concurrency {args.concurrency})...")
+
+    start = time.perf_counter()
+    errors = 0
+    with MCPClient(pool_size=args.concurrency, timeout=args.timeout) as client, \
+            open(args.out, "w", encoding="utf-8") as out:
+        for record in run_batch(client, args.command, queries, args.mode,
+                                args.concurrency, args.batch_size, args.timeout):
+            errors += record["error"] is not None
+            out.write(json.dumps(record) + "\n")
+
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {len(queries)} results to {args.out} ({errors} errors) in {elapsed:.1f}s")
+
+
 def main():
     if len(sys.argv) < 2:
         print("Usage:")
@@ -155,6 +444,7 @@ def main():
         print("  python simple_mcp_client.py list")
         print("  python simple_mcp_client.py search 'your query here'")
         print("  python simple_mcp_client.py analyst 'your question here'")
+        print("  python simple_mcp_client.py batch search|analyst queries.txt [--out results.jsonl]")
         sys.exit(1)
     
     command = sys.argv[1].lower()
@@ -174,14 +464,7 @@ def main():
             sys.exit(1)
             
         query = sys.argv[2]
-        params = {
-            "name": "policy-search",
-            "arguments": {
-                "query": query,
-                "limit": 5
-            }
-        }
-        make_mcp_call("tools/call", params)
+        make_mcp_call("tools/call", tool_params("search", query))
         
     elif command == "analyst":
         # Call revenue-semantic-view tool
@@ -190,17 +473,15 @@ def main():
             sys.exit(1)
             
         question = sys.argv[2]
-        params = {
-            "name": "revenue-semantic-view",
-            "arguments": {
-                "message": question
-            }
-        }
-        make_mcp_call("tools/call", params)
+        make_mcp_call("tools/call", tool_params("analyst", question))
+        
+    elif command == "batch":
+        # Run a file (or stdin) of search/analyst queries
+        batch_main(sys.argv[2:])
         
     else:
         print(f"Unknown command: {command}")
-        print("Available commands: init, list, search, analyst")
+        print("Available commands: init, list, search, analyst, batch")
         sys.exit(1)
 
 if __name__ == "__main__":
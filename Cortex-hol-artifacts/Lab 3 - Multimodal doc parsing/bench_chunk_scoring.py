@@ -0,0 +1,181 @@
+"""
+Benchmark - chunk_scoring.select_chunks vs. the original smart_chunk_selection
+
+Generates synthetic search results shaped like the docs search service output (ENRICHED_CHUNK
+and RAW_CHUNK_TEXT with ICI vocabulary, numbers, percentages and years) at 1k, 10k and 100k
+chunks, times both implementations and checks that they select the same chunks in the same
+order.
+
+Usage:
+    python bench_chunk_scoring.py
+    python bench_chunk_scoring.py --sizes 1000 10000 --repeat 3
+"""
+
+import argparse
+import random
+import re
+import statistics
+import time
+
+from chunk_scoring import ChunkScorer, select_chunks
+
+QUESTION = "What was the total net assets of US mutual funds and ETFs in 2023?"
+
+VOCABULARY = (
+    "the of and in to a is for by with as at on assets net total fund funds mutual etf etfs "
+    "exchange traded equity fixed income money market billion trillion percent allocation class "
+    "domestic international flow flows investment company companies registered households "
+    "retirement share shares figure chart table visual context bond hybrid world investors"
+).split()
+
+
+def legacy_smart_chunk_selection(chunks, question, max_chunks=10):
+    """smart_chunk_selection as it was before chunk_scoring.py"""
+
+    # ICI-specific high-value keywords with enhanced weighting
+    ici_keywords = {
+        'asset': 3, 'allocation': 3, 'class': 2, 'total': 3, 'net': 2,
+        'equity': 2, 'fixed': 2, 'income': 2, 'money': 2, 'market': 2,
+        'mutual': 2, 'fund': 2, 'etf': 2, 'exchange': 2, 'traded': 2,
+        'billion': 3, 'trillion': 3, 'percentage': 2, 'breakdown': 3,
+        'domestic': 2, 'international': 2, 'flow': 2, 'investment': 1,
+        'company': 1, 'registered': 2, '2023': 3, '2022': 2
+    }
+
+    question_words = [word.lower().strip('.,!?') for word in question.split()]
+
+    scored_chunks = []
+    for chunk in chunks:
+        enriched_text = chunk.get("ENRICHED_CHUNK", "").lower()
+        raw_text = chunk.get("RAW_CHUNK_TEXT", "").lower()
+
+        enriched_base = sum(3 for word in question_words if len(word) > 3 and word in enriched_text)
+        raw_base = sum(4 for word in question_words if len(word) > 3 and word in raw_text)
+
+        enriched_ici = sum(weight for term, weight in ici_keywords.items() if term in enriched_text)
+        raw_ici = sum(weight * 1.2 for term, weight in ici_keywords.items() if term in raw_text)
+
+        enriched_numerical = len(re.findall(r'\b\d+\.?\d*\b', enriched_text)) * 0.3
+        raw_numerical = len(re.findall(r'\b\d+\.?\d*\b', raw_text)) * 0.8
+
+        enriched_percentage = len(re.findall(r'\b\d+\.?\d*%', enriched_text)) * 0.5
+        raw_percentage = len(re.findall(r'\b\d+\.?\d*%', raw_text)) * 1.2
+
+        enriched_year = 1 if '2023' in enriched_text else (0.5 if '2022' in enriched_text else 0)
+        raw_year = 2 if '2023' in raw_text else (1 if '2022' in raw_text else 0)
+
+        visual_bonus = 1 if 'visual context' in enriched_text or 'chart' in enriched_text or 'table' in enriched_text else 0
+        financial_bonus = 1 if any(term in raw_text for term in ['$', 'billion', 'trillion', 'assets', 'net']) else 0
+
+        total_score = (
+            enriched_base + raw_base +
+            enriched_ici + raw_ici +
+            enriched_numerical + raw_numerical +
+            enriched_percentage + raw_percentage +
+            enriched_year + raw_year +
+            visual_bonus + financial_bonus
+        )
+
+        scored_chunks.append((total_score, chunk))
+
+    scored_chunks.sort(key=lambda x: x[0], reverse=True)
+
+    selected_chunks = []
+    enriched_heavy = 0
+    raw_heavy = 0
+
+    for score, chunk in scored_chunks[:max_chunks * 2]:
+        if len(selected_chunks) >= max_chunks:
+            break
+
+        enriched_text = chunk.get("ENRICHED_CHUNK", "")
+        raw_text = chunk.get("RAW_CHUNK_TEXT", "")
+
+        is_enriched_heavy = len(enriched_text) > len(raw_text) * 2
+        is_raw_heavy = len(raw_text) > 100 and any(char.isdigit() for char in raw_text)
+
+        if is_enriched_heavy and enriched_heavy < max_chunks * 0.6:
+            selected_chunks.append(chunk)
+            enriched_heavy += 1
+        elif is_raw_heavy and raw_heavy < max_chunks * 0.5:
+            selected_chunks.append(chunk)
+            raw_heavy += 1
+        elif len(selected_chunks) < max_chunks:
+            selected_chunks.append(chunk)
+
+    return selected_chunks, [score for score, _ in scored_chunks]
+
+
+def synthetic_text(rng, words):
+    tokens = []
+    for _ in range(words):
+        r = rng.random()
+        if r < 0.08:
+            tokens.append(f"{rng.randint(1, 9999):,}")
+        elif r < 0.11:
+            tokens.append(f"{rng.uniform(0, 100):.1f}%")
+        elif r < 0.13:
+            tokens.append(rng.choice(["2023", "2022", "2019", "2013"]))
+        elif r < 0.14:
+            tokens.append(f"${rng.randint(1, 30)}.{rng.randint(0, 9)}")
+        else:
+            word = rng.choice(VOCABULARY)
+            tokens.append(word.capitalize() if rng.random() < 0.1 else word)
+    return " ".join(tokens)
+
+
+def synthetic_chunks(n, seed=0, pool_size=4000):
+    """
+    Chunks assembled from a pool of generated texts, so large sizes are quick to build and
+    equal scores (which must keep their order) are common.
+    """
+    rng = random.Random(seed)
+    enriched = [synthetic_text(rng, rng.randint(80, 300)) for _ in range(pool_size)]
+    raw = [synthetic_text(rng, rng.randint(10, 250)) for _ in range(pool_size)]
+    return [
+        {
+            "ENRICHED_CHUNK": rng.choice(enriched),
+            "RAW_CHUNK_TEXT": rng.choice(raw),
+            "IMAGE_FILE_NAME": f"PARSED/paged_image/2023-factbook_page_{i % 400}.png",
+            "PAGE_NUMBER": i % 400,
+        }
+        for i in range(n)
+    ]
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    parser.add_argument("--max-chunks", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--question", default=QUESTION)
+    args = parser.parse_args()
+
+    print(f"{'chunks':>8}  {'original':>10}  {'vectorized':>10}  {'speedup':>8}  identical")
+    for n in args.sizes:
+        chunks = synthetic_chunks(n)
+        legacy_time, (legacy_selected, legacy_scores) = timed(
+            lambda: legacy_smart_chunk_selection(chunks, args.question, args.max_chunks), args.repeat
+        )
+        new_time, selected = timed(lambda: select_chunks(chunks, args.question, args.max_chunks), args.repeat)
+
+        scores = ChunkScorer(args.question).score(chunks)
+        identical = (
+            [id(c) for c in selected] == [id(c) for c in legacy_selected]
+            and sorted(scores.tolist(), reverse=True) == legacy_scores
+        )
+        print(f"{n:>8,}  {legacy_time * 1000:>8.0f}ms  {new_time * 1000:>8.0f}ms  "
+              f"{legacy_time / new_time:>7.1f}x  {identical}")
+
+
+if __name__ == "__main__":
+    main()
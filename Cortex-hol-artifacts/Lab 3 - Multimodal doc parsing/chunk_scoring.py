@@ -0,0 +1,200 @@
+"""
+Vectorized chunk scoring for smart_chunk_selection
+
+The search service returns up to 1000 chunks per question, and the original scorer lowercased,
+regex-scanned and substring-checked each of them in a Python loop before sorting (score, chunk)
+tuples. ChunkScorer builds the term list of a question (question words, ICI keywords, bonus
+terms) and its weight vectors once, so each chunk is checked once per distinct term instead of
+once per scoring rule, and computes the scores from the resulting term presence matrix as NumPy
+arrays. Term presence is still one substring check per chunk and term, not a single pass:
+CPython's substring search beats a compiled alternation of the terms, which the re engine tries
+at every position. On the enriched texts of 10k chunks the checks take about 0.2s, one findall
+per text 0.7s, and 1.4s with the lookahead needed for overlapping terms. Most of the remaining
+time is the number regex. select_chunks then takes the top candidates with
+argpartition and applies the same balanced enriched / raw selection, so the chunks it picks are
+identical to the original ones.
+
+See bench_chunk_scoring.py for a comparison with the original implementation.
+"""
+
+import re
+
+import numpy as np
+
+# ICI-specific high-value keywords with enhanced weighting
+ICI_KEYWORDS = {
+    'asset': 3, 'allocation': 3, 'class': 2, 'total': 3, 'net': 2,
+    'equity': 2, 'fixed': 2, 'income': 2, 'money': 2, 'market': 2,
+    'mutual': 2, 'fund': 2, 'etf': 2, 'exchange': 2, 'traded': 2,
+    'billion': 3, 'trillion': 3, 'percentage': 2, 'breakdown': 3,
+    'domestic': 2, 'international': 2, 'flow': 2, 'investment': 1,
+    'company': 1, 'registered': 2, '2023': 3, '2022': 2
+}
+
+# Enriched chunks with visual context and raw chunks with exact financial terms get a bonus
+VISUAL_TERMS = ('visual context', 'chart', 'table')
+FINANCIAL_TERMS = ('$', 'billion', 'trillion', 'assets', 'net')
+
+NUMBER = re.compile(r'\b\d+\.?\d*\b')
+PERCENTAGE = re.compile(r'\b\d+\.?\d*%')
+
+# NUMBER on ASCII text with every digit mapped to '0': the literal lets the regex engine jump
+# between digits instead of testing a character class at every position
+_ASCII_NUMBER = re.compile(rb'\b0+\.?0*\b')
+_DIGITS_TO_ZERO = bytes.maketrans(b'123456789', b'000000000')
+# A PERCENTAGE match ends at each '%' preceded by digits[.digits] starting at a word boundary;
+# in the reversed text those matches start with the '%' literal, which is fast to search for
+_REVERSED_PERCENTAGE = re.compile(r'%\.?\d+(?!\w)')
+
+
+def count_numbers(text):
+    if text.isascii():
+        return len(_ASCII_NUMBER.findall(text.encode('ascii').translate(_DIGITS_TO_ZERO)))
+    return len(NUMBER.findall(text))
+
+
+def count_percentages(text):
+    return len(_REVERSED_PERCENTAGE.findall(text[::-1]))
+
+
+def question_words(question):
+    """Words of the question that count for relevance: lowercased, punctuation stripped, longer than 3"""
+    words = [word.lower().strip('.,!?') for word in question.split()]
+    return [word for word in words if len(word) > 3]
+
+
+def top_k_indices(scores, k):
+    """
+    Indices of the k highest scores, highest first. Equal scores keep their input order, as
+    with a stable sort, including at the cut-off.
+    """
+    n = len(scores)
+    if k >= n:
+        candidates = np.arange(n)
+    else:
+        kth = scores[np.argpartition(scores, n - k)[n - k]]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[: k - len(above)]
+        candidates = np.concatenate([above, ties])
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+class ChunkScorer:
+    """
+    Hybrid relevance scores of chunks for one question, from both their enriched and raw text.
+    """
+
+    def __init__(self, question, keywords=ICI_KEYWORDS):
+        words = question_words(question)
+        self.terms = list(dict.fromkeys([*words, *keywords, '2023', '2022', *VISUAL_TERMS, *FINANCIAL_TERMS]))
+        column = {term: i for i, term in enumerate(self.terms)}
+
+        # A question word counts once per occurrence in the question
+        self.word_counts = np.zeros(len(self.terms))
+        for word in words:
+            self.word_counts[column[word]] += 1
+        self.keyword_columns = [column[term] for term in keywords]
+        self.keyword_weights = list(keywords.values())
+        self.year_columns = column['2023'], column['2022']
+        self.visual_columns = [column[term] for term in VISUAL_TERMS]
+        self.financial_columns = [column[term] for term in FINANCIAL_TERMS]
+
+    def features(self, texts):
+        """
+        Term presence matrix, number counts and percentage counts of lowercased texts.
+        """
+        # `term in text` per term rather than one regex over all terms: see the module docstring
+        terms = self.terms
+        present = np.zeros((len(texts), len(terms)), dtype=bool)
+        numbers = np.zeros(len(texts))
+        percentages = np.zeros(len(texts))
+        for i, text in enumerate(texts):
+            present[i] = [term in text for term in terms]
+            numbers[i] = count_numbers(text)
+            percentages[i] = count_percentages(text)
+        return present, numbers, percentages
+
+    def keyword_score(self, present, factor=None):
+        # Summed keyword by keyword, as the original sum() did, so floats come out bit-identical
+        score = np.zeros(len(present))
+        for column, weight in zip(self.keyword_columns, self.keyword_weights):
+            score = score + np.where(present[:, column], weight if factor is None else weight * factor, 0)
+        return score
+
+    def score(self, chunks):
+        """
+        Scores of chunks, a float array in input order.
+        """
+        enriched, enriched_numbers, enriched_percentages = self.features(
+            [chunk.get("ENRICHED_CHUNK", "").lower() for chunk in chunks]
+        )
+        raw, raw_numbers, raw_percentages = self.features(
+            [chunk.get("RAW_CHUNK_TEXT", "").lower() for chunk in chunks]
+        )
+        year_2023, year_2022 = self.year_columns
+
+        # Base relevance from question keywords in BOTH texts, higher weight for exact (raw) matches
+        enriched_base = 3 * (enriched @ self.word_counts)
+        raw_base = 4 * (raw @ self.word_counts)
+        # ICI-specific scoring, slight boost for raw
+        enriched_ici = self.keyword_score(enriched)
+        raw_ici = self.keyword_score(raw, 1.2)
+        # Numerical data and percentage bonuses, higher weights for raw numbers
+        enriched_numerical = enriched_numbers * 0.3
+        raw_numerical = raw_numbers * 0.8
+        enriched_percentage = enriched_percentages * 0.5
+        raw_percentage = raw_percentages * 1.2
+        # Year bonuses
+        enriched_year = np.where(enriched[:, year_2023], 1, np.where(enriched[:, year_2022], 0.5, 0))
+        raw_year = np.where(raw[:, year_2023], 2, np.where(raw[:, year_2022], 1, 0))
+        # Quality bonuses
+        visual_bonus = enriched[:, self.visual_columns].any(axis=1).astype(float)
+        financial_bonus = raw[:, self.financial_columns].any(axis=1).astype(float)
+
+        return (
+            enriched_base + raw_base +
+            enriched_ici + raw_ici +
+            enriched_numerical + raw_numerical +
+            enriched_percentage + raw_percentage +
+            enriched_year + raw_year +
+            visual_bonus + financial_bonus
+        )
+
+
+def select_chunks(chunks, question, max_chunks=10):
+    """
+    Score chunks for question and pick up to max_chunks with a balanced mix of enriched-heavy
+    (up to 60%) and raw-heavy (up to 50%) chunks.
+    """
+    if not chunks:
+        return []
+    scores = ChunkScorer(question).score(chunks)
+
+    # BALANCED SELECTION: Ensure mix of high-context and high-precision chunks
+    selected_chunks = []
+    enriched_heavy = 0
+    raw_heavy = 0
+
+    for index in top_k_indices(scores, max_chunks * 2):  # Consider more candidates
+        if len(selected_chunks) >= max_chunks:
+            break
+
+        chunk = chunks[index]
+        enriched_text = chunk.get("ENRICHED_CHUNK", "")
+        raw_text = chunk.get("RAW_CHUNK_TEXT", "")
+
+        # Determine if chunk is enriched-heavy or raw-heavy based on content length/richness
+        is_enriched_heavy = len(enriched_text) > len(raw_text) * 2
+        is_raw_heavy = len(raw_text) > 100 and any(char.isdigit() for char in raw_text)
+
+        # Balance selection
+        if is_enriched_heavy and enriched_heavy < max_chunks * 0.6:  # Up to 60% enriched
+            selected_chunks.append(chunk)
+            enriched_heavy += 1
+        elif is_raw_heavy and raw_heavy < max_chunks * 0.5:  # Up to 50% raw-focused
+            selected_chunks.append(chunk)
+            raw_heavy += 1
+        elif len(selected_chunks) < max_chunks:  # Fill remaining slots
+            selected_chunks.append(chunk)
+
+    return selected_chunks
@@ -0,0 +1,158 @@
+"""
+DAG executor for the Lab 3 question pipeline
+
+The app's steps used to run strictly one after another, although several of them only depend on
+the search results: the page images to critique are known before the text answer exists. A
+Pipeline runs named nodes on a thread pool as soon as the nodes they depend on have finished, so
+independent branches (text analysis, visual extraction) overlap and the wall clock time is that
+of the longest branch rather than the sum of all steps.
+
+    pipeline = Pipeline(deadline=90)
+    pipeline.add("text_answer", lambda: answer(question))
+    pipeline.add("visual_data", lambda: extract(images))
+    pipeline.add("reconcile", lambda text_answer, visual_data: ..., deps=("text_answer", "visual_data"))
+    run = pipeline.run()
+
+A node is called with the results of its dependencies as keyword arguments. Every node gets a
+NodeTiming (status, start offset, duration, error). Once the deadline passes, run() returns with
+the results of the nodes finished so far: running nodes are marked timed out and nodes not
+started yet skipped, as are the dependents of failed nodes. Node functions that wait on Snowpark
+async jobs should do so with wait_for_job, which cancels the job at the deadline; a synchronous
+call still running at the deadline is left to finish in the background.
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple
+
+
+@dataclass
+class NodeTiming:
+    status: str = "pending"  # pending, running, done, failed, skipped or timed_out
+    started: Optional[float] = None  # seconds after the pipeline started
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+@dataclass
+class Node:
+    name: str
+    fn: Callable
+    deps: Tuple[str, ...] = ()
+
+
+@dataclass
+class PipelineRun:
+    results: Dict[str, object]
+    timings: Dict[str, NodeTiming]
+    seconds: float
+    timed_out: bool = False
+    errors: Dict[str, str] = field(default_factory=dict)
+
+    def done(self, name):
+        return name in self.results
+
+
+class Pipeline:
+    """
+    Runs a DAG of named nodes concurrently, with per-node timing and an overall deadline.
+    """
+
+    def __init__(self, deadline=None, max_workers=None, poll_interval=0.25):
+        self.nodes = {}
+        self.deadline = deadline
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self._deadline_at = None
+
+    def add(self, name, fn, deps=()):
+        missing = [dep for dep in deps if dep not in self.nodes]
+        if missing:
+            raise ValueError(f"Node {name} depends on unknown nodes {missing}; add those first")
+        self.nodes[name] = Node(name, fn, tuple(deps))
+        return self
+
+    def remaining(self):
+        """Seconds left until the deadline, None without one"""
+        if self._deadline_at is None:
+            return None
+        return self._deadline_at - time.perf_counter()
+
+    def wait_for_job(self, job):
+        """
+        Wait for a Snowpark async job and return its result; cancel it and raise TimeoutError if
+        it is still running at the deadline.
+        """
+        while not job.is_done():
+            remaining = self.remaining()
+            if remaining is not None and remaining <= 0:
+                try:
+                    job.cancel()
+                except Exception as e:
+                    print(f"DEBUG: Could not cancel job {job.query_id}: {e}")
+                raise TimeoutError(f"job {job.query_id} still running at the pipeline deadline")
+            time.sleep(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+        return job.result()
+
+    def run(self, on_node_done=None):
+        """
+        Run all nodes and return a PipelineRun. on_node_done(name, timing) is called from the
+        calling thread as each node finishes, fails or times out.
+        """
+        start = time.perf_counter()
+        self._deadline_at = start + self.deadline if self.deadline else None
+        timings = {name: NodeTiming() for name in self.nodes}
+        results, errors = {}, {}
+        running = {}  # future -> node name
+
+        def settle(name, status, error=None):
+            timing = timings[name]
+            timing.status = status
+            timing.error = error
+            if timing.started is not None:
+                timing.seconds = time.perf_counter() - start - timing.started
+            if on_node_done:
+                on_node_done(name, timing)
+
+        pool = ThreadPoolExecutor(max_workers=self.max_workers or max(1, len(self.nodes)))
+        try:
+            while True:
+                # Skip the dependents of failed nodes, start the nodes whose dependencies are done
+                for name, node in self.nodes.items():
+                    if timings[name].status != "pending":
+                        continue
+                    if any(timings[dep].status in ("failed", "skipped", "timed_out") for dep in node.deps):
+                        settle(name, "skipped", "a dependency did not finish")
+                    elif all(dep in results for dep in node.deps):
+                        timings[name].status = "running"
+                        timings[name].started = time.perf_counter() - start
+                        future = pool.submit(node.fn, **{dep: results[dep] for dep in node.deps})
+                        running[future] = name
+
+                if not running:
+                    break
+                remaining = self.remaining()
+                if remaining is not None and remaining <= 0:
+                    break
+                finished, _ = wait(running, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                        settle(name, "done")
+                    except Exception as e:
+                        errors[name] = f"{type(e).__name__}: {e}"
+                        settle(name, "timed_out" if isinstance(e, TimeoutError) else "failed", errors[name])
+
+            for name in running.values():
+                settle(name, "timed_out", f"still running after {self.deadline}s")
+            for name, timing in timings.items():
+                if timing.status == "pending":
+                    settle(name, "skipped", "not started before the deadline")
+        finally:
+            # Do not wait for nodes still running at the deadline
+            pool.shutdown(wait=False)
+
+        timed_out = any(timing.status == "timed_out" for timing in timings.values())
+        return PipelineRun(results, timings, time.perf_counter() - start, timed_out, errors)
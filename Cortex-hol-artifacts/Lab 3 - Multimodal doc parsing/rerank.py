@@ -0,0 +1,146 @@
+"""
+Page rankers for the Lab 3 retrieval step
+
+A ranker turns a question into a ranked list of page images, which streamlit_app.py then fetches
+the full chunk text for. Two are available:
+
+    ServiceRanker  - one multi_index_query over all indexes; the search service fuses them and
+                     pages are ranked by the summed reciprocal ranks of their chunks
+    RRFRanker      - one query per index, issued concurrently, fused locally with weighted
+                     reciprocal rank fusion; the weights can be tuned offline on a labeled
+                     question set with tune_rerank.py, which writes rerank_weights.json
+
+Both return pages deduplicated by IMAGE_FILE_NAME, best first.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+INDEXES = ("image_vector", "enriched_chunk", "pdf_text", "raw_chunk_text")
+VECTOR_INDEXES = ("image_vector",)
+PAGE_COLUMNS = ["PDF_FILE_NAME", "IMAGE_FILE_NAME", "ORIGINAL_FILE_NAME", "PAGE_NUMBER"]
+RRF_K = 60
+DEFAULT_WEIGHTS = {index: 1.0 for index in INDEXES}
+WEIGHTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rerank_weights.json")
+
+
+def load_weights(path=WEIGHTS_FILE):
+    """
+    Return (weights, k) tuned by tune_rerank.py, or the defaults if there is no weights file.
+    """
+    try:
+        with open(path) as f:
+            tuned = json.load(f)
+    except FileNotFoundError:
+        return dict(DEFAULT_WEIGHTS), RRF_K
+    return {**DEFAULT_WEIGHTS, **tuned.get("weights", {})}, tuned.get("k", RRF_K)
+
+
+def index_query(index, question, embedding):
+    if index in VECTOR_INDEXES:
+        return {index: [{"vector": embedding}]}
+    return {index: [{"text": question}]}
+
+
+def page_ranks(results):
+    """{IMAGE_FILE_NAME: (rank, result)} of the best ranked chunk of each page, ranks from 1"""
+    ranks = {}
+    for rank, result in enumerate(results, start=1):
+        page = result.get("IMAGE_FILE_NAME")
+        if page and page not in ranks:
+            ranks[page] = (rank, result)
+    return ranks
+
+
+def weighted_rrf(ranked_lists, weights, k=RRF_K):
+    """
+    Fuse per-index result lists: a page scores sum(weight / (k + rank)) over the indexes it
+    appears in, ranked by its best chunk in each. Returns page dicts, best first, with their
+    "score" and per-index "ranks".
+    """
+    pages = {}
+    for index, results in ranked_lists.items():
+        weight = weights.get(index, 0.0)
+        if not weight:
+            continue
+        for page, (rank, result) in page_ranks(results).items():
+            entry = pages.setdefault(page, {**{c: result.get(c) for c in PAGE_COLUMNS}, "score": 0.0, "ranks": {}})
+            entry["score"] += weight / (k + rank)
+            entry["ranks"][index] = rank
+    return sorted(pages.values(), key=lambda page: page["score"], reverse=True)
+
+
+def rank_service_results(results, k=RRF_K):
+    """Pages of the service's fused result list: each chunk hit adds 1 / (k + rank) to its page"""
+    pages = {}
+    for rank, result in enumerate(results, start=1):
+        page = result.get("IMAGE_FILE_NAME")
+        if not page:
+            continue
+        entry = pages.setdefault(page, {**{c: result.get(c) for c in PAGE_COLUMNS}, "score": 0.0})
+        entry["score"] += 1.0 / (k + rank)
+    return sorted(pages.values(), key=lambda page: page["score"], reverse=True)
+
+
+class ServiceRanker:
+    """
+    Ranks pages from a single multi-index query fused by the search service.
+    """
+
+    name = "service"
+
+    def __init__(self, limit=100):
+        self.limit = limit
+
+    def search(self, service, question, embedding):
+        return {
+            "service": service.search(
+                multi_index_query={index: index_query(index, question, embedding)[index] for index in INDEXES},
+                columns=PAGE_COLUMNS,
+                limit=self.limit,
+            ).results
+        }
+
+    def fuse(self, ranked_lists):
+        return rank_service_results(ranked_lists["service"])
+
+    def rank(self, service, question, embedding):
+        return self.fuse(self.search(service, question, embedding))
+
+
+class RRFRanker:
+    """
+    Queries every index separately and concurrently and fuses the lists with weighted RRF.
+    """
+
+    name = "rrf"
+
+    def __init__(self, weights=None, k=None, limit=50, max_workers=len(INDEXES)):
+        tuned_weights, tuned_k = load_weights()
+        self.weights = weights or tuned_weights
+        self.k = k or tuned_k
+        self.limit = limit
+        self.max_workers = max_workers
+
+    def search(self, service, question, embedding):
+        indexes = [index for index in INDEXES if self.weights.get(index)]
+
+        def query(index):
+            return service.search(
+                multi_index_query=index_query(index, question, embedding),
+                columns=PAGE_COLUMNS,
+                limit=self.limit,
+            ).results
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return dict(zip(indexes, pool.map(query, indexes)))
+
+    def fuse(self, ranked_lists):
+        return weighted_rrf(ranked_lists, self.weights, self.k)
+
+    def rank(self, service, question, embedding):
+        return self.fuse(self.search(service, question, embedding))
+
+
+RANKERS = {ranker.name: ranker for ranker in (ServiceRanker, RRFRanker)}
@@ -15,6 +15,8 @@ import datetime
 import re
 import time
 import hashlib
+import threading
+from collections import OrderedDict
 from difflib import SequenceMatcher
 import tempfile
 from textwrap import dedent
@@ -22,7 +24,7 @@ import streamlit as st
 from PIL import Image, ImageDraw, ImageFont
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from contextlib import contextmanager
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from typing import List
 from typing import Tuple
 import snowflake.snowpark.session as session
@@ -32,13 +34,40 @@ import streamlit as st
 from snowflake.snowpark.context import get_active_session
 from snowflake.core import Root
 from snowflake.cortex import complete, CompleteOptions
+from chunk_scoring import question_words, select_chunks
+from rerank import RRFRanker, ServiceRanker
+from pipeline import Pipeline
 sp_session = get_active_session()
 
-def query_multi_index_search_service(session, my_service, query_text):
+EMBEDDING_MODEL = "voyage-multimodal-3"
+EMBEDDING_DIM = 1024
+EMBEDDING_CACHE_TABLE = "CORTEX_SEARCH_TUTORIAL_DB.PUBLIC.QUERY_EMBEDDING_CACHE"
+EMBEDDING_CACHE_SIZE = 1024  # query embeddings kept in memory, shared by all sessions
+DOC_STAGE = "@CORTEX_SEARCH_TUTORIAL_DB.PUBLIC.DOC_REPO"
+PRESIGNED_URL_EXPIRY = 3600  # seconds a presigned URL stays valid
+PRESIGNED_URL_CACHE_TTL = PRESIGNED_URL_EXPIRY - 300  # reuse it until 5 minutes before it expires
+IMAGE_CRITIQUE_POLL_INTERVAL = 0.25  # seconds between checks of the running critique jobs
+# Placeholders of the image critique prompt, filled per image inside the batched query
+IMAGE_DOCUMENT_MARKER = "<<ORIGINAL_FILE_NAME>>"
+IMAGE_PAGE_MARKER = "<<PAGE_NUMBER>>"
+IMAGE_EXTRACTION_MARKER = "<<VISUAL_EXTRACTION>>"
+PIPELINE_STATUS_ICONS = {"done": "✅", "failed": "❌", "timed_out": "⏱️", "skipped": "⏭️"}
+VISUAL_EXTRACTIONS_TABLE = "CORTEX_SEARCH_TUTORIAL_DB.PUBLIC.PAGE_VISUAL_EXTRACTIONS"  # built by visual_extraction.py
+PAGE_CHUNKS_TABLE = "CORTEX_SEARCH_TUTORIAL_DB.PUBLIC.PDF_IMAGES_JOINED"  # the search service's source table
+SEARCH_LIGHT_COLUMNS = ["PDF_FILE_NAME", "IMAGE_FILE_NAME", "ORIGINAL_FILE_NAME", "PAGE_NUMBER"]
+SEARCH_FULL_COLUMNS = ["ENRICHED_CHUNK", "RAW_CHUNK_TEXT", *SEARCH_LIGHT_COLUMNS]
+RETRIEVAL_MODES = {
+    "Two-phase, service fusion": "service",
+    "Two-phase, RRF rerank": "rrf",
+    "All results (1000 full-text chunks)": None,
+}
+
+def multi_index_search(session, my_service, query_text, columns=SEARCH_FULL_COLUMNS, limit=1000,
+                       embedding_lookup=None):
     """ENHANCED HYBRID SEARCH: Image + Enriched Text + Raw Text"""
-    query_embedding = get_text_embedding_via_image(session, query_text)
+    query_embedding = get_text_embedding_via_image(session, query_text, lookup_info=embedding_lookup)
     
-    resp = my_service.search(
+    return my_service.search(
         # Use ONLY multi_index_query, not both query and multi_index_query
         multi_index_query={
             "image_vector": [
@@ -47,22 +76,100 @@ def query_multi_index_search_service(session, my_service, query_text):
             "pdf_text":[{"text":query_text}],
             "raw_chunk_text":[{"text":query_text}]},
         
-        columns=[
-            "ENRICHED_CHUNK",
-            "RAW_CHUNK_TEXT",
-            "PDF_FILE_NAME",
-            "IMAGE_FILE_NAME",
-            "ORIGINAL_FILE_NAME",
-            "PAGE_NUMBER"
-        ],
-        limit=1000
+        columns=columns,
+        limit=limit
     )
-    
+
+def query_multi_index_search_service(session, my_service, query_text, embedding_lookup=None):
+    resp = multi_index_search(session, my_service, query_text, embedding_lookup=embedding_lookup)
     return resp.to_json() 
 
+def candidate_limit(question, minimum=30, maximum=200):
+    """Phase one candidate count: more for longer, comparative or multi-year questions"""
+    words = question_words(question)
+    years = len(set(re.findall(r"\b(?:19|20)\d{2}\b", question)))
+    comparative = re.search(r"\b(?:vs|versus|compare[ds]?|comparison|between|trends?|over time|change|growth)\b",
+                            question.lower())
+    limit = 40 + 10 * max(0, len(words) - 4)
+    if comparative or years > 1:
+        limit *= 2
+    return max(minimum, min(maximum, limit))
+
+def fetch_page_chunks(session, image_files):
+    """Full text of all chunks of the given page images, in the order of image_files"""
+    if not image_files:
+        return []
+    rows = session.sql(
+        f"select {', '.join(SEARCH_FULL_COLUMNS)} from {PAGE_CHUNKS_TABLE} "
+        f"where image_file_name in ({', '.join('?' for _ in image_files)})",
+        params=list(image_files)
+    ).collect()
+    position = {image_file: i for i, image_file in enumerate(image_files)}
+    chunks = [row.asDict() for row in rows]
+    chunks.sort(key=lambda chunk: position[chunk["IMAGE_FILE_NAME"]])
+    return chunks
+
+def make_ranker(name, question):
+    """Page ranker of rerank.py for a retrieval mode; candidate counts adapt to the question"""
+    limit = candidate_limit(question)
+    if name == "rrf":
+        # Each index only has to surface its own best pages
+        return RRFRanker(limit=max(20, limit // 2))
+    return ServiceRanker(limit=limit)
+
+def two_phase_retrieval(session, my_service, question, max_pages, ranker, embedding_lookup=None):
+    """
+    Phase one ranks pages from light search results (metadata only) with ranker; phase two
+    fetches the full chunk text of the top max_pages pages from the service's source table.
+    Returns (chunks, stats).
+    """
+    start = time.perf_counter()
+    embedding = get_text_embedding_via_image(session, question, lookup_info=embedding_lookup)
+    ranked_lists = ranker.search(my_service, question, embedding)
+    ranked_pages = ranker.fuse(ranked_lists)
+    phase_one = time.perf_counter() - start
+
+    pages = [page["IMAGE_FILE_NAME"] for page in ranked_pages[:max_pages]]
+    chunks = fetch_page_chunks(session, pages)
+    phase_two = time.perf_counter() - start - phase_one
+
+    candidates = [row for rows in ranked_lists.values() for row in rows]
+    return chunks, {
+        "ranker": ranker.name,
+        "candidate_limit": ranker.limit,
+        "candidates": len(candidates),
+        "pages": len(pages),
+        "chunks": len(chunks),
+        "phase_one_seconds": phase_one,
+        "phase_two_seconds": phase_two,
+        "payload_chars": sum(len(str(v)) for row in candidates + chunks for v in row.values())
+    }
+
+def select_ranked_chunks(chunks, max_chunks=10):
+    """
+    Up to max_chunks chunks of the ranked pages, for rankers that replace the heuristics. Chunks
+    are taken round-robin across the pages (each page's first chunk, then each page's second, ...)
+    so a chunk-heavy top page cannot crowd out the other top pages, and returned in page order.
+    """
+    by_page = {}
+    for chunk in chunks:
+        by_page.setdefault(chunk["IMAGE_FILE_NAME"], []).append(chunk)
+    pages = list(by_page.values())
+    picked = []
+    for depth in range(max(map(len, pages), default=0)):
+        for page_rank, page_chunks in enumerate(pages):
+            if len(picked) < max_chunks and depth < len(page_chunks):
+                picked.append((page_rank, depth))
+    return [pages[page_rank][depth] for page_rank, depth in sorted(picked)]
+
+def query_hash(text: str) -> str:
+    """md5 of the normalized question: case, whitespace and trailing punctuation do not change it"""
+    normalized = re.sub(r"\s+", " ", text.strip().lower()).rstrip("?.! ")
+    return hashlib.md5(normalized.encode()).hexdigest()
+
 def create_temp_image_from_text(text: str) -> tuple[str, str]:
-    query_hash = hashlib.md5(text.strip().lower().encode()).hexdigest()
-    image_filename = f"{query_hash}.png"
+    query_hash_value = query_hash(text)
+    image_filename = f"{query_hash_value}.png"
 
     temp_file = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
     file_path = temp_file.name
@@ -136,7 +243,127 @@ def upload_file_to_stage(session, local_path: str, stage_name: str, dest_file_na
     finally:
         os.remove(temp_named_path)
 
-def get_text_embedding_via_image(
+class QueryEmbeddingCache:
+    """
+    Two-tier cache of question embeddings keyed by (query_hash, model): an in-process LRU in
+    front of a Snowflake table, so repeated questions skip rendering, uploading and embedding
+    the question image. Also keeps per-tier hit counts and latency for the diagnostics.
+    """
+
+    TIERS = ("memory", "table", "miss")
+
+    def __init__(self, table=EMBEDDING_CACHE_TABLE, max_entries=EMBEDDING_CACHE_SIZE):
+        self.table = table
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._table_ready = None
+        self._inserts = []  # async insert jobs not checked yet
+        self._stats = {tier: {"count": 0, "seconds": 0.0} for tier in self.TIERS}
+
+    def _ensure_table(self, session):
+        if self._table_ready is None:
+            try:
+                session.sql(f"""
+                    create table if not exists {self.table} (
+                        query_hash varchar,
+                        model varchar,
+                        embedding vector(float, {EMBEDDING_DIM}),
+                        created_at timestamp_ltz default current_timestamp()
+                    )
+                """).collect()
+                self._table_ready = True
+            except Exception as e:
+                print(f"DEBUG: Embedding cache table unavailable, caching in memory only: {e}")
+                self._table_ready = False
+        return self._table_ready
+
+    def _remember(self, key, embedding):
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, session, key):
+        """Return (embedding, tier) - the embedding is None on a miss"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key], "memory"
+
+        if self._ensure_table(session):
+            try:
+                rows = session.sql(
+                    f"select embedding from {self.table} where query_hash = ? and model = ? limit 1",
+                    params=list(key)
+                ).collect()
+            except Exception as e:
+                # Losing the table tier must not break the search: carry on in memory only
+                print(f"DEBUG: Embedding cache table lookup failed, caching in memory only: {e}")
+                self._table_ready = False
+                return None, "miss"
+            if rows:
+                embedding = list(rows[0][0])
+                self._remember(key, embedding)
+                return embedding, "table"
+        return None, "miss"
+
+    def _check_inserts(self):
+        """Log the failures of the finished async inserts"""
+        with self._lock:
+            done = [job for job in self._inserts if job.is_done()]
+            self._inserts = [job for job in self._inserts if job not in done]
+        for job in done:
+            try:
+                job.result()
+            except Exception as e:
+                print(f"DEBUG: Embedding cache insert {job.query_id} failed: {e}")
+
+    def put(self, session, key, embedding):
+        self._remember(key, embedding)
+        self._check_inserts()
+        if self._ensure_table(session):
+            # Persisting is off the critical path: submit it and check it on a later put
+            try:
+                job = session.sql(
+                    f"insert into {self.table} (query_hash, model, embedding) "
+                    f"select ?, ?, parse_json(?)::array::vector(float, {EMBEDDING_DIM})",
+                    params=[*key, json.dumps(list(embedding))]
+                ).collect_nowait()
+            except Exception as e:
+                print(f"DEBUG: Embedding cache insert could not be submitted: {e}")
+                return
+            with self._lock:
+                self._inserts.append(job)
+
+    def record(self, tier, seconds):
+        with self._lock:
+            self._stats[tier]["count"] += 1
+            self._stats[tier]["seconds"] += seconds
+
+    def stats(self):
+        with self._lock:
+            lookups = sum(s["count"] for s in self._stats.values())
+            hits = lookups - self._stats["miss"]["count"]
+            return {
+                "lookups": lookups,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "tiers": {
+                    tier: {
+                        "count": s["count"],
+                        "avg_ms": 1000 * s["seconds"] / s["count"] if s["count"] else 0.0
+                    }
+                    for tier, s in self._stats.items()
+                }
+            }
+
+@st.cache_resource
+def get_query_embedding_cache():
+    return QueryEmbeddingCache()
+
+def embed_text_via_image(
     session, 
     text: str, 
     stage_name="@cortex_search_tutorial_db.public.doc_repo"
@@ -151,7 +378,7 @@ def get_text_embedding_via_image(
         query = f"""
             select 
                 AI_EMBED(
-                    'voyage-multimodal-3', 
+                    '{EMBEDDING_MODEL}', 
                     '{stage_name}+{stage_subpath.lstrip('/')}'
                 )
         """
@@ -161,22 +388,53 @@ def get_text_embedding_via_image(
 
     return embedding
 
+def get_text_embedding_via_image(
+    session, 
+    text: str, 
+    stage_name="@cortex_search_tutorial_db.public.doc_repo",
+    lookup_info=None
+):
+    """Embed the question through the cache; lookup_info, if given, receives the tier and latency"""
+    start = time.perf_counter()
+    cache = get_query_embedding_cache()
+    key = (query_hash(text), EMBEDDING_MODEL)
+
+    embedding, tier = cache.get(session, key)
+    if embedding is None:
+        embedding = embed_text_via_image(session, text, stage_name)
+        cache.put(session, key, embedding)
+
+    elapsed = time.perf_counter() - start
+    cache.record(tier, elapsed)
+    if lookup_info is not None:
+        lookup_info.update({"tier": tier, "seconds": elapsed})
+    return embedding
+
+def critique_result(row):
+    return {
+        "RESULT": row["RESULT"],
+        "ORIGINAL_FILE_NAME": row["ORIGINAL_FILE_NAME"],
+        "IMAGE_FILE_NAME": row["IMAGE_FILE_NAME"],
+        "PRESIGNED_URL": row.get("PRESIGNED_URL", "#")
+    }
+
+def critique_error(e, item=None):
+    return {
+        "RESULT": f"Error: {e}",
+        "ORIGINAL_FILE_NAME": item.get("ORIGINAL_FILE_NAME") if item else None,
+        "IMAGE_FILE_NAME": item.get("IMAGE_FILE_NAME") if item else None,
+        "PRESIGNED_URL": "#"
+    }
+
 def resolve_async_job(job):
     try:
-        row = job.result()[0].asDict()
-        return {
-            "RESULT": row["RESULT"],
-            "ORIGINAL_FILE_NAME": row["ORIGINAL_FILE_NAME"],
-            "IMAGE_FILE_NAME": row["IMAGE_FILE_NAME"],
-            "PRESIGNED_URL": row.get("PRESIGNED_URL", "#")
-        }
+        return critique_result(job.result()[0].asDict())
     except Exception as e:
-        return {
-            "RESULT": f"Error: {e}",
-            "ORIGINAL_FILE_NAME": None,
-            "IMAGE_FILE_NAME": None,
-            "PRESIGNED_URL": "#"
-        }
+        return critique_error(e)
+
+def resolve_async_batch_job(job):
+    """Map the rows of a multi-image critique job to {IMAGE_FILE_NAME: result}"""
+    return {row["IMAGE_FILE_NAME"]: critique_result(row.asDict()) for row in job.result()}
 
 def rephrase_for_search(question):
     return question.strip().lower()
@@ -193,6 +451,50 @@ def filter_by_confidence(responses, threshold=0.5):
 def sql_escape(value):
     return str(value).replace("'", "''") if value is not None else ""
 
+class PresignedUrlCache:
+    """
+    Presigned URLs of stage files, resolved for many files in one query and reused until shortly
+    before they expire. Shared by the text answer, the image critiques and the debug sections.
+    """
+
+    def __init__(self, stage=DOC_STAGE, expiry=PRESIGNED_URL_EXPIRY, ttl=PRESIGNED_URL_CACHE_TTL):
+        self.stage = stage
+        self.expiry = expiry
+        self.ttl = ttl
+        self._urls = {}  # file name -> (url, cached at)
+        self._lock = threading.Lock()
+
+    def get_many(self, session, file_names):
+        """Return {file name: presigned URL}, querying only the files not cached yet"""
+        now = time.time()
+        urls, missing = {}, []
+        with self._lock:
+            for name in dict.fromkeys(f for f in file_names if f):
+                cached = self._urls.get(name)
+                if cached and now - cached[1] < self.ttl:
+                    urls[name] = cached[0]
+                else:
+                    missing.append(name)
+
+        if missing:
+            rows = session.sql(
+                f"select column1, get_presigned_url({self.stage}, column1, {int(self.expiry)}) "
+                f"from values {', '.join('(?)' for _ in missing)}",
+                params=missing
+            ).collect()
+            with self._lock:
+                for name, url in rows:
+                    self._urls[name] = (url, now)
+                    urls[name] = url
+        return urls
+
+    def get(self, session, file_name):
+        return self.get_many(session, [file_name]).get(file_name, "#")
+
+@st.cache_resource
+def get_presigned_url_cache():
+    return PresignedUrlCache()
+
 def run_model(model_name, llm_prompt, session, temperature, max_tokens, top_p, guardrails, stream):
     return complete(
         model=model_name,
@@ -207,10 +509,15 @@ def run_model(model_name, llm_prompt, session, temperature, max_tokens, top_p, g
         stream=stream
     )
 
-def ai_complete_on_text(session, question, retrieved_chunks):
+def ai_complete_on_text(session, question, retrieved_chunks, url_cache=None):
     seen = set()
     enriched_context_blocks = []
 
+    # Presigned URLs of all the chunks' images in one query
+    presigned_urls = (url_cache or get_presigned_url_cache()).get_many(
+        session, [chunk.get("IMAGE_FILE_NAME") for chunk in retrieved_chunks]
+    )
+
     for chunk in retrieved_chunks:
         enriched_chunk = chunk["ENRICHED_CHUNK"]
         original_file = chunk.get("ORIGINAL_FILE_NAME")
@@ -224,10 +531,7 @@ def ai_complete_on_text(session, question, retrieved_chunks):
             continue
         seen.add(key)
 
-        # Generate presigned URL
-        presigned_url = session.sql(
-            f"SELECT GET_PRESIGNED_URL(@cortex_search_tutorial_db.public.doc_repo, '{sql_escape(image_file)}')"
-        ).collect()[0][0]
+        presigned_url = presigned_urls.get(image_file, "#")
 
         # Format for the model
         block = dedent(f"""
@@ -416,19 +720,8 @@ def ai_complete_on_text(session, question, retrieved_chunks):
         "prompt": prompt
     }
     
-def ai_complete_on_image_async(session, question, item, text_answer):
-    image_file_name = item["IMAGE_FILE_NAME"]
-    original_file_name = item.get("ORIGINAL_FILE_NAME", "")
-    page_number = item.get("PAGE_NUMBER", "")
-
-    # Escape for SQL
-    image_file_escaped = sql_escape(image_file_name)
-    original_file_escaped = sql_escape(original_file_name)
-    document_metadata_escaped = sql_escape(original_file_name)
-    page_metadata_escaped = sql_escape(str(page_number))
-    answer_snippet_escaped = sql_escape(text_answer["result"][:2000])
-
-    prompt = dedent(f"""
+def image_critique_prompt(question, text_answer, original_file_name, page_number):
+    return dedent(f"""
     You are an expert visual analyst specializing in ICI Investment Company Fact Book financial charts, 
     tables, and infographics. Your role is to extract precise data from visual elements and validate 
     text-based answers against actual document imagery.
@@ -567,24 +860,373 @@ def ai_complete_on_image_async(session, question, item, text_answer):
     Analysis:
     """)
 
-    prompt_escaped = prompt.replace("'", "\\'")
+def extraction_validation_prompt(question, text_answer, original_file_name, page_number, visual_extraction):
+    return dedent(f"""
+    You are an expert analyst of ICI Investment Company Fact Book financial charts, tables, and
+    infographics. The visual data of a document page was extracted ahead of time into the JSON below.
+    Treat it as the authoritative content of the page image and validate the text-based answer against it.
+
+    **Original Question**: {question.strip()}
+
+    **Text Answer Being Validated**:
+    {text_answer["result"]}
+
+    **Image Source**: Document: `{original_file_name}`, Page: {page_number}
+
+    **Visual Data Extracted From The Page**:
+    {visual_extraction}
+
+    ## VALIDATION TASK:
+    - Compare the text answer values with the extracted visual data point by point
+    - Check that time periods, units, scale factors and scope (geography, fund types) match exactly
+    - Consider footnotes and qualifiers as critical context
+    - Note relevant visual data missing from the text answer; ignore data unrelated to the question
+
+    ## REQUIRED OUTPUT FORMAT:
+
+    CRITIQUE_RESULT: [CONFIRMED/REQUIRES_CORRECTION/NEEDS_ENHANCEMENT] - [Brief assessment with specific reasoning]
+
+    VISUAL_DATA_EXTRACTED: [The values of the extraction relevant to the question, with exact figures, units, and time periods]
+
+    ACCURACY_VALIDATION: [Point-by-point comparison of text answer vs. visual data with specific discrepancies noted]
+
+    SCOPE_ASSESSMENT: [Whether text answer scope matches visual data scope - time period, geography, fund types, completeness]
+
+    FOOTNOTE_ANALYSIS: [Any footnotes, symbols, or qualifiers in the extraction that affect interpretation]
+
+    MISSING_INSIGHTS: [Any relevant data in the extraction but not captured in text answer]
+
+    CORRECTED_ANSWER: [If corrections needed, provide precise corrected answer based on visual data with exact values and proper context]
+
+    CONFIDENCE_IN_VALIDATION: [0.0-1.0 based on completeness of the extraction and certainty of assessment]
+
+    Analysis:
+    """)
+
+def fetch_visual_extraction_confidence(session, image_files):
+    """
+    {IMAGE_FILE_NAME: confidence} of the stored extractions of image_files that are current, i.e.
+    made from the image file now in the stage
+    """
+    if not image_files:
+        return {}
+    rows = session.sql(
+        f"select e.image_file_name, e.confidence from {VISUAL_EXTRACTIONS_TABLE} e "
+        f"join directory({DOC_STAGE}) d on d.relative_path = e.image_file_name and d.md5 = e.content_hash "
+        f"where e.extraction is not null and e.image_file_name in ({', '.join('?' for _ in image_files)})",
+        params=list(dict.fromkeys(image_files))
+    ).collect()
+    return {row[0]: row[1] or 0.0 for row in rows}
+
+def ai_complete_on_extractions_async(session, question, items, text_answer, extracted=None, url_cache=None):
+    """
+    Validate the text answer against the visual data of the pages of items, in one set-based
+    text-only ai_complete query: extracted ({IMAGE_FILE_NAME: visual data}) if given, the stored
+    visual extractions otherwise. Returns rows shaped like those of the image critiques.
+    """
+    images = list({item["IMAGE_FILE_NAME"]: item for item in items}.values())
+    presigned_urls = (url_cache or get_presigned_url_cache()).get_many(
+        session, [item["IMAGE_FILE_NAME"] for item in images]
+    )
+    template = extraction_validation_prompt(
+        question, text_answer, IMAGE_DOCUMENT_MARKER, IMAGE_PAGE_MARKER, IMAGE_EXTRACTION_MARKER
+    )
+
+    params = [template]
+    for item in images:
+        params += [
+            item.get("ORIGINAL_FILE_NAME", ""),
+            item["IMAGE_FILE_NAME"],
+            str(item.get("PAGE_NUMBER", "")),
+            presigned_urls.get(item["IMAGE_FILE_NAME"], "#"),
+            extracted.get(item["IMAGE_FILE_NAME"], "") if extracted is not None else ""
+        ]
+    if extracted is None:
+        visual_data = "to_varchar(extractions.extraction)"
+        source = (f"join {VISUAL_EXTRACTIONS_TABLE} extractions "
+                  "on extractions.image_file_name = images.image_file_name")
+    else:
+        visual_data, source = "images.visual_data", ""
 
     df = session.sql(f"""
+        with prompt_template as (select ? as template)
         select 
-            '{original_file_escaped}' as original_file_name,
-            '{image_file_escaped}' as image_file_name,
-            '{document_metadata_escaped}' as document_metadata,
-            '{page_metadata_escaped}' as page_metadata,
-            get_presigned_url('@CORTEX_SEARCH_TUTORIAL_DB.public.doc_repo', '{image_file_escaped}') as presigned_url,
+            images.original_file_name,
+            images.image_file_name,
+            images.original_file_name as document_metadata,
+            images.page_metadata,
+            images.presigned_url,
             ai_complete(
                 'claude-4-sonnet',
-                '{prompt_escaped}',
-                to_file('@CORTEX_SEARCH_TUTORIAL_DB.public.doc_repo', '{image_file_escaped}'),
+                replace(
+                    replace(
+                        replace(prompt_template.template, '{IMAGE_DOCUMENT_MARKER}', images.original_file_name),
+                        '{IMAGE_PAGE_MARKER}', images.page_metadata
+                    ),
+                    '{IMAGE_EXTRACTION_MARKER}', {visual_data}
+                ),
                 object_construct('temperature', 0.1, 'top_p', 0.9, 'max_tokens', 2500, 'guardrails', FALSE)
             ) as result
+        from (values {', '.join('(?, ?, ?, ?, ?)' for _ in images)})
+            as images (original_file_name, image_file_name, page_metadata, presigned_url, visual_data)
+        {source}
+        cross join prompt_template
+    """, params=params)
+    return df.collect_nowait()
+
+def ai_complete_on_images_async(session, question, items, text_answer):
+    """
+    Critique the page images of items in one set-based ai_complete query, so Snowflake runs the
+    calls in parallel inside the warehouse. The prompt is bound once as a template and filled in
+    per image; one row per distinct IMAGE_FILE_NAME comes back.
+    """
+    images = list({item["IMAGE_FILE_NAME"]: item for item in items}.values())
+    presigned_urls = get_presigned_url_cache().get_many(session, [item["IMAGE_FILE_NAME"] for item in images])
+    template = image_critique_prompt(question, text_answer, IMAGE_DOCUMENT_MARKER, IMAGE_PAGE_MARKER)
+
+    params = [template]
+    for item in images:
+        params += [
+            item.get("ORIGINAL_FILE_NAME", ""),
+            item["IMAGE_FILE_NAME"],
+            str(item.get("PAGE_NUMBER", "")),
+            presigned_urls.get(item["IMAGE_FILE_NAME"], "#")
+        ]
+
+    df = session.sql(f"""
+        with prompt_template as (select ? as template)
+        select 
+            images.original_file_name,
+            images.image_file_name,
+            images.original_file_name as document_metadata,
+            images.page_metadata,
+            images.presigned_url,
+            ai_complete(
+                'claude-4-sonnet',
+                replace(
+                    replace(prompt_template.template, '{IMAGE_DOCUMENT_MARKER}', images.original_file_name),
+                    '{IMAGE_PAGE_MARKER}', images.page_metadata
+                ),
+                to_file('{DOC_STAGE}', images.image_file_name),
+                object_construct('temperature', 0.1, 'top_p', 0.9, 'max_tokens', 2500, 'guardrails', FALSE)
+            ) as result
+        from (values {', '.join('(?, ?, ?, ?)' for _ in images)})
+            as images (original_file_name, image_file_name, page_metadata, presigned_url)
+        cross join prompt_template
+    """, params=params)
+    return df.collect_nowait()
+
+def ai_complete_on_image_async(session, question, item, text_answer):
+    return ai_complete_on_images_async(session, question, [item], text_answer)
+
+def question_visual_extraction_prompt(question, original_file_name, page_number):
+    return dedent(f"""
+    You are an expert visual analyst specializing in ICI Investment Company Fact Book financial charts,
+    tables, and infographics. Extract the visual data of this page image that is relevant to the
+    question below. A separate step will compare it with a text-based answer, so report what the page
+    shows, not an answer.
+
+    **Question**: {question.strip()}
+
+    **Image Source**: Document: `{original_file_name}`, Page: {page_number}
+
+    For every relevant table, chart or infographic, extract:
+    - Its figure or table number ("Figure X.X"), title and type
+    - Units (billions, percentages, ...), time periods and geographic / fund type scope
+    - The exact data values with their row / column, category or series labels
+    - Footnotes, symbols (*, †, ‡) and source lines that qualify them
+
+    ## REQUIRED OUTPUT FORMAT:
+
+    VISUAL_DATA_EXTRACTED: [Specific values, percentages, trends visible in image with exact figures, units, and time periods]
+
+    FOOTNOTE_ANALYSIS: [Any footnotes, symbols, or qualifiers visible that affect interpretation]
+
+    EXTRACTION_CONFIDENCE: [0.0-1.0 based on clarity of visual data and completeness of extraction]
+
+    Extraction:
     """)
+
+def extract_visual_data_async(session, question, items):
+    """
+    Question-only visual data extraction of the page images of items, in one set-based
+    ai_complete query; needs no text answer, so it can run while the text is analyzed.
+    """
+    images = list({item["IMAGE_FILE_NAME"]: item for item in items}.values())
+    template = question_visual_extraction_prompt(question, IMAGE_DOCUMENT_MARKER, IMAGE_PAGE_MARKER)
+
+    params = [template]
+    for item in images:
+        params += [item.get("ORIGINAL_FILE_NAME", ""), item["IMAGE_FILE_NAME"], str(item.get("PAGE_NUMBER", ""))]
+
+    df = session.sql(f"""
+        with prompt_template as (select ? as template)
+        select 
+            images.image_file_name,
+            ai_complete(
+                'claude-4-sonnet',
+                replace(
+                    replace(prompt_template.template, '{IMAGE_DOCUMENT_MARKER}', images.original_file_name),
+                    '{IMAGE_PAGE_MARKER}', images.page_metadata
+                ),
+                to_file('{DOC_STAGE}', images.image_file_name),
+                object_construct('temperature', 0.1, 'top_p', 0.9, 'max_tokens', 1500, 'guardrails', FALSE)
+            ) as result
+        from (values {', '.join('(?, ?, ?)' for _ in images)})
+            as images (original_file_name, image_file_name, page_metadata)
+        cross join prompt_template
+    """, params=params)
     return df.collect_nowait()
 
+def fetch_visual_extractions(session, image_files):
+    """{IMAGE_FILE_NAME: extraction JSON} of the stored visual extractions of image_files"""
+    if not image_files:
+        return {}
+    rows = session.sql(
+        f"select image_file_name, to_varchar(extraction) from {VISUAL_EXTRACTIONS_TABLE} "
+        f"where extraction is not null and image_file_name in ({', '.join('?' for _ in image_files)})",
+        params=list(image_files)
+    ).collect()
+    return {row[0]: row[1] for row in rows}
+
+def build_question_pipeline(session, question, chunks, images, offline_images, deadline):
+    """
+    Steps 4-7 as a DAG (see pipeline.py):
+
+        text_answer ------+--> citations
+                          |
+                          +--> reconcile
+                          |
+        visual_extraction +
+
+    visual_extraction starts with the text analysis: stored extractions for offline_images,
+    question-only extraction from the image for the others. reconcile then validates the text
+    answer against that data with a text-only call.
+
+    The nodes run on pool threads without a ScriptRunContext, so nothing they call may use st:
+    the shared presigned URL cache is resolved here, on the script thread.
+    """
+    pipeline = Pipeline(deadline=deadline)
+    url_cache = get_presigned_url_cache()
+
+    def visual_extraction():
+        extracted = fetch_visual_extractions(session, sorted(offline_images))
+        live = [item for item in images if item["IMAGE_FILE_NAME"] not in extracted]
+        if live:
+            rows = pipeline.wait_for_job(extract_visual_data_async(session, question, live))
+            extracted.update({row["IMAGE_FILE_NAME"]: row["RESULT"] for row in (r.asDict() for r in rows)})
+        return extracted
+
+    def reconcile(text_answer, visual_extraction):
+        items = [item for item in images if item["IMAGE_FILE_NAME"] in visual_extraction]
+        if not items:
+            return []
+        job = ai_complete_on_extractions_async(
+            session, question, items, text_answer, extracted=visual_extraction, url_cache=url_cache
+        )
+        return [critique_result(row.asDict()) for row in pipeline.wait_for_job(job)]
+
+    pipeline.add("text_answer", lambda: ai_complete_on_text(session, question, chunks, url_cache))
+    pipeline.add("citations", lambda text_answer: extract_cited_docs_and_pages(text_answer["result"]),
+                 deps=("text_answer",))
+    if images:
+        pipeline.add("visual_extraction", visual_extraction)
+        pipeline.add("reconcile", reconcile, deps=("text_answer", "visual_extraction"))
+    return pipeline
+
+def pipeline_answers(run, deadline):
+    """
+    (answer_text, cited_docs_pages, image_critiques) of a question pipeline run, from whatever
+    finished before the deadline: the unreconciled visual data if reconcile did not finish.
+    """
+    if run.done("text_answer"):
+        answer_text = run.results["text_answer"]
+    else:
+        reason = run.errors.get("text_answer") or f"not finished within {deadline}s"
+        answer_text = {"result": f"⏱️ The text analysis did not complete ({reason}).", "metadata": {}}
+    cited_docs_pages = run.results.get("citations") or {}
+
+    if run.done("reconcile"):
+        image_critiques = [critique["RESULT"] for critique in run.results["reconcile"]]
+    elif run.done("visual_extraction"):
+        image_critiques = [
+            f"**{image_file}** (not validated against the text answer):\n{data}"
+            for image_file, data in run.results["visual_extraction"].items()
+        ]
+    else:
+        image_critiques = []
+    return answer_text, cited_docs_pages, [c for c in image_critiques if c and c.strip()]
+
+def run_image_critiques(session, question, items, text_answer, max_concurrent, timeout,
+                        batch_size=1, on_result=None, offline_images=()):
+    """
+    Run the image critiques of items as concurrent Snowpark async jobs of batch_size images each
+    (one set-based query per job), at most max_concurrent jobs at a time, and resolve them in
+    completion order. A job still running after timeout seconds is cancelled.
+    Items whose IMAGE_FILE_NAME is in offline_images are validated against their stored visual
+    extraction instead, all in one text-only job submitted first.
+    on_result(index, result, seconds) is called as each critique finishes.
+
+    Returns the resolved results in the order of items; timed out ones have "TIMED_OUT": True and
+    the ones validated from stored extractions "OFFLINE_EXTRACTION": True.
+    """
+    offline = [i for i, item in enumerate(items) if item["IMAGE_FILE_NAME"] in offline_images]
+    live = [i for i, item in enumerate(items) if item["IMAGE_FILE_NAME"] not in offline_images]
+    queued = [(live[i:i + batch_size], ai_complete_on_images_async) for i in range(0, len(live), batch_size)]
+    if offline:
+        queued.insert(0, (offline, ai_complete_on_extractions_async))
+    running = []  # (batch of indices, job, submitted at)
+    results = [None] * len(items)
+
+    def finish(batch, batch_results, seconds):
+        for index in batch:
+            results[index] = batch_results[index]
+            if on_result:
+                on_result(index, results[index], seconds)
+
+    while queued or running:
+        while queued and len(running) < max_concurrent:
+            batch, submit = queued.pop(0)
+            try:
+                job = submit(session, question, [items[i] for i in batch], text_answer)
+            except Exception as e:
+                finish(batch, {i: critique_error(e, items[i]) for i in batch}, 0.0)
+                continue
+            running.append((batch, job, time.time()))
+
+        for entry in list(running):
+            batch, job, submitted = entry
+            elapsed = time.time() - submitted
+            if job.is_done():
+                try:
+                    by_image = resolve_async_batch_job(job)
+                    batch_results = {
+                        i: by_image.get(items[i]["IMAGE_FILE_NAME"]) or critique_error("no result", items[i])
+                        for i in batch
+                    }
+                except Exception as e:
+                    batch_results = {i: critique_error(e, items[i]) for i in batch}
+            elif elapsed > timeout:
+                try:
+                    job.cancel()
+                except Exception as e:
+                    print(f"DEBUG: Could not cancel critique job {job.query_id}: {e}")
+                batch_results = {
+                    i: {**critique_error(f"timed out after {timeout}s", items[i]), "TIMED_OUT": True}
+                    for i in batch
+                }
+            else:
+                continue
+            running.remove(entry)
+            if batch is offline:
+                batch_results = {i: {**result, "OFFLINE_EXTRACTION": True} for i, result in batch_results.items()}
+            finish(batch, batch_results, elapsed)
+
+        if running:
+            time.sleep(IMAGE_CRITIQUE_POLL_INTERVAL)
+
+    return results
+
 def synthesise_all_answers(session, question, text_answer_dict, image_answer_dicts):
     text_result = text_answer_dict["result"]
     text_meta = text_answer_dict.get("metadata", {})
@@ -747,98 +1389,10 @@ def synthesise_all_answers(session, question, text_answer_dict, image_answer_dic
 
     return "".join(result)
 
-import re
-
 def smart_chunk_selection(chunks, question, max_chunks=10):
     """ENHANCED HYBRID CHUNK SELECTION: Balances enriched context with raw text precision"""
-    
-    # ICI-specific high-value keywords with enhanced weighting
-    ici_keywords = {
-        'asset': 3, 'allocation': 3, 'class': 2, 'total': 3, 'net': 2,
-        'equity': 2, 'fixed': 2, 'income': 2, 'money': 2, 'market': 2,
-        'mutual': 2, 'fund': 2, 'etf': 2, 'exchange': 2, 'traded': 2,
-        'billion': 3, 'trillion': 3, 'percentage': 2, 'breakdown': 3,
-        'domestic': 2, 'international': 2, 'flow': 2, 'investment': 1,
-        'company': 1, 'registered': 2, '2023': 3, '2022': 2
-    }
-    
-    question_words = [word.lower().strip('.,!?') for word in question.split()]
-    
-    scored_chunks = []
-    for chunk in chunks:
-        # HYBRID SCORING: Consider both enriched and raw content
-        enriched_text = chunk.get("ENRICHED_CHUNK", "").lower()
-        raw_text = chunk.get("RAW_CHUNK_TEXT", "").lower()
-        
-        # Base relevance from question keywords in BOTH texts
-        enriched_base = sum(3 for word in question_words if len(word) > 3 and word in enriched_text)
-        raw_base = sum(4 for word in question_words if len(word) > 3 and word in raw_text)  # Higher weight for exact matches
-        
-        # ICI-specific scoring for both texts
-        enriched_ici = sum(weight for term, weight in ici_keywords.items() if term in enriched_text)
-        raw_ici = sum(weight * 1.2 for term, weight in ici_keywords.items() if term in raw_text)  # Slight boost for raw
-        
-        # Numerical data bonuses (more likely in raw text for exact figures)
-        enriched_numerical = len(re.findall(r'\b\d+\.?\d*\b', enriched_text)) * 0.3
-        raw_numerical = len(re.findall(r'\b\d+\.?\d*\b', raw_text)) * 0.8  # Higher weight for raw numbers
-        
-        # Percentage bonuses
-        enriched_percentage = len(re.findall(r'\b\d+\.?\d*%', enriched_text)) * 0.5
-        raw_percentage = len(re.findall(r'\b\d+\.?\d*%', raw_text)) * 1.2  # Raw percentages more precise
-        
-        # Year bonuses for both
-        enriched_year = 1 if '2023' in enriched_text else (0.5 if '2022' in enriched_text else 0)
-        raw_year = 2 if '2023' in raw_text else (1 if '2022' in raw_text else 0)
-        
-        # QUALITY BONUSES:
-        # Enriched chunks with visual context get bonus
-        visual_bonus = 1 if 'visual context' in enriched_text or 'chart' in enriched_text or 'table' in enriched_text else 0
-        
-        # Raw chunks with exact financial terms get bonus
-        financial_bonus = 1 if any(term in raw_text for term in ['$', 'billion', 'trillion', 'assets', 'net']) else 0
-        
-        # HYBRID TOTAL SCORE
-        total_score = (
-            enriched_base + raw_base +
-            enriched_ici + raw_ici +
-            enriched_numerical + raw_numerical +
-            enriched_percentage + raw_percentage +
-            enriched_year + raw_year +
-            visual_bonus + financial_bonus
-        )
-        
-        scored_chunks.append((total_score, chunk))
-    
-    # Sort by score and take top chunks
-    scored_chunks.sort(key=lambda x: x[0], reverse=True)
-    
-    # BALANCED SELECTION: Ensure mix of high-context and high-precision chunks
-    selected_chunks = []
-    enriched_heavy = 0
-    raw_heavy = 0
-    
-    for score, chunk in scored_chunks[:max_chunks * 2]:  # Consider more candidates
-        if len(selected_chunks) >= max_chunks:
-            break
-            
-        enriched_text = chunk.get("ENRICHED_CHUNK", "")
-        raw_text = chunk.get("RAW_CHUNK_TEXT", "")
-        
-        # Determine if chunk is enriched-heavy or raw-heavy based on content length/richness
-        is_enriched_heavy = len(enriched_text) > len(raw_text) * 2
-        is_raw_heavy = len(raw_text) > 100 and any(char.isdigit() for char in raw_text)
-        
-        # Balance selection
-        if is_enriched_heavy and enriched_heavy < max_chunks * 0.6:  # Up to 60% enriched
-            selected_chunks.append(chunk)
-            enriched_heavy += 1
-        elif is_raw_heavy and raw_heavy < max_chunks * 0.5:  # Up to 50% raw-focused
-            selected_chunks.append(chunk)
-            raw_heavy += 1
-        elif len(selected_chunks) < max_chunks:  # Fill remaining slots
-            selected_chunks.append(chunk)
-    
-    return selected_chunks 
+    # Scored for all chunks at once with NumPy, see chunk_scoring.py
+    return select_chunks(chunks, question, max_chunks)
 
 # ========================================
 # STREAMLIT APPLICATION LOGIC
@@ -860,6 +1414,40 @@ with st.sidebar:
     st.markdown("**Image Analysis:**")
     MAX_IMAGES_TO_ANALYZE = st.slider("Max Images to Analyze", 1, 20, 8)
     st.write(f"Currently analyzing top {MAX_IMAGES_TO_ANALYZE} images")
+    IMAGE_CRITIQUE_TIMEOUT = st.slider("Image Critique Timeout (seconds)", 30, 300, 120)
+    BATCH_IMAGE_CRITIQUES = st.checkbox(
+        "Batch Image Critiques", value=True,
+        help="Critique all images in one set-based query instead of one query per image. "
+             "Unbatched critiques are shown one by one as they finish."
+    )
+    SPECULATIVE_PIPELINE = st.checkbox(
+        "Parallel Text + Image Analysis", value=True,
+        help="Extract the visual data of the matched pages while the text answer is generated, then "
+             "reconcile both in one text-only pass, instead of critiquing the images after the text answer."
+    )
+    PIPELINE_DEADLINE = st.slider(
+        "Pipeline Deadline (seconds)", 30, 300, 120, disabled=not SPECULATIVE_PIPELINE,
+        help="After this, the answer is built from the steps that finished."
+    )
+    st.markdown("**Retrieval:**")
+    RETRIEVAL_MODE = RETRIEVAL_MODES[st.selectbox(
+        "Retrieval Mode", list(RETRIEVAL_MODES),
+        help="Two-phase modes rank pages from a small set of light search results, then fetch full "
+             "text for the top pages only. RRF rerank queries each index separately and fuses them "
+             "with the weights tuned by tune_rerank.py, and keeps its page order instead of the "
+             "keyword heuristics."
+    )]
+    TWO_PHASE_PAGES = st.slider("Pages to Fetch", 5, 50, 20, disabled=RETRIEVAL_MODE is None)
+    st.markdown("**Visual Extractions:**")
+    USE_VISUAL_EXTRACTIONS = st.checkbox(
+        "Use Stored Visual Extractions", value=True,
+        help="Validate the answer against the page data extracted offline by visual_extraction.py, "
+             "and only send page images without a current extraction to the vision model."
+    )
+    VISUAL_EXTRACTION_MIN_CONFIDENCE = st.slider(
+        "Min Extraction Confidence", 0.0, 1.0, 0.7, 0.05, disabled=not USE_VISUAL_EXTRACTIONS,
+        help="Pages whose stored extraction is less confident are critiqued from the image."
+    )
     
     if st.button("🔄 Reset All"):
         # Clear all session state
@@ -887,15 +1475,28 @@ if user_question and submit_clicked:
     with st.spinner("🔍 Processing your question..."):
         start_time = time.time()
         
+        # The pipeline runs text analysis, citations and image synthesis as one step
+        total_steps, citation_step = (5, 5) if SPECULATIVE_PIPELINE else (7, 6)
+
         # Step 1: Search
-        st.write("🔍 Step 1 of 7: Searching vector database...")
+        st.write(f"🔍 Step 1 of {total_steps}: Searching vector database...")
         root = Root(sp_session)
         search_service = (root
             .databases["CORTEX_SEARCH_TUTORIAL_DB"]
             .schemas["PUBLIC"]
             .cortex_search_services["DOCS_SEARCH_SERVICE"]
         )
-        search_results = query_multi_index_search_service(sp_session, search_service, user_question)
+        embedding_lookup = {}
+        retrieval_stats = {}
+        if RETRIEVAL_MODE:
+            search_results, retrieval_stats = two_phase_retrieval(
+                sp_session, search_service, user_question, TWO_PHASE_PAGES,
+                make_ranker(RETRIEVAL_MODE, user_question), embedding_lookup=embedding_lookup
+            )
+        else:
+            search_results = query_multi_index_search_service(
+                sp_session, search_service, user_question, embedding_lookup=embedding_lookup
+            )
         
         # Parse JSON string to Python object if needed
         if isinstance(search_results, str):
@@ -908,20 +1509,14 @@ if user_question and submit_clicked:
             search_results = search_results['data']
         
         # Step 2: Smart chunk selection
-        st.write("🧠 Step 2 of 7: Smart chunk selection...")
-        deduped_results = smart_chunk_selection(search_results, user_question)
-        
-        # Step 3: Text analysis
-        st.write("📝 Step 3 of 7: Analyzing text content...")
-        answer_text = ai_complete_on_text(sp_session, user_question, deduped_results)
-        
-        # Step 4: Extract citations
-        st.write("📚 Step 4 of 7: Extracting citations...")
-        answer_text_str = answer_text.get("result", "") if isinstance(answer_text, dict) else str(answer_text)
-        cited_docs_pages = extract_cited_docs_and_pages(answer_text_str)
+        st.write(f"🧠 Step 2 of {total_steps}: Smart chunk selection...")
+        if RETRIEVAL_MODE == "rrf":
+            deduped_results = select_ranked_chunks(search_results)
+        else:
+            deduped_results = smart_chunk_selection(search_results, user_question)
         
-        # Step 5: Match images
-        st.write("🖼️ Step 5 of 7: Matching relevant images...")
+        # Step 3: Match images (needs only the selected chunks)
+        st.write(f"🖼️ Step 3 of {total_steps}: Matching relevant images...")
         
         def score_image_relevance(item, question):
             """Score image relevance based on multiple factors"""
@@ -957,7 +1552,12 @@ if user_question and submit_clicked:
         # Get all available images and score them
         all_images = [result for result in deduped_results if result.get('IMAGE_FILE_NAME')]
         
-        if all_images:
+        if all_images and RETRIEVAL_MODE == "rrf":
+            # Already in fused rank order: one image per page
+            matched_images = list({item['IMAGE_FILE_NAME']: item for item in reversed(all_images)}.values())
+            matched_images = matched_images[::-1][:MAX_IMAGES_TO_ANALYZE]
+            st.write(f"Found {len(all_images)} total images, analyzing top {len(matched_images)} ranked pages")
+        elif all_images:
             scored_images = [(item, score_image_relevance(item, user_question)) for item in all_images]
             scored_images.sort(key=lambda x: x[1], reverse=True)
             matched_images = [item for item, score in scored_images[:MAX_IMAGES_TO_ANALYZE]]
@@ -966,8 +1566,53 @@ if user_question and submit_clicked:
             matched_images = []
             st.write("No images found for analysis")
         
-        # Step 6: Process citations and create fallback if needed
-        st.write("⚙️ Step 6 of 7: Processing citations...")
+        offline_images = set()
+        if matched_images and USE_VISUAL_EXTRACTIONS:
+            try:
+                confidence = fetch_visual_extraction_confidence(
+                    sp_session, [item['IMAGE_FILE_NAME'] for item in matched_images]
+                )
+                offline_images = {image for image, c in confidence.items() if c >= VISUAL_EXTRACTION_MIN_CONFIDENCE}
+            except Exception as e:
+                print(f"DEBUG: No stored visual extractions, critiquing all images live: {e}")
+        
+        image_critiques = []
+        critique_timings = {'wall_clock': 0.0, 'slowest': 0.0, 'timed_out': 0, 'offline': 0}
+        pipeline_timings = {}
+        if SPECULATIVE_PIPELINE:
+            # Step 4: the text answer and the visual extraction of the matched pages run at the
+            # same time as a DAG, and a text-only pass reconciles them once both are done
+            st.write(f"⚡ Step 4 of {total_steps}: Analyzing text and extracting image data in parallel...")
+            node_container = st.container()
+            
+            def show_node(name, timing):
+                node_container.write(f"{PIPELINE_STATUS_ICONS.get(timing.status, '•')} {name}: "
+                                     f"{timing.status} ({timing.seconds:.1f}s)")
+            
+            pipeline_run = build_question_pipeline(
+                sp_session, user_question, deduped_results, matched_images, offline_images, PIPELINE_DEADLINE
+            ).run(on_node_done=show_node)
+            answer_text, cited_docs_pages, image_critiques = pipeline_answers(pipeline_run, PIPELINE_DEADLINE)
+            answer_text_str = answer_text["result"]
+            pipeline_timings = {name: asdict(timing) for name, timing in pipeline_run.timings.items()}
+            if matched_images:
+                critique_timings['wall_clock'] = pipeline_run.seconds
+                critique_timings['slowest'] = max(pipeline_run.timings["visual_extraction"].seconds,
+                                                  pipeline_run.timings["reconcile"].seconds)
+                critique_timings['timed_out'] = 0 if pipeline_run.done("reconcile") else len(matched_images)
+                critique_timings['offline'] = len(offline_images)
+        else:
+            # Step 4: Text analysis
+            st.write(f"📝 Step 4 of {total_steps}: Analyzing text content...")
+            answer_text = ai_complete_on_text(sp_session, user_question, deduped_results)
+        
+            # Step 5: Extract citations
+            st.write(f"📚 Step 5 of {total_steps}: Extracting citations...")
+            answer_text_str = answer_text.get("result", "") if isinstance(answer_text, dict) else str(answer_text)
+            cited_docs_pages = extract_cited_docs_and_pages(answer_text_str)
+        
+        # Step 6 (5 with the pipeline): Process citations and create fallback if needed
+        st.write(f"⚙️ Step {citation_step} of {total_steps}: Processing citations...")
         
         if not cited_docs_pages:
             st.write("⚠️ No citations found - activating fallback mode")
@@ -979,33 +1624,46 @@ if user_question and submit_clicked:
                 cited_docs_pages[doc_name].add(page_num)
             st.write(f"✅ Created fallback citations for {len(cited_docs_pages)} documents")
         
-        # Step 7: Synthesize
-        st.write("🧪 Step 7 of 7: Synthesize final answer")
-        st.write("Synthesizing text + image answers into a final response...")
+        if not SPECULATIVE_PIPELINE:
+            # Step 7: Synthesize
+            st.write(f"🧪 Step 7 of {total_steps}: Synthesize final answer")
+            st.write("Synthesizing text + image answers into a final response...")
         
-        # Process images with progress tracking
-        image_critiques = []
-        if matched_images:
-            progress_placeholder = st.empty()
+            # Process images concurrently, showing each critique as it finishes
+            if matched_images:
+                progress_placeholder = st.empty()
+                progress_placeholder.text(f"Processing image critiques... (0/{len(matched_images)})")
+                critique_container = st.container()
+                finished = []
             
-            def process_limited_images():
-                """Process images synchronously using Snowpark jobs"""
-                critiques = []
-                
-                for i, result in enumerate(matched_images):
-                    progress_placeholder.text(f"Processing image critiques... ({i+1}/{len(matched_images)})")
-                    
-                    job = ai_complete_on_image_async(sp_session, user_question, result, answer_text)
-                    resolved_result = resolve_async_job(job)
-                    critique = resolved_result.get("RESULT", "") if resolved_result else ""
-                    
-                    if critique and critique.strip():
-                        critiques.append(critique)
-                
-                return critiques
+                def show_critique(index, resolved_result, seconds):
+                    finished.append(seconds)
+                    critique_timings['slowest'] = max(critique_timings['slowest'], seconds)
+                    progress_placeholder.text(f"Processing image critiques... ({len(finished)}/{len(matched_images)})")
+                    item = matched_images[index]
+                    source = ", stored extraction" if resolved_result.get("OFFLINE_EXTRACTION") else ""
+                    with critique_container.expander(
+                        f"🖼️ Image {index + 1}: {item.get('ORIGINAL_FILE_NAME', 'Unknown')} "
+                        f"page {item.get('PAGE_NUMBER', '?')} ({seconds:.1f}s{source})"
+                    ):
+                        st.markdown(resolved_result.get("RESULT", ""))
             
-            image_critiques = process_limited_images()
-            progress_placeholder.empty()
+                critique_start = time.time()
+                resolved_results = run_image_critiques(
+                    sp_session, user_question, matched_images, answer_text,
+                    max_concurrent=MAX_IMAGES_TO_ANALYZE, timeout=IMAGE_CRITIQUE_TIMEOUT,
+                    batch_size=len(matched_images) if BATCH_IMAGE_CRITIQUES else 1,
+                    on_result=show_critique, offline_images=offline_images
+                )
+                critique_timings['wall_clock'] = time.time() - critique_start
+                critique_timings['timed_out'] = sum(1 for r in resolved_results if r.get("TIMED_OUT"))
+                critique_timings['offline'] = sum(1 for r in resolved_results if r.get("OFFLINE_EXTRACTION"))
+            
+                for resolved_result in resolved_results:
+                    critique = resolved_result.get("RESULT", "") if not resolved_result.get("TIMED_OUT") else ""
+                    if critique and critique.strip():
+                        image_critiques.append(critique)
+                progress_placeholder.empty()
         
         # Combine text and image results
         final_answer = answer_text_str
@@ -1027,6 +1685,10 @@ if user_question and submit_clicked:
             'cited_docs_pages': cited_docs_pages,
             'image_critiques': image_critiques,
             'final_answer': final_answer,
+            'embedding_lookup': embedding_lookup,
+            'retrieval_stats': retrieval_stats,
+            'critique_timings': critique_timings,
+            'pipeline_timings': pipeline_timings,
             'total_time': total_time
         }
         st.session_state.main_question_processed = True
@@ -1056,6 +1718,13 @@ if st.session_state.main_question_processed and 'main_results' in st.session_sta
         st.write("**🔍 DIAGNOSTIC - Search Results:**")
         st.write(f"Total search results: {len(results['search_results']) if results['search_results'] else 0}")
         st.write(f"After smart selection: {len(results['deduped_results']) if results['deduped_results'] else 0}")
+        retrieval_stats = results.get('retrieval_stats') or {}
+        if retrieval_stats:
+            st.write(f"Two-phase retrieval ({retrieval_stats['ranker']} ranker): {retrieval_stats['candidates']} light candidates "
+                     f"(limit {retrieval_stats['candidate_limit']}) in {retrieval_stats['phase_one_seconds']:.2f}s, "
+                     f"then {retrieval_stats['chunks']} full-text chunks of the top {retrieval_stats['pages']} pages "
+                     f"in {retrieval_stats['phase_two_seconds']:.2f}s, "
+                     f"{retrieval_stats['payload_chars']:,} characters fetched")
         
         st.write("**🔍 DIAGNOSTIC - Extracted Citations:**")
         st.write(f"Citations found: {dict(results['cited_docs_pages']) if results['cited_docs_pages'] else {}}")
@@ -1073,6 +1742,34 @@ if st.session_state.main_question_processed and 'main_results' in st.session_sta
         st.write("**🔍 DIAGNOSTIC - Final Results:**")
         st.write(f"Total jobs created: {len(results['image_critiques'])}")
         st.write(f"Successful critiques: {len([c for c in results['image_critiques'] if c and c.strip()])}")
+        critique_timings = results.get('critique_timings') or {}
+        if critique_timings.get('wall_clock'):
+            st.write(f"Image critiques: {critique_timings['wall_clock']:.1f}s wall clock, "
+                     f"slowest single critique {critique_timings['slowest']:.1f}s, "
+                     f"{critique_timings['timed_out']} timed out, "
+                     f"{critique_timings.get('offline', 0)} validated from stored extractions")
+        
+        pipeline_timings = results.get('pipeline_timings') or {}
+        if pipeline_timings:
+            st.write("**🔍 DIAGNOSTIC - Pipeline Nodes:**")
+            st.table(pd.DataFrame([
+                {"node": name, "status": t["status"],
+                 "started (s)": round(t["started"], 2) if t["started"] is not None else None,
+                 "duration (s)": round(t["seconds"], 2), "error": t["error"] or ""}
+                for name, t in pipeline_timings.items()
+            ]))
+        
+        st.write("**🔍 DIAGNOSTIC - Query Embedding Cache:**")
+        lookup = results.get('embedding_lookup') or {}
+        if lookup:
+            st.write(f"This question: {lookup['tier']} ({lookup['seconds'] * 1000:.0f} ms)")
+        cache_stats = get_query_embedding_cache().stats()
+        st.write(f"Hit rate: {cache_stats['hit_rate']:.0%} of {cache_stats['lookups']} lookups, "
+                 f"{cache_stats['entries']} embeddings in memory")
+        st.table(pd.DataFrame([
+            {"tier": tier, "lookups": s["count"], "avg latency (ms)": round(s["avg_ms"], 1)}
+            for tier, s in cache_stats["tiers"].items()
+        ]))
 
 # ========================================
 # IMAGE ANALYSIS SECTION (COMPLETELY INDEPENDENT)
@@ -1085,6 +1782,9 @@ if st.session_state.main_question_processed and 'main_results' in st.session_sta
     with st.expander("🔍 Debug - Raw Image Answers"):
         if matched_images:
             st.write(f"Found {len(matched_images)} relevant images for analysis:")
+            image_urls = get_presigned_url_cache().get_many(
+                sp_session, [ans.get('IMAGE_FILE_NAME') for ans in matched_images]
+            )
             
             for i, ans in enumerate(matched_images):
                 st.markdown(f"### 📄 **Image {i+1}**")
@@ -1095,6 +1795,8 @@ if st.session_state.main_question_processed and 'main_results' in st.session_sta
                     st.write(f"**📄 Document:** {ans.get('ORIGINAL_FILE_NAME', 'Unknown')}")
                     st.write(f"**🖼️ Image File:** {ans.get('IMAGE_FILE_NAME', 'Unknown')}")
                     st.write(f"**📄 Page:** {ans.get('PAGE_NUMBER', 'Unknown')}")
+                    if ans.get('IMAGE_FILE_NAME') in image_urls:
+                        st.markdown(f"[🔗 Open page image]({image_urls[ans['IMAGE_FILE_NAME']]})")
                 
                 with col2:
                     content_preview = ans.get('ENRICHED_CHUNK', 'No content available')[:200]
@@ -0,0 +1,245 @@
+"""
+Tune and benchmark the rerank.py page rankers on a labeled question set
+
+The labeled set is a JSONL file with one question per line and the page images that answer it:
+
+    {"question": "What was the total net assets of US ETFs in 2023?",
+     "relevant_pages": ["PARSED/paged_image/2023-factbook_page_12.png"]}
+
+Run in two steps:
+
+    collect   embeds every question the way the app does (question rendered to an image,
+              uploaded to the stage, AI_EMBED), runs the ServiceRanker query and the per-index
+              RRFRanker queries against DOCS_SEARCH_SERVICE and saves the ranked lists and
+              latencies to a JSON file
+    tune      offline, on the collected lists: reports precision@10, recall@10 and MRR of the
+              service fusion, RRF with the default weights and RRF with tuned weights, and writes
+              the weights and k of a grid search over all questions to rerank_weights.json for
+              the app
+
+The tuned RRF metrics are k-fold cross-validated: the grid search runs on all folds but one and
+the weights it picks are scored on the held-out fold, so every question is scored by weights
+tuned without it. Those held-out metrics are the ones compared with the service fusion and
+stored in rerank_weights.json; the metrics of the final weights on the questions they were
+tuned on are shown too, as an upper bound, but say nothing about new questions.
+
+Tune on the collected lists as often as needed; only collect queries Snowflake.
+
+Usage:
+    python tune_rerank.py collect --connection my_conn --questions questions.jsonl --out runs.json
+    python tune_rerank.py tune --runs runs.json
+    python tune_rerank.py tune --runs runs.json --folds 10 --dry-run
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from rerank import DEFAULT_WEIGHTS, INDEXES, RRF_K, WEIGHTS_FILE, RRFRanker, ServiceRanker, weighted_rrf
+
+EMBEDDING_MODEL = "voyage-multimodal-3"
+STAGE = "@cortex_search_tutorial_db.public.doc_repo"
+WEIGHT_GRID = (0.0, 0.5, 1.0, 1.5, 2.0)
+K_GRID = (10, 30, 60)
+TOP_N = 10
+
+
+def embed_question(session, question):
+    """AI_EMBED of the question rendered to an image, as get_text_embedding_via_image does"""
+    from PIL import Image, ImageDraw, ImageFont
+
+    image = Image.new("RGB", (1000, 200), "white")
+    ImageDraw.Draw(image).text((10, 10), question, fill="black", font=ImageFont.load_default())
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, f"tune_{abs(hash(question))}.png")
+        image.save(path)
+        session.file.put(path, f"{STAGE}/queries", overwrite=True, auto_compress=False)
+    file_name = os.path.basename(path)
+    return session.sql(f"select AI_EMBED('{EMBEDDING_MODEL}', '{STAGE}+queries/{file_name}')").collect()[0][0]
+
+
+def collect(args):
+    from snowflake.core import Root
+    from snowflake.snowpark import Session
+
+    session = Session.builder.config("connection_name", args.connection).create()
+    service = (Root(session)
+        .databases["CORTEX_SEARCH_TUTORIAL_DB"]
+        .schemas["PUBLIC"]
+        .cortex_search_services["DOCS_SEARCH_SERVICE"]
+    )
+    rankers = [ServiceRanker(limit=args.service_limit), RRFRanker(weights=DEFAULT_WEIGHTS, limit=args.index_limit)]
+
+    runs = []
+    with open(args.questions) as f:
+        labeled = [json.loads(line) for line in f if line.strip()]
+    for i, item in enumerate(labeled, start=1):
+        embedding = embed_question(session, item["question"])
+        run = {**item, "lists": {}, "seconds": {}}
+        for ranker in rankers:
+            start = time.perf_counter()
+            lists = ranker.search(service, item["question"], embedding)
+            run["seconds"][ranker.name] = time.perf_counter() - start
+            run["lists"].update(
+                {index: [row.get("IMAGE_FILE_NAME") for row in rows] for index, rows in lists.items()}
+            )
+        runs.append(run)
+        print(f"  {i}/{len(labeled)} service {run['seconds']['service']:.2f}s, "
+              f"rrf {run['seconds']['rrf']:.2f}s: {item['question'][:60]}")
+
+    with open(args.out, "w") as f:
+        json.dump(runs, f, indent=1)
+    print(f"saved {len(runs)} runs to {args.out}")
+
+
+def as_rows(pages):
+    return [{"IMAGE_FILE_NAME": page} for page in pages]
+
+
+def service_ranking(run):
+    return [page["IMAGE_FILE_NAME"] for page in ServiceRanker().fuse({"service": as_rows(run["lists"]["service"])})]
+
+
+def rrf_ranking(run, weights, k):
+    lists = {index: as_rows(run["lists"].get(index, [])) for index in INDEXES}
+    return [page["IMAGE_FILE_NAME"] for page in weighted_rrf(lists, weights, k)]
+
+
+def run_metrics(ranking, run, n=TOP_N):
+    """Precision@n, recall@n and reciprocal rank of one ranking"""
+    relevant = set(run["relevant_pages"])
+    hits = [page in relevant for page in ranking]
+    return (
+        sum(hits[:n]) / n,
+        sum(hits[:n]) / len(relevant) if relevant else 0.0,
+        1.0 / (hits.index(True) + 1) if True in hits else 0.0,
+    )
+
+
+def mean_metrics(per_run, n=TOP_N):
+    precision, recall, reciprocal_rank = zip(*per_run)
+    return {
+        f"p@{n}": statistics.mean(precision),
+        f"recall@{n}": statistics.mean(recall),
+        "mrr": statistics.mean(reciprocal_rank),
+    }
+
+
+def metrics(rankings, runs, n=TOP_N):
+    """Mean precision@n, recall@n and MRR of one ranking per run"""
+    return mean_metrics([run_metrics(ranking, run, n) for ranking, run in zip(rankings, runs)], n)
+
+
+def grid(runs):
+    """
+    (weights, k, per-run metrics) of every grid point. The rankings are computed once, and the
+    grid searches of the cross-validation folds only average them over their questions.
+    """
+    points = []
+    for values in itertools.product(WEIGHT_GRID, repeat=len(INDEXES)):
+        if not any(values):
+            continue
+        weights = dict(zip(INDEXES, values))
+        for k in K_GRID:
+            points.append((weights, k, [run_metrics(rrf_ranking(run, weights, k), run) for run in runs]))
+    return points
+
+
+def grid_search(points, questions):
+    """
+    The grid point with the best precision@10 on the given question indices, ties broken by MRR,
+    and its metrics on them.
+    """
+    best = None
+    for point in points:
+        result = mean_metrics([point[2][i] for i in questions])
+        key = (result[f"p@{TOP_N}"], result["mrr"])
+        if best is None or key > best[0]:
+            best = key, point, result
+    return best[1:]
+
+
+def cross_validate(points, runs, folds, seed=0):
+    """
+    Metrics of RRF with weights tuned by k-fold cross-validation: each question is scored with
+    the weights and k the grid search picks on the other folds.
+    """
+    order = list(range(len(runs)))
+    random.Random(seed).shuffle(order)
+    folds = max(2, min(folds, len(runs)))
+    held_out_metrics = [None] * len(runs)
+    for fold in range(folds):
+        held_out = set(order[fold::folds])
+        (_, _, per_run), _ = grid_search(points, [i for i in range(len(runs)) if i not in held_out])
+        for i in held_out:
+            held_out_metrics[i] = per_run[i]
+    return mean_metrics(held_out_metrics), folds
+
+
+def tune(args):
+    with open(args.runs) as f:
+        runs = json.load(f)
+    if len(runs) < 2:
+        raise SystemExit("tune needs at least 2 labeled questions to cross-validate")
+
+    points = grid(runs)
+    (weights, k, _), fitted = grid_search(points, range(len(runs)))
+    validated, folds = cross_validate(points, runs, args.folds)
+    rows = [
+        ("service fusion", metrics([service_ranking(run) for run in runs], runs)),
+        ("rrf, default weights", metrics([rrf_ranking(run, DEFAULT_WEIGHTS, RRF_K) for run in runs], runs)),
+        (f"rrf, tuned ({folds}-fold)", validated),
+        ("rrf, tuned (fit)", fitted),
+    ]
+    print(f"{len(runs)} labeled questions, tuned rows: held-out folds, then the final weights "
+          f"on the questions they were tuned on")
+    print(f"{'ranker':<22}" + "".join(f"{name:>11}" for name in rows[0][1]))
+    for name, result in rows:
+        print(f"{name:<22}" + "".join(f"{value:>11.3f}" for value in result.values()))
+
+    for name in ("service", "rrf"):
+        seconds = [run["seconds"][name] for run in runs if name in run.get("seconds", {})]
+        if seconds:
+            print(f"{name} search latency: median {statistics.median(seconds):.2f}s, max {max(seconds):.2f}s")
+
+    print(f"tuned weights {weights}, k {k}")
+    if not args.dry_run:
+        with open(args.weights_file, "w") as f:
+            json.dump(
+                {"weights": weights, "k": k, "metrics": validated, "folds": folds, "fit_metrics": fitted,
+                 "questions": len(runs)},
+                f, indent=2,
+            )
+        print(f"wrote {args.weights_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    collect_parser = commands.add_parser("collect", help="run the labeled questions against the search service")
+    collect_parser.add_argument("--connection", required=True, help="connection name in connections.toml")
+    collect_parser.add_argument("--questions", required=True, help="labeled questions, JSONL")
+    collect_parser.add_argument("--out", default="rerank_runs.json")
+    collect_parser.add_argument("--service-limit", type=int, default=100, help="results of the fused query")
+    collect_parser.add_argument("--index-limit", type=int, default=50, help="results of each per-index query")
+    collect_parser.set_defaults(run=collect)
+
+    tune_parser = commands.add_parser("tune", help="evaluate the rankers and grid search the RRF weights")
+    tune_parser.add_argument("--runs", default="rerank_runs.json")
+    tune_parser.add_argument("--weights-file", default=WEIGHTS_FILE)
+    tune_parser.add_argument("--folds", type=int, default=5, help="cross-validation folds")
+    tune_parser.add_argument("--dry-run", action="store_true", help="only report, do not write the weights")
+    tune_parser.set_defaults(run=tune)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Offline visual data extraction for the Lab 3 page images
+
+The app's image critiques send every matched page image to claude-4-sonnet at question time, and
+most of that call is the same VISUAL_DATA_EXTRACTED work for a page whatever the question is.
+This driver does that extraction once per page, after the notebook has built PDF_IMAGES_JOINED,
+and stores the charts, tables and key figures of each page as JSON in PAGE_VISUAL_EXTRACTIONS,
+keyed by IMAGE_FILE_NAME and the MD5 of the image file in the stage:
+
+    1. list the page images of PDF_IMAGES_JOINED whose MD5 in DIRECTORY(@DOC_REPO) has no
+       extraction yet (new pages, or images re-rendered since the last run), or whose last
+       extraction was not valid JSON
+    2. extract them with one set-based AI_COMPLETE query per batch of --batch-size pages, at most
+       --max-concurrent batches running at a time
+    3. drop the extractions of pages no longer in PDF_IMAGES_JOINED
+
+The app validates its text answer against the stored extractions with a text-only call, and only
+sends the page image itself to the model for pages without an extraction or with a confidence
+below its threshold.
+
+Usage:
+    python visual_extraction.py --connection my_conn
+    python visual_extraction.py --connection my_conn --dry-run
+"""
+
+import argparse
+import time
+from textwrap import dedent
+
+from snowflake.snowpark import Session
+
+EXTRACTION_MODEL = "claude-4-sonnet"
+POLL_INTERVAL = 5  # seconds between checks of the running batches
+
+EXTRACTION_PROMPT = dedent("""
+    You are an expert visual analyst specializing in ICI Investment Company Fact Book financial charts,
+    tables, and infographics. Extract all data shown in the visual elements of this page image, so it
+    can be used later to validate answers to any question about the page.
+
+    For every table, chart or infographic on the page, extract:
+    - Its figure or table number ("Figure X.X") and title
+    - Its type (table, bar chart, pie chart, line graph, infographic)
+    - Units (billions, percentages, ...), time periods and geographic / fund type scope
+    - Every data value with its row / column, category or series label, exactly as printed
+    - Footnotes, symbols (*, †, ‡) and source lines
+
+    Respond with JSON only, no other text, in this format:
+    {
+      "page_type": "table | chart | infographic | mixed | text",
+      "figures": [
+        {
+          "figure": "Figure 2.1",
+          "title": "...",
+          "type": "...",
+          "units": "...",
+          "time_period": "...",
+          "scope": "...",
+          "data": [{"label": "...", "series": "...", "value": "..."}],
+          "footnotes": ["..."],
+          "source": "..."
+        }
+      ],
+      "key_figures": [{"label": "...", "value": "...", "time_period": "..."}],
+      "confidence": 0.0
+    }
+
+    "confidence" (0.0-1.0) is how certain you are that the extraction is complete and exact: lower it
+    for small print, dense or overlapping labels, values read from bar heights or slices without
+    printed numbers, and pages cut off or blurred.
+""").strip()
+
+
+class VisualExtractor:
+    """
+    Keeps PAGE_VISUAL_EXTRACTIONS in line with the page images of PDF_IMAGES_JOINED.
+    """
+
+    def __init__(self, session, schema="CORTEX_SEARCH_TUTORIAL_DB.PUBLIC", stage="DOC_REPO",
+                 batch_size=10, max_concurrent=4, dry_run=False):
+        self.session = session
+        self.schema = schema
+        self.stage = f"@{schema}.{stage}"
+        self.table = f"{schema}.PAGE_VISUAL_EXTRACTIONS"
+        self.batch_size = batch_size
+        self.max_concurrent = max_concurrent
+        self.dry_run = dry_run
+
+    def sql(self, query, params=None):
+        return self.session.sql(query, params=params)
+
+    def ensure_table(self):
+        self.sql(
+            f"CREATE TABLE IF NOT EXISTS {self.table} "
+            "(image_file_name VARCHAR, content_hash VARCHAR, model VARCHAR, extraction VARIANT, "
+            "confidence FLOAT, raw_result VARCHAR, extracted_at TIMESTAMP_LTZ)"
+        ).collect()
+
+    def plan(self):
+        """
+        Return the (image_file_name, md5) of pages to extract and the image file names of
+        extractions whose page is gone. A page whose stored result did not parse is extracted
+        again, although its MD5 is current.
+        """
+        pending = self.sql(
+            "SELECT p.image_file_name, d.md5 FROM "
+            f"(SELECT DISTINCT image_file_name FROM {self.schema}.PDF_IMAGES_JOINED) p "
+            f"JOIN DIRECTORY({self.stage}) d ON d.relative_path = p.image_file_name "
+            f"LEFT JOIN {self.table} e ON e.image_file_name = p.image_file_name AND e.content_hash = d.md5 "
+            "WHERE e.image_file_name IS NULL OR e.extraction IS NULL ORDER BY p.image_file_name"
+        ).collect()
+        removed = self.sql(
+            f"SELECT DISTINCT e.image_file_name FROM {self.table} e "
+            f"LEFT JOIN {self.schema}.PDF_IMAGES_JOINED p ON p.image_file_name = e.image_file_name "
+            "WHERE p.image_file_name IS NULL"
+        ).collect()
+        return [(r[0], r[1]) for r in pending], [r[0] for r in removed]
+
+    def extract_batch_async(self, pages):
+        """
+        Extract a batch of (image_file_name, md5) pages in one set-based query, replacing their
+        previous extractions. Returns the Snowpark async job.
+        """
+        return self.sql(
+            f"MERGE INTO {self.table} e USING ("
+            "SELECT image_file_name, content_hash, result, "
+            "TRY_PARSE_JSON(REGEXP_REPLACE(TRIM(result), '^```(json)?|```$', '')) AS extraction "
+            "FROM (SELECT column1 AS image_file_name, column2 AS content_hash, "
+            f"AI_COMPLETE('{EXTRACTION_MODEL}', ?, TO_FILE('{self.stage}', column1), "
+            "OBJECT_CONSTRUCT('temperature', 0, 'max_tokens', 4096)) AS result "
+            f"FROM VALUES {', '.join('(?, ?)' for _ in pages)})"
+            ") x ON e.image_file_name = x.image_file_name "
+            f"WHEN MATCHED THEN UPDATE SET content_hash = x.content_hash, model = '{EXTRACTION_MODEL}', "
+            "extraction = x.extraction, "
+            "confidence = TRY_TO_DOUBLE(x.extraction:confidence::VARCHAR), raw_result = x.result, "
+            "extracted_at = CURRENT_TIMESTAMP() "
+            "WHEN NOT MATCHED THEN INSERT "
+            "(image_file_name, content_hash, model, extraction, confidence, raw_result, extracted_at) "
+            f"VALUES (x.image_file_name, x.content_hash, '{EXTRACTION_MODEL}', x.extraction, "
+            "TRY_TO_DOUBLE(x.extraction:confidence::VARCHAR), x.result, CURRENT_TIMESTAMP())",
+            params=[EXTRACTION_PROMPT, *[value for page in pages for value in page]],
+        ).collect_nowait()
+
+    def delete(self, image_files):
+        self.sql(
+            f"DELETE FROM {self.table} WHERE image_file_name IN ({', '.join('?' for _ in image_files)})",
+            params=list(image_files),
+        ).collect()
+
+    def run(self):
+        self.ensure_table()
+        pending, removed = self.plan()
+        print(f"{len(pending)} pages to extract, {len(removed)} extractions of removed pages")
+        if self.dry_run:
+            for image_file, _ in pending:
+                print(f"  extract {image_file}")
+            for image_file in removed:
+                print(f"  delete {image_file}")
+            return
+
+        if removed:
+            self.delete(removed)
+
+        # Same queue as the notebook's embedding batches: at most max_concurrent async jobs
+        queued = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        running = []  # (pages, job, submitted at)
+        failed = 0
+        while queued or running:
+            while queued and len(running) < self.max_concurrent:
+                pages = queued.pop(0)
+                running.append((pages, self.extract_batch_async(pages), time.perf_counter()))
+
+            for entry in list(running):
+                pages, job, submitted = entry
+                if not job.is_done():
+                    continue
+                running.remove(entry)
+                try:
+                    job.result()
+                    print(f"  extracted {len(pages)} pages ({time.perf_counter() - submitted:.0f}s)")
+                except Exception as e:
+                    failed += len(pages)
+                    print(f"  failed {pages[0][0]} .. {pages[-1][0]}: {e}")
+
+            if running:
+                time.sleep(POLL_INTERVAL)
+
+        unparsed = self.sql(
+            f"SELECT COUNT(*) FROM {self.table} WHERE extraction IS NULL"
+        ).collect()[0][0]
+        print(f"done: {len(pending) - failed} pages extracted, {failed} failed, "
+              f"{unparsed} results without valid JSON (retried on the next run, the app critiques "
+              "those pages live until then)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connection", required=True, help="connection name in connections.toml")
+    parser.add_argument("--schema", default="CORTEX_SEARCH_TUTORIAL_DB.PUBLIC")
+    parser.add_argument("--stage", default="DOC_REPO")
+    parser.add_argument("--batch-size", type=int, default=10, help="pages per AI_COMPLETE query")
+    parser.add_argument("--max-concurrent", type=int, default=4, help="batches running at a time")
+    parser.add_argument("--dry-run", action="store_true", help="only list what would be extracted")
+    args = parser.parse_args()
+
+    session = Session.builder.config("connection_name", args.connection).create()
+    VisualExtractor(session, args.schema, args.stage, args.batch_size, args.max_concurrent, args.dry_run).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Micro-benchmark - SSE decoding in process_sse_response
+
+Replays agent SSE streams through process_sse_response, split into byte
+chunks the way a network read would deliver them. Reports MB/s and checks
+that no text, SQL or citations are lost. The previous line-based parser is
+replayed alongside for comparison.
+
+Without arguments a synthetic multi-megabyte stream is generated. It includes
+multi-line data frames, CRLF line endings, comments, 'done' events and
+list-shaped events. Recorded streams (raw bytes, e.g. from `curl -N ... > run.sse`)
+can be passed as arguments. They have no known expected output, so for them
+the new parser is compared with the legacy one.
+
+Usage:
+    uv run bench_sse_parser.py
+    uv run bench_sse_parser.py --size-mb 20 --chunk-size 1024
+    uv run bench_sse_parser.py recorded_run.sse
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("SNOWFLAKE_ACCOUNT_URL", "http://127.0.0.1")
+os.environ.setdefault("SNOWFLAKE_PAT", "bench")
+
+import cortex_agents as ca  # noqa: E402
+
+
+async def legacy_process_sse_response(resp):
+    """The line-based parser process_sse_response replaced, kept for comparison."""
+    text, sql, citations = "", "", []
+    async for raw_line in resp.aiter_lines():
+        if not raw_line:
+            continue
+        raw_line = raw_line.strip()
+        if not raw_line.startswith("data:"):
+            continue
+        payload = raw_line[len("data:"):].strip()
+        if payload in ("", "[DONE]"):
+            continue
+        try:
+            evt = json.loads(payload)
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(evt, dict):
+            continue
+        if "code" in evt and "message" in evt:
+            raise Exception(f"Snowflake API Error {evt.get('code')}: {evt.get('message')}")
+        delta = evt.get("delta") or evt.get("data", {}).get("delta")
+        if not isinstance(delta, dict):
+            continue
+        for item in delta.get("content", []):
+            t = item.get("type")
+            if t == "text":
+                text += item.get("text", "")
+            elif t == "tool_results":
+                for result in item["tool_results"].get("content", []):
+                    if result.get("type") == "json":
+                        j = result["json"]
+                        text += j.get("text", "")
+                        if "sql" in j:
+                            sql = j["sql"]
+                        for s in j.get("searchResults", []):
+                            citations.append({"source_id": s.get("source_id"), "doc_id": s.get("doc_id")})
+    return text, sql, citations
+
+
+def text_delta(text):
+    return {"delta": {"content": [{"type": "text", "text": text}]}}
+
+
+def synthetic_stream(size_mb, seed=7):
+    """Build a stream of roughly size_mb and the (text, sql, citations) it should decode to."""
+    rng = random.Random(seed)
+    words = ["asset", "allocation", "401(k)", "vesting", "€", "🚀", "fund", "net", "équité"]
+    frames, texts, citations = [], [], []
+    sql = ""
+    size = 0
+    i = 0
+    while size < size_mb * 1024 * 1024:
+        kind = i % 10
+        if kind == 9:
+            sql = f"SELECT {i} AS N FROM t"
+            cite = {"source_id": i, "doc_id": f"doc-{i}"}
+            citations.append(cite)
+            texts.append("")
+            evt = {"delta": {"content": [{"type": "tool_results", "tool_results": {"content": [
+                {"type": "json", "json": {"text": "", "sql": sql, "searchResults": [cite]}}]}}]}}
+            frame = f"event: message.delta\ndata: {json.dumps(evt)}\n\n"
+        else:
+            piece = " ".join(rng.choice(words) for _ in range(rng.randint(5, 40))) + " "
+            texts.append(piece)
+            evt = text_delta(piece)
+            if kind == 3:
+                # Pretty-printed JSON split over several data: lines
+                body = json.dumps(evt, indent=1)
+                frame = "event: message.delta\n" + "".join(f"data: {l}\n" for l in body.split("\n")) + "\n"
+            elif kind == 5:
+                frame = f"event: message.delta\r\ndata: {json.dumps(evt)}\r\n\r\n"
+            elif kind == 7:
+                # Two events in one list-shaped frame
+                half = len(piece) // 2
+                texts[-1] = piece[:half]
+                texts.append(piece[half:])
+                frame = f"data: {json.dumps([text_delta(piece[:half]), text_delta(piece[half:])])}\n\n"
+            else:
+                frame = f": keep-alive\nevent: message.delta\ndata: {json.dumps(evt)}\n\n"
+        frames.append(frame)
+        size += len(frame)
+        i += 1
+    frames.append("event: done\ndata: [DONE]\n\n")
+    return "".join(frames).encode("utf-8"), ("".join(texts), sql, citations)
+
+
+def response(data, chunk_size, seed=11):
+    rng = random.Random(seed)
+
+    async def chunks():
+        pos = 0
+        while pos < len(data):
+            step = rng.randint(1, chunk_size)
+            yield data[pos:pos + step]
+            pos += step
+
+    return httpx.Response(200, content=chunks())
+
+
+async def timed(parser, data, chunk_size, repeat):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        resp = response(data, chunk_size)
+        start = time.perf_counter()
+        result = await parser(resp)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def report(label, data, elapsed, result, expected):
+    text, sql, citations = result
+    mb = len(data) / (1024 * 1024)
+    line = f"  {label:<8} {mb / elapsed:8.1f} MB/s  text={len(text):>9} chars  citations={len(citations):>6}"
+    if expected is not None:
+        lost = len(expected[0]) - len(text)
+        ok = (text, sql, citations) == expected
+        line += f"  {'OK' if ok else 'MISMATCH'} ({lost} chars lost)"
+    print(line)
+
+
+async def main_async(args):
+    streams = []
+    if args.streams:
+        for path in args.streams:
+            with open(path, "rb") as f:
+                streams.append((path, f.read(), None))
+    else:
+        data, expected = synthetic_stream(args.size_mb)
+        streams.append((f"synthetic {args.size_mb} MB", data, expected))
+
+    for name, data, expected in streams:
+        print(f"{name}: {len(data) / (1024 * 1024):.1f} MB, chunks up to {args.chunk_size} bytes")
+        elapsed, result = await timed(ca.process_sse_response, data, args.chunk_size, args.repeat)
+        report("decoder", data, elapsed, result, expected)
+        elapsed, legacy = await timed(legacy_process_sse_response, data, args.chunk_size, args.repeat)
+        report("legacy", data, elapsed, legacy, expected)
+        if expected is None and legacy[0] != result[0]:
+            print(f"  legacy parser dropped {len(result[0]) - len(legacy[0])} chars of text")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("streams", nargs="*", help="recorded raw SSE streams to replay")
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--chunk-size", type=int, default=4096, help="max bytes per network read")
+    parser.add_argument("--repeat", type=int, default=3)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
-from typing import Any, Dict, Tuple, List, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Tuple, List, NamedTuple, Optional
 import httpx
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import Context, FastMCP
 import os
 import json
 import uuid
+import importlib.util
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import asyncio
 
@@ -11,9 +13,6 @@ import asyncio
 env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
 load_dotenv(env_path)
 
-# Initialize FastMCP server
-mcp = FastMCP("cortex_agent")
-
 # Constants
 SEMANTIC_MODEL_FILE = os.getenv("SEMANTIC_MODEL_FILE")
 CORTEX_SEARCH_SERVICE = os.getenv("CORTEX_SEARCH_SERVICE")
@@ -32,95 +31,407 @@ API_HEADERS = {
     "Content-Type": "application/json",
 }
 
-async def process_sse_response(resp: httpx.Response) -> Tuple[str, str, List[Dict]]:
+# Shared HTTP client settings (all optional)
+HTTP2_ENABLED = os.getenv("CORTEX_HTTP2", "true").lower() in ("1", "true", "yes")
+MAX_CONNECTIONS = int(os.getenv("CORTEX_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("CORTEX_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("CORTEX_KEEPALIVE_EXPIRY", "30"))
+CONNECT_TIMEOUT = float(os.getenv("CORTEX_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("CORTEX_READ_TIMEOUT", "60"))
+
+# SQL API result handling
+SQL_MAX_ROWS = int(os.getenv("CORTEX_SQL_MAX_ROWS", "10000"))
+SQL_PARTITION_CONCURRENCY = int(os.getenv("CORTEX_SQL_PARTITION_CONCURRENCY", "4"))
+SQL_POLL_TIMEOUT = float(os.getenv("CORTEX_SQL_POLL_TIMEOUT", "120"))
+
+# Forward agent deltas to the MCP host as progress notifications while the run streams
+STREAM_PROGRESS = os.getenv("CORTEX_STREAM_PROGRESS", "true").lower() in ("1", "true", "yes")
+
+# Called as on_event(kind, value) for each "text", "tool_result", "sql" and "citation" event
+EventCallback = Callable[[str, Any], Awaitable[None]]
+
+# One pooled client for the whole server process, opened and closed by the lifespan below
+_http_client: Optional[httpx.AsyncClient] = None
+
+def create_http_client() -> httpx.AsyncClient:
+    """Build the pooled client. HTTP/2 is only used when the h2 package is installed."""
+    http2 = HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+    return httpx.AsyncClient(
+        http2=http2,
+        headers=API_HEADERS,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        # read/write/pool use READ_TIMEOUT, connect gets its own shorter limit
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+    )
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it if the server lifespan has not run (e.g. in scripts)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = create_http_client()
+    return _http_client
+
+@asynccontextmanager
+async def http_client_lifespan(server: FastMCP) -> AsyncIterator[Dict[str, Any]]:
+    """Open the shared HTTP client at server startup and close it at shutdown."""
+    global _http_client
+    _http_client = create_http_client()
+    try:
+        yield {}
+    finally:
+        await _http_client.aclose()
+        _http_client = None
+
+# Initialize FastMCP server
+mcp = FastMCP("cortex_agent", lifespan=http_client_lifespan)
+
+class SSEEvent(NamedTuple):
+    event: str
+    data: str
+    id: str
+
+
+class SSEDecoder:
     """
-    Process SSE stream lines, extracting any 'delta' payloads,
-    regardless of whether the JSON contains an 'event' field.
+    Incremental Server-Sent Events decoder.
+
+    Feed it raw byte chunks in any split (e.g. from resp.aiter_bytes()) and it
+    returns complete events as they are reassembled, following the
+    text/event-stream rules: CRLF, LF or CR line endings, multi-line 'data:'
+    fields joined with newlines, 'event:'/'id:' fields and ':' comments.
     """
-    text, sql, citations = "", "", []
-    async for raw_line in resp.aiter_lines():
-        if not raw_line:
-            continue
-        raw_line = raw_line.strip()
-        # only handle data lines
-        if not raw_line.startswith("data:"):
-            continue
-        payload = raw_line[len("data:") :].strip()
-        if payload in ("", "[DONE]"):
-            continue
-        try:
-            evt = json.loads(payload)
-        except json.JSONDecodeError:
-            continue
-        
-        # Handle case where evt might be a list instead of dict
-        if isinstance(evt, list):
-            # If it's a list, skip or try to process each item
-            continue
-        elif not isinstance(evt, dict):
-            continue
-            
+
+    def __init__(self) -> None:
+        self._buffer = b""
+        self._event = ""
+        self._data: List[str] = []
+        self._last_id = ""
+        self._started = False
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """Consume a chunk of bytes and return the events it completed."""
+        data = self._buffer + chunk
+        # A trailing CR may be the first half of a CRLF split across chunks
+        held = b""
+        if data.endswith(b"\r"):
+            data, held = data[:-1], b"\r"
+        if b"\r" in data:
+            data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+        lines = data.split(b"\n")
+        self._buffer = lines.pop() + held
+
+        events = []
+        for line in lines:
+            event = self._process_line(line)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def flush(self) -> List[SSEEvent]:
+        """
+        End of stream: process an unterminated last line and dispatch any
+        pending event. The spec drops an event with no closing blank line,
+        but servers often omit it, so it is kept instead.
+        """
+        events = []
+        if self._buffer:
+            for line in self._buffer.replace(b"\r", b"\n").split(b"\n"):
+                if line:
+                    self._process_line(line)
+            self._buffer = b""
+        event = self._dispatch()
+        if event is not None:
+            events.append(event)
+        return events
+
+    def _process_line(self, raw: bytes) -> Optional[SSEEvent]:
+        if not self._started:
+            self._started = True
+            if raw.startswith(b"\xef\xbb\xbf"):
+                raw = raw[3:]
+        if not raw:
+            return self._dispatch()
+        if raw.startswith(b"data: "):
+            # Fast path for the most common line
+            self._data.append(raw[6:].decode("utf-8", errors="replace"))
+            return None
+        if raw.startswith(b":"):
+            return None  # comment / keep-alive
+
+        field, sep, value = raw.partition(b":")
+        if sep and value.startswith(b" "):
+            value = value[1:]
+
+        if field == b"data":
+            self._data.append(value.decode("utf-8", errors="replace"))
+        elif field == b"event":
+            self._event = value.decode("utf-8", errors="replace")
+        elif field == b"id":
+            if b"\x00" not in value:
+                self._last_id = value.decode("utf-8", errors="replace")
+        # 'retry' and unknown fields are ignored
+        return None
+
+    def _dispatch(self) -> Optional[SSEEvent]:
+        if not self._data:
+            self._event = ""
+            return None
+        event = SSEEvent(self._event or "message", "\n".join(self._data), self._last_id)
+        self._event = ""
+        self._data = []
+        return event
+
+
+# SSE event types whose payloads we decode. Anything else (e.g. 'done') is skipped
+# without parsing its JSON. 'message' is the type of frames with no 'event:' line.
+CONSUMED_EVENTS = frozenset({"message", "message.delta", "error"})
+
+
+async def process_sse_response(
+    resp: httpx.Response, on_event: Optional[EventCallback] = None
+) -> Tuple[str, str, List[Dict]]:
+    """
+    Decode the agent SSE stream and extract the 'delta' payloads, whether
+    they are top-level or nested under 'data', and whether a frame holds one
+    event object or a list of them.
+
+    If on_event is given it is awaited for every text delta, tool result,
+    SQL statement and citation as soon as it arrives.
+    """
+    text_chunks, citations = [], []
+    sql = ""
+
+    async def emit(kind: str, value: Any) -> None:
+        if on_event is not None:
+            await on_event(kind, value)
+
+    async def handle(evt: Dict[str, Any]) -> None:
+        nonlocal sql
         # Check for error events first
         if "code" in evt and "message" in evt:
             error_msg = f"Snowflake API Error {evt.get('code')}: {evt.get('message')}"
             raise Exception(error_msg)
-            
+
         # Grab the 'delta' section, whether top-level or nested in 'data'
-        delta = evt.get("delta") or evt.get("data", {}).get("delta")
+        nested = evt.get("data")
+        delta = evt.get("delta") or (nested.get("delta") if isinstance(nested, dict) else None)
         if not isinstance(delta, dict):
-            continue
+            return
         for item in delta.get("content", []):
             t = item.get("type")
             if t == "text":
-                text += item.get("text", "")
+                chunk = item.get("text", "")
+                text_chunks.append(chunk)
+                await emit("text", chunk)
             elif t == "tool_results":
                 for result in item["tool_results"].get("content", []):
                     if result.get("type") == "json":
                         j = result["json"]
-                        text += j.get("text", "")
+                        text_chunks.append(j.get("text", ""))
+                        await emit("tool_result", j)
                         # capture SQL if present
                         if "sql" in j:
                             sql = j["sql"]
+                            await emit("sql", sql)
                         # capture any citations
                         for s in j.get("searchResults", []):
-                            citations.append({
+                            citation = {
                                 "source_id": s.get("source_id"),
                                 "doc_id": s.get("doc_id"),
-                            })
-    return text, sql, citations
+                            }
+                            citations.append(citation)
+                            await emit("citation", citation)
 
-async def execute_sql(sql: str) -> Dict[str, Any]:
+    async def handle_frame(frame: SSEEvent) -> None:
+        if frame.event not in CONSUMED_EVENTS:
+            return
+        payload = frame.data.strip()
+        if payload in ("", "[DONE]"):
+            return
+        try:
+            evt = json.loads(payload)
+        except json.JSONDecodeError:
+            return
+        for item in evt if isinstance(evt, list) else [evt]:
+            if isinstance(item, dict):
+                await handle(item)
+
+    decoder = SSEDecoder()
+    async for chunk in resp.aiter_bytes():
+        for frame in decoder.feed(chunk):
+            await handle_frame(frame)
+    for frame in decoder.flush():
+        await handle_frame(frame)
+
+    return "".join(text_chunks), sql, citations
+
+def progress_reporter(ctx: Optional[Context]) -> Optional[EventCallback]:
+    """
+    Build an on_event callback that sends each agent event to the MCP host
+    as a progress notification. Returns None when there is no request context
+    or streaming is turned off.
+    """
+    if ctx is None or not STREAM_PROGRESS:
+        return None
+
+    step = 0
+
+    async def report(kind: str, value: Any) -> None:
+        nonlocal step
+        step += 1
+        if kind == "text":
+            message = value
+        elif kind == "sql":
+            message = f"[sql] {value}"
+        elif kind == "citation":
+            message = f"[citation] {json.dumps(value)}"
+        else:
+            message = f"[{kind}] {json.dumps(value, default=str)[:1000]}"
+        await ctx.report_progress(progress=step, message=message)
+
+    return report
+
+class SQLAPIError(Exception):
+    """Raised when the SQL API rejects a statement or a result partition request."""
+
+
+def _sql_api_error(resp: httpx.Response) -> SQLAPIError:
+    try:
+        body = resp.json()
+        detail = f"{body.get('code')}: {body.get('message')}"
+    except ValueError:
+        detail = resp.text
+    return SQLAPIError(f"SQL API error (HTTP {resp.status_code}) {detail}")
+
+
+async def run_statement(sql: str) -> Dict[str, Any]:
+    """
+    Submit a statement to the SQL API and wait for it to finish.
+
+    A 202 response means the statement is still running; its status URL is
+    polled with exponential backoff until the result is ready. Returns the
+    final response body: metadata plus the rows of partition 0.
+    """
+    client = get_http_client()
+    sql_api_url = f"{SNOWFLAKE_ACCOUNT_URL}/api/v2/statements"
+    sql_payload = {
+        "statement": sql.replace(";", ""),
+        "timeout": 60  # 60 second timeout
+    }
+    resp = await client.post(sql_api_url, json=sql_payload, params={"requestId": str(uuid.uuid4())})
+
+    delay = 0.2
+    deadline = asyncio.get_running_loop().time() + SQL_POLL_TIMEOUT
+    while resp.status_code == 202:
+        handle = resp.json().get("statementHandle")
+        if asyncio.get_running_loop().time() + delay > deadline:
+            raise SQLAPIError(f"Statement {handle} still running after {SQL_POLL_TIMEOUT:.0f}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 5.0)
+        resp = await client.get(f"{sql_api_url}/{handle}")
+
+    if resp.status_code != 200:
+        raise _sql_api_error(resp)
+    return resp.json()
+
+
+async def iter_result_rows(first: Dict[str, Any], max_rows: Optional[int] = None) -> AsyncIterator[List[Any]]:
+    """
+    Yield every row of a finished statement in order, up to max_rows.
+
+    Partition 0 is already in `first`. The remaining partitions listed in
+    resultSetMetaData.partitionInfo are fetched concurrently, at most
+    SQL_PARTITION_CONCURRENCY at a time. Only that many partitions are held
+    in memory, and fetching stops once max_rows rows have been yielded.
+    """
+    meta = first.get("resultSetMetaData", {})
+    partitions = meta.get("partitionInfo") or [{}]
+    handle = first.get("statementHandle")
+    remaining = max_rows
+
+    # Only fetch the partitions needed to reach max_rows
+    needed = len(partitions)
+    if max_rows is not None:
+        rows_seen = 0
+        for i, info in enumerate(partitions):
+            rows_seen += info.get("rowCount", 0)
+            if rows_seen >= max_rows:
+                needed = i + 1
+                break
+
+    for row in first.get("data") or []:
+        if remaining is not None and remaining <= 0:
+            return
+        yield row
+        if remaining is not None:
+            remaining -= 1
+    if needed <= 1 or not handle:
+        return
+
+    client = get_http_client()
+    semaphore = asyncio.Semaphore(SQL_PARTITION_CONCURRENCY)
+    url = f"{SNOWFLAKE_ACCOUNT_URL}/api/v2/statements/{handle}"
+
+    async def fetch(partition: int) -> List[List[Any]]:
+        async with semaphore:
+            resp = await client.get(url, params={"partition": partition})
+            if resp.status_code != 200:
+                raise _sql_api_error(resp)
+            return resp.json().get("data") or []
+
+    # Keep a window of partitions in flight and consume them in order
+    window = SQL_PARTITION_CONCURRENCY
+    tasks: Dict[int, asyncio.Task] = {}
+    try:
+        for partition in range(1, min(needed, 1 + window)):
+            tasks[partition] = asyncio.create_task(fetch(partition))
+        for partition in range(1, needed):
+            rows = await tasks.pop(partition)
+            upcoming = partition + window
+            if upcoming < needed:
+                tasks[upcoming] = asyncio.create_task(fetch(upcoming))
+            for row in rows:
+                if remaining is not None and remaining <= 0:
+                    return
+                yield row
+                if remaining is not None:
+                    remaining -= 1
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+
+async def iter_sql_rows(sql: str, max_rows: Optional[int] = None) -> AsyncIterator[List[Any]]:
+    """Run a statement and stream its rows as they are fetched, up to max_rows."""
+    first = await run_statement(sql)
+    async for row in iter_result_rows(first, max_rows):
+        yield row
+
+
+async def execute_sql(sql: str, max_rows: Optional[int] = SQL_MAX_ROWS) -> Dict[str, Any]:
     """Execute SQL using the Snowflake SQL API.
     
     Args:
         sql: The SQL query to execute
+        max_rows: Cap on the rows collected from all result partitions (None for no cap)
         
     Returns:
-        Dict containing either the query results or an error message
+        Dict containing either the query results or an error message. 'data'
+        holds the rows of every partition, and 'truncated' is True when
+        max_rows cut the result short.
     """
     try:
-        # Generate a unique request ID
-        request_id = str(uuid.uuid4())
-        
-        # Prepare the SQL API request
-        sql_api_url = f"{SNOWFLAKE_ACCOUNT_URL}/api/v2/statements"
-        sql_payload = {
-            "statement": sql.replace(";", ""),
-            "timeout": 60  # 60 second timeout
-        }
-        
-        async with httpx.AsyncClient() as client:
-            sql_response = await client.post(
-                sql_api_url,
-                json=sql_payload,
-                headers=API_HEADERS,
-                params={"requestId": request_id}
-            )
-            
-            if sql_response.status_code == 200:
-                return sql_response.json()
-            else:
-                return {"error": f"SQL API error: {sql_response.text}"}
+        first = await run_statement(sql)
+        rows = [row async for row in iter_result_rows(first, max_rows)]
+        total = first.get("resultSetMetaData", {}).get("numRows", len(rows))
+        return {**first, "data": rows, "truncated": len(rows) < total}
+    except SQLAPIError as e:
+        return {"error": str(e)}
     except Exception as e:
         return {"error": f"SQL execution error: {e}"}
 
@@ -128,8 +439,9 @@ import uuid
 import httpx
 
 @mcp.tool()
-async def run_cortex_agents(query: str) -> Dict[str, Any]:
+async def run_cortex_agents(query: str, ctx: Context = None) -> Dict[str, Any]:
     """Run the Cortex agent with the given query, streaming SSE."""
+    on_event = progress_reporter(ctx)
     try:
         # Build your payload exactly as before
         payload = {
@@ -155,27 +467,27 @@ async def run_cortex_agents(query: str) -> Dict[str, Any]:
         request_id = str(uuid.uuid4())
 
         url = f"{SNOWFLAKE_ACCOUNT_URL}/api/v2/cortex/agent:run"
-        # Copy your API headers and add the SSE Accept
-        headers = {
-            **API_HEADERS,
-            "Accept": "text/event-stream",
-        }
+        # The shared client already sends API_HEADERS; add the SSE Accept
+        headers = {"Accept": "text/event-stream"}
 
-        # 1) Open a streaming POST
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            async with client.stream(
-                "POST",
-                url,
-                json=payload,
-                headers=headers,
-                params={"requestId": request_id},   # SQL API needs this, Cortex agent may ignore it
-            ) as resp:
-                resp.raise_for_status()
-                # 2) Now resp.aiter_lines() will yield each "data: …" chunk
-                text, sql, citations = await process_sse_response(resp)
+        # 1) Open a streaming POST on the pooled connection
+        client = get_http_client()
+        async with client.stream(
+            "POST",
+            url,
+            json=payload,
+            headers=headers,
+            params={"requestId": request_id},   # SQL API needs this, Cortex agent may ignore it
+        ) as resp:
+            resp.raise_for_status()
+            # 2) process_sse_response decodes resp.aiter_bytes() into SSE frames with SSEDecoder
+            text, sql, citations = await process_sse_response(resp, on_event)
 
         # 3) If SQL was generated, execute it
         results = await execute_sql(sql) if sql else None
+        if results is not None and on_event is not None:
+            await on_event("sql_results", {"error": results["error"]} if "error" in results
+                           else {"numRows": results.get("resultSetMetaData", {}).get("numRows")})
 
         # Provide informative response when no content is found
         if not text and not citations and not sql:
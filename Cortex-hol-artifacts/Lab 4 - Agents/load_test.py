@@ -0,0 +1,174 @@
+"""
+Load test for the MCP server against the local ASGI stub in stub_snowflake_api.py
+
+Scenario "agents" (default) runs run_cortex_agents concurrently, as an MCP
+host firing parallel tool calls would. It reports latency percentiles,
+throughput and connections opened for:
+
+    per-call  - the old path: a new httpx.AsyncClient for agent:run and another for statements
+    pooled    - the shared client from cortex_agents.get_http_client()
+
+Scenario "sql" drives execute_sql / iter_sql_rows against a fake SQL API
+that answers 202 for a few polls and splits the result into partitions. It
+checks that every row comes back in order, that the row cap stops partition
+fetches early, and that partition fetches stay within the concurrency bound.
+
+Usage:
+    uv run load_test.py
+    uv run load_test.py --calls 500 --concurrency 50 --agent-latency 0.2
+    uv run load_test.py sql --sql-rows 200000 --partition-rows 5000 --pending-polls 3
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+import uuid
+
+from stub_snowflake_api import StubSnowflakeAPI, serve_in_thread, server_url
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def drive(label, call, calls, concurrency, stub):
+    stub.connections.clear()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await call(f"question {i}")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    elapsed = time.perf_counter() - start
+
+    ms = [l * 1000 for l in latencies]
+    print(f"{label:<9} p50 {percentile(ms, 50):7.1f}ms  p95 {percentile(ms, 95):7.1f}ms  "
+          f"p99 {percentile(ms, 99):7.1f}ms  max {max(ms):7.1f}ms  "
+          f"mean {statistics.mean(ms):7.1f}ms  {calls / elapsed:7.1f} calls/s  "
+          f"{len(stub.connections):5d} connections")
+
+
+def load_server_module():
+    import cortex_agents as ca
+
+    # FastMCP turns on INFO logging at import; keep httpx's per-request lines out of the report
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    return ca
+
+
+async def sql_scenario(args, stub):
+    ca = load_server_module()
+    expected = [[str(i)] for i in range(args.sql_rows)]
+    partitions = len(stub.partition_bounds())
+
+    async with ca.http_client_lifespan(ca.mcp):
+        start = time.perf_counter()
+        result = await ca.execute_sql("select * from big_table", max_rows=None)
+        elapsed = time.perf_counter() - start
+        assert "error" not in result, result
+        assert result["data"] == expected, "rows missing or out of order"
+        assert not result["truncated"]
+        print(f"full fetch    {len(result['data']):>8} rows  {partitions:>5} partitions  {elapsed * 1000:8.1f}ms  "
+              f"max in flight {stub.max_partitions_in_flight} (limit {ca.SQL_PARTITION_CONCURRENCY})")
+        assert stub.max_partitions_in_flight <= ca.SQL_PARTITION_CONCURRENCY
+
+        cap = min(args.max_rows, args.sql_rows)
+        stub.partition_fetches = 0
+        start = time.perf_counter()
+        result = await ca.execute_sql("select * from big_table", max_rows=cap)
+        elapsed = time.perf_counter() - start
+        assert result["data"] == expected[:cap]
+        assert result["truncated"] == (cap < args.sql_rows)
+        print(f"capped fetch  {len(result['data']):>8} rows  {stub.partition_fetches + 1:>5} partitions  "
+              f"{elapsed * 1000:8.1f}ms  truncated={result['truncated']}")
+
+        start = time.perf_counter()
+        first_row_at, count = None, 0
+        async for row in ca.iter_sql_rows("select * from big_table"):
+            if first_row_at is None:
+                first_row_at = time.perf_counter() - start
+            count += 1
+        assert count == args.sql_rows
+        print(f"streamed      {count:>8} rows  first row after {first_row_at * 1000:.1f}ms, "
+              f"all after {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+async def main_async(args, stub):
+    ca = load_server_module()
+    import httpx
+
+    async def per_call(query):
+        # Mirrors the original run_cortex_agents + execute_sql client handling
+        url = f"{ca.SNOWFLAKE_ACCOUNT_URL}/api/v2/cortex/agent:run"
+        headers = {**ca.API_HEADERS, "Accept": "text/event-stream"}
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            async with client.stream("POST", url, json={"query": query}, headers=headers,
+                                     params={"requestId": str(uuid.uuid4())}) as resp:
+                resp.raise_for_status()
+                text, sql, citations = await ca.process_sse_response(resp)
+        async with httpx.AsyncClient() as client:
+            await client.post(f"{ca.SNOWFLAKE_ACCOUNT_URL}/api/v2/statements",
+                              json={"statement": sql, "timeout": 60}, headers=ca.API_HEADERS,
+                              params={"requestId": str(uuid.uuid4())})
+
+    async def pooled(query):
+        result = await ca.run_cortex_agents(query)
+        if "error" in result:
+            raise RuntimeError(result["error"])
+
+    await drive("per-call", per_call, args.calls, args.concurrency, stub)
+    async with ca.http_client_lifespan(ca.mcp):
+        await drive("pooled", pooled, args.calls, args.concurrency, stub)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", nargs="?", choices=["agents", "sql"], default="agents")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--agent-latency", type=float, default=0.05,
+                        help="seconds the stub takes to stream one agent answer")
+    parser.add_argument("--sql-latency", type=float, default=0.02)
+    parser.add_argument("--sql-rows", type=int, default=50000, help="sql scenario: rows in the result")
+    parser.add_argument("--partition-rows", type=int, default=1000, help="sql scenario: rows per partition")
+    parser.add_argument("--pending-polls", type=int, default=2, help="sql scenario: 202 answers before the result")
+    parser.add_argument("--max-rows", type=int, default=2500, help="sql scenario: row cap for the capped fetch")
+    args = parser.parse_args()
+
+    if args.scenario == "sql":
+        stub = StubSnowflakeAPI(sql_latency=args.sql_latency, sql_rows=args.sql_rows,
+                                partition_rows=args.partition_rows, pending_polls=args.pending_polls)
+    else:
+        stub = StubSnowflakeAPI(agent_latency=args.agent_latency, sql_latency=args.sql_latency)
+    server = serve_in_thread(stub)
+
+    # cortex_agents reads these at import time
+    os.environ["SNOWFLAKE_ACCOUNT_URL"] = server_url(server)
+    os.environ["SNOWFLAKE_PAT"] = "stub-pat"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    if args.scenario == "sql":
+        print(f"Fake SQL API at {os.environ['SNOWFLAKE_ACCOUNT_URL']}: {args.sql_rows} rows, "
+              f"{args.partition_rows} per partition, {args.pending_polls} pending polls\n")
+        asyncio.run(sql_scenario(args, stub))
+    else:
+        print(f"Stub at {os.environ['SNOWFLAKE_ACCOUNT_URL']}: {args.calls} calls, "
+              f"concurrency {args.concurrency}")
+        print("Note: the stub is plain HTTP, so TLS handshake savings are not included\n")
+        asyncio.run(main_async(args, stub))
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
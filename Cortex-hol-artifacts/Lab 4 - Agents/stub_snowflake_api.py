@@ -0,0 +1,201 @@
+"""
+Local ASGI stub of the two Snowflake REST endpoints the MCP server calls:
+
+    POST /api/v2/cortex/agent:run           - SSE stream of message.delta events
+    POST /api/v2/statements                 - SQL API submit (200, or 202 while "running")
+    GET  /api/v2/statements/{handle}        - SQL API status poll / partition 0
+    GET  /api/v2/statements/{handle}?partition=N - further result partitions
+
+Used by load_test.py so the server can be exercised without an account.
+Serve it with uvicorn (installed with mcp[cli]):
+
+    uvicorn stub_snowflake_api:app --port 8765
+"""
+
+import asyncio
+import itertools
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+
+import uvicorn
+
+
+class StubSnowflakeAPI:
+    """Minimal ASGI app that replays canned Cortex agent and SQL API responses."""
+
+    def __init__(self, agent_latency: float = 0.05, sql_latency: float = 0.02,
+                 text_chunks: int = 20, sql: str = "SELECT 1 AS ONE",
+                 sql_rows: int = 1, partition_rows: Optional[int] = None,
+                 pending_polls: int = 0, partition_latency: float = 0.01):
+        self.agent_latency = agent_latency
+        self.sql_latency = sql_latency
+        self.text_chunks = text_chunks
+        self.sql = sql
+        # SQL API result shape: sql_rows rows split into partitions of
+        # partition_rows, after answering 202 to the first pending_polls polls
+        self.sql_rows = sql_rows
+        self.partition_rows = partition_rows or max(sql_rows, 1)
+        self.pending_polls = pending_polls
+        self.partition_latency = partition_latency
+        self._handles = itertools.count(1)
+        self._polls_left: Dict[str, int] = {}
+        self.partition_fetches = 0
+        self.partitions_in_flight = 0
+        self.max_partitions_in_flight = 0
+        # (host, port) of every client connection seen, i.e. connections opened
+        self.connections = set()
+        self.requests = 0
+
+    def agent_events(self) -> List[Dict[str, Any]]:
+        events = [
+            {"event": "message.delta",
+             "data": {"delta": {"content": [{"type": "text", "text": f"chunk {i} "}]}}}
+            for i in range(self.text_chunks)
+        ]
+        events.append({"event": "message.delta", "data": {"delta": {"content": [{
+            "type": "tool_results",
+            "tool_results": {"content": [{"type": "json", "json": {
+                "text": "",
+                "sql": self.sql,
+                "searchResults": [{"source_id": 1, "doc_id": "doc-1"}],
+            }}]},
+        }]}}})
+        return events
+
+    def partition_bounds(self) -> List[range]:
+        return [range(start, min(start + self.partition_rows, self.sql_rows))
+                for start in range(0, max(self.sql_rows, 1), self.partition_rows)]
+
+    def sql_result(self, handle: str = "stub-handle") -> Dict[str, Any]:
+        bounds = self.partition_bounds()
+        return {
+            "code": "090001",
+            "message": "Statement executed successfully.",
+            "statementHandle": handle,
+            "resultSetMetaData": {
+                "numRows": self.sql_rows,
+                "format": "jsonv2",
+                "rowType": [{"name": "ONE", "type": "fixed"}],
+                "partitionInfo": [{"rowCount": len(r)} for r in bounds],
+            },
+            "data": [[str(i)] for i in bounds[0]],
+        }
+
+    def sql_pending(self, handle: str) -> Dict[str, Any]:
+        return {
+            "code": "333334",
+            "message": "Asynchronous execution in progress.",
+            "statementHandle": handle,
+            "statementStatusUrl": f"/api/v2/statements/{handle}",
+        }
+
+    async def sql_submit(self, send):
+        await asyncio.sleep(self.sql_latency)
+        handle = f"stub-handle-{next(self._handles)}"
+        if self.pending_polls:
+            self._polls_left[handle] = self.pending_polls
+            await self.send_json(send, 202, self.sql_pending(handle))
+        else:
+            await self.send_json(send, 200, self.sql_result(handle))
+
+    async def sql_status(self, send, handle: str, partition: int):
+        if self._polls_left.get(handle):
+            self._polls_left[handle] -= 1
+            await self.send_json(send, 202, self.sql_pending(handle))
+            return
+        if partition == 0:
+            await self.send_json(send, 200, self.sql_result(handle))
+            return
+
+        bounds = self.partition_bounds()
+        if partition >= len(bounds):
+            await self.send_json(send, 422, {"code": "000605", "message": f"no partition {partition}"})
+            return
+        self.partition_fetches += 1
+        self.partitions_in_flight += 1
+        self.max_partitions_in_flight = max(self.max_partitions_in_flight, self.partitions_in_flight)
+        try:
+            await asyncio.sleep(self.partition_latency)
+        finally:
+            self.partitions_in_flight -= 1
+        await self.send_json(send, 200, {"data": [[str(i)] for i in bounds[partition]]})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        self.requests += 1
+        if scope.get("client"):
+            self.connections.add(tuple(scope["client"]))
+
+        # Drain the request body
+        more_body = True
+        while more_body:
+            message = await receive()
+            more_body = message.get("more_body", False)
+
+        path = scope["path"]
+        query = parse_qs(scope.get("query_string", b"").decode())
+        if path.endswith("/cortex/agent:run"):
+            await self.stream_agent(send)
+        elif path.endswith("/statements"):
+            await self.sql_submit(send)
+        elif "/statements/" in path:
+            handle = path.rsplit("/", 1)[-1]
+            await self.sql_status(send, handle, int(query.get("partition", ["0"])[0]))
+        else:
+            await self.send_json(send, 404, {"message": f"no stub for {path}"})
+
+    async def stream_agent(self, send):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream")],
+        })
+        events = self.agent_events()
+        delay = self.agent_latency / max(len(events), 1)
+        for evt in events:
+            await asyncio.sleep(delay)
+            frame = f"event: {evt['event']}\ndata: {json.dumps(evt['data'])}\n\n"
+            await send({"type": "http.response.body", "body": frame.encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b"event: done\ndata: [DONE]\n\n"})
+
+    @staticmethod
+    async def send_json(send, status: int, body: Any):
+        data = json.dumps(body).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"),
+                        (b"content-length", str(len(data)).encode())],
+        })
+        await send({"type": "http.response.body", "body": data})
+
+
+app = StubSnowflakeAPI()
+
+
+def serve_in_thread(stub: Optional[StubSnowflakeAPI] = None, port: int = 0) -> uvicorn.Server:
+    """Start uvicorn for `stub` on a background thread and wait until it accepts connections."""
+    config = uvicorn.Config(stub or app, host="127.0.0.1", port=port,
+                            log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+def server_url(server: uvicorn.Server) -> str:
+    sock = server.servers[0].sockets[0]
+    host, port = sock.getsockname()[:2]
+    return f"http://{host}:{port}"